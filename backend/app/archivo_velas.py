@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .coincidencias import a_segundos
+from .config import ajustes
+from .models import Vela
+from .utils_time import seg_a_utc_naive, utc_naive_a_seg
+
+log = logging.getLogger(__name__)
+
+# Archivo por (mercado, intervalo), little-endian:
+#   cabecera: magia, versión, bytes por delta (1|2|4), paso, t0, t_último, n
+#   n deltas de fin_ts en unidades de paso segundos (el primero 0, relativo a t0); paso es el
+#   mcd de los deltas, así una serie regular de 5m cabe en 1 byte por vela
+#   ceil(n/8) bytes de color (bit 1 = V) y ceil(n/8) de validez (bit 1 = V/R; 0 = otro color)
+MAGIA = b"PPVELAS\x00"
+VERSION = 1
+_CABECERA = struct.Struct("<8sHHIqqQ")
+_TIPOS_DELTA = {1: "u1", 2: "<u2", 4: "<u4"}
+_EXTENSION = ".velas"
+_NOMBRE_VALIDO = re.compile(r"^[A-Za-z0-9._-]+$")
+
+Crudo = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (ts int64, verdes bool, validas bool)
+
+
+def ruta(mercado: str, intervalo: str) -> Optional[str]:
+    """Ruta del archivo del par (None si ARCHIVO_VELAS_DIR está vacío o el nombre no es seguro)."""
+    if not ajustes.ARCHIVO_VELAS_DIR:
+        return None
+    if not _NOMBRE_VALIDO.match(mercado) or not _NOMBRE_VALIDO.match(intervalo) or "__" in intervalo:
+        return None
+    return os.path.join(ajustes.ARCHIVO_VELAS_DIR, f"{mercado}__{intervalo}{_EXTENSION}")
+
+
+def listar() -> List[Tuple[str, str]]:
+    if not ajustes.ARCHIVO_VELAS_DIR or not os.path.isdir(ajustes.ARCHIVO_VELAS_DIR):
+        return []
+    out = []
+    for nombre in sorted(os.listdir(ajustes.ARCHIVO_VELAS_DIR)):
+        if nombre.endswith(_EXTENSION) and "__" in nombre:
+            mercado, intervalo = nombre[: -len(_EXTENSION)].rsplit("__", 1)
+            out.append((mercado, intervalo))
+    return out
+
+
+def codificar(ts: np.ndarray, verdes: np.ndarray, validas: np.ndarray) -> bytes:
+    n = len(ts)
+    deltas = np.diff(ts, prepend=ts[:1]) if n else np.zeros(0, dtype=np.int64)
+    if n and deltas.min() < 0:
+        raise ValueError("ts debe venir ordenado")
+    paso = int(np.gcd.reduce(deltas)) if n else 0
+    if paso > 1:
+        deltas = deltas // paso
+    maximo = int(deltas.max()) if n else 0
+    ancho = next(a for a in (1, 2, 4) if maximo < 1 << (8 * a))
+    t0 = int(ts[0]) if n else 0
+    t_ultimo = int(ts[-1]) if n else 0
+    return b"".join((
+        _CABECERA.pack(MAGIA, VERSION, ancho, max(paso, 1), t0, t_ultimo, n),
+        deltas.astype(_TIPOS_DELTA[ancho]).tobytes(),
+        np.packbits(verdes.astype(bool), bitorder="little").tobytes(),
+        np.packbits(validas.astype(bool), bitorder="little").tobytes(),
+    ))
+
+
+def _decodificar(mm: mmap.mmap) -> Crudo:
+    """Arreglos nuevos a partir de las vistas sobre el mmap (las vistas no salen de aquí).
+
+    No es zero-copy: cumsum y unpackbits dejan la serie completa en memoria, que es lo que
+    guarda el cache de velas; desempacar por ventana no le ahorraría nada a los motores.
+    """
+    magia, version, ancho, paso, t0, _, n = _CABECERA.unpack_from(mm, 0)
+    if magia != MAGIA or version != VERSION or ancho not in _TIPOS_DELTA:
+        raise ValueError("archivo de velas inválido")
+    pos = _CABECERA.size
+    deltas = np.frombuffer(mm, dtype=_TIPOS_DELTA[ancho], count=n, offset=pos)
+    pos += n * ancho
+    nb = (n + 7) // 8
+    ts = np.cumsum(deltas, dtype=np.int64)
+    if paso > 1:
+        ts *= paso
+    ts += t0
+    verdes = np.unpackbits(np.frombuffer(mm, dtype=np.uint8, count=nb, offset=pos), count=n, bitorder="little")
+    validas = np.unpackbits(np.frombuffer(mm, dtype=np.uint8, count=nb, offset=pos + nb), count=n, bitorder="little")
+    return ts, verdes.view(bool), validas.view(bool)
+
+
+def leer_crudo(ruta_archivo: str) -> Optional[Crudo]:
+    try:
+        with open(ruta_archivo, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _CABECERA.size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _decodificar(mm)
+    except FileNotFoundError:
+        return None
+
+
+def leer(mercado: str, intervalo: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(ts epoch seg, colores uint8 V=1/R=0) de las velas V/R archivadas, o None si no hay archivo."""
+    r = ruta(mercado, intervalo)
+    crudo = leer_crudo(r) if r is not None else None
+    if crudo is None:
+        return None
+    ts, verdes, validas = crudo
+    if validas.all():
+        return ts, verdes.view(np.uint8)
+    return ts[validas], verdes[validas].view(np.uint8)
+
+
+def _escribir(ruta_archivo: str, datos: bytes) -> None:
+    # reemplazo atómico: los lectores con el mmap abierto conservan el archivo anterior
+    tmp = f"{ruta_archivo}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(datos)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta_archivo)
+
+
+@contextmanager
+def _candado(ruta_archivo: str) -> Iterator[None]:
+    """Un escritor a la vez por par entre procesos (API y worker de ingesta)."""
+    with open(f"{ruta_archivo}.lock", "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _filas(db: Session, mercado: str, intervalo: str, despues_de: Optional[int]) -> Crudo:
+    q = (
+        select(Vela.fin_ts_utc, Vela.color)
+        .where(Vela.mercado == mercado)
+        .where(Vela.intervalo == intervalo)
+    )
+    if despues_de is not None:
+        q = q.where(Vela.fin_ts_utc > seg_a_utc_naive(despues_de))
+    filas = db.execute(q.order_by(Vela.fin_ts_utc.asc())).all()
+    ts = a_segundos([f[0] for f in filas])
+    colores = np.array([f[1] for f in filas], dtype=object)
+    return ts, colores == "V", (colores == "V") | (colores == "R")
+
+
+def actualizar(db: Session, mercado: str, intervalo: str, desde_fin_ts: Optional[datetime] = None) -> int:
+    """Tras insertar velas con fin_ts >= desde_fin_ts: anexa lo posterior a la cola del archivo,
+    o lo reescribe completo desde la DB si hubo inserciones en o antes de la cola (o si
+    desde_fin_ts es None). Regresa las velas del archivo (0 si está desactivado)."""
+    r = ruta(mercado, intervalo)
+    if r is None:
+        return 0
+    os.makedirs(os.path.dirname(r), exist_ok=True)
+    try:
+        with _candado(r):
+            actual = leer_crudo(r)
+            anexar = (
+                actual is not None
+                and len(actual[0])
+                and desde_fin_ts is not None
+                and utc_naive_a_seg(desde_fin_ts) > int(actual[0][-1])
+            )
+            if anexar:
+                nuevas = _filas(db, mercado, intervalo, int(actual[0][-1]))
+                if not len(nuevas[0]):
+                    return len(actual[0])
+                ts, verdes, validas = (np.concatenate((a, b)) for a, b in zip(actual, nuevas))
+            else:
+                ts, verdes, validas = _filas(db, mercado, intervalo, None)
+            _escribir(r, codificar(ts, verdes, validas))
+            return len(ts)
+    except Exception:
+        # sin archivo las lecturas vuelven a la DB; nunca servir uno a medias o desfasado
+        log.exception("archivo de velas %s %s: no se pudo actualizar, se descarta", mercado, intervalo)
+        try:
+            os.remove(r)
+        except FileNotFoundError:
+            pass
+        return 0
+
+
+if __name__ == "__main__":
+    # python -m app.archivo_velas exportar [mercado:intervalo ...] | info
+    import argparse
+
+    from .db import SesionLocal
+
+    p = argparse.ArgumentParser(prog="python -m app.archivo_velas", description="Archivo bit-packed de velas por par.")
+    sub = p.add_subparsers(dest="comando", required=True)
+    s = sub.add_parser("exportar", help="reescribe el archivo desde la DB (default: todos los pares en velas)")
+    s.add_argument("pares", nargs="*", help="mercado:intervalo")
+    sub.add_parser("info", help="pares archivados, velas y tamaño")
+    args = p.parse_args()
+
+    if not ajustes.ARCHIVO_VELAS_DIR:
+        raise SystemExit("ARCHIVO_VELAS_DIR está vacío")
+    if args.comando == "exportar":
+        db = SesionLocal()
+        try:
+            if args.pares:
+                pares = [tuple(x.rsplit(":", 1)) for x in args.pares]
+            else:
+                pares = db.execute(select(Vela.mercado, Vela.intervalo).distinct()).all()
+            for mercado, intervalo in pares:
+                print(f"{mercado} {intervalo}: {actualizar(db, mercado, intervalo)} velas")
+        finally:
+            db.close()
+    else:
+        for mercado, intervalo in listar():
+            r = ruta(mercado, intervalo)
+            crudo = leer_crudo(r)
+            n = len(crudo[0]) if crudo is not None else 0
+            validas = int(crudo[2].sum()) if crudo is not None else 0
+            print(f"{mercado:32s} {intervalo:6s} {n:>10d} velas ({validas} V/R) {os.path.getsize(r):>12d} bytes")
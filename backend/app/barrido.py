@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .coincidencias import resultados_patron
+from .config import ajustes
+from .simular import simular_desde_resultados
+
+_pool: Optional[ProcessPoolExecutor] = None
+_procesos = ajustes.BARRIDO_PROCESOS or (os.cpu_count() or 1)
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_procesos)
+    return _pool
+
+
+def cerrar_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def evaluar_patrones(
+    bits: np.ndarray,
+    patrones: List[str],
+    direcciones: List[str],
+    banca0: float,
+    stakes: List[float],
+    payouts: List[float],
+    reinvertir: List[bool],
+) -> List[Dict]:
+    """Evalúa todas las combinaciones para un bloque de patrones.
+    Las apariciones de cada patrón se calculan una sola vez y se reutilizan en toda la rejilla.
+    """
+    filas: List[Dict] = []
+    for patron in patrones:
+        indices, siguientes = resultados_patron(bits, patron)
+        trades = len(indices)
+        for direccion in direcciones:
+            for stake in stakes:
+                for payout in payouts:
+                    for reinv in reinvertir:
+                        res = simular_desde_resultados(
+                            indices=indices,
+                            siguientes=siguientes,
+                            direccion=direccion,
+                            banca0=banca0,
+                            stake=stake,
+                            payout=payout,
+                            reinvertir=reinv,
+                        )
+                        ganados = int(np.count_nonzero(res.gano))
+                        filas.append({
+                            "patron": patron,
+                            "direccion": res.direccion,
+                            "stake": float(stake),
+                            "payout": float(payout),
+                            "reinvertir": bool(reinv),
+                            "trades": trades,
+                            "ganados": ganados,
+                            "efectividad": (ganados / trades) if trades else None,
+                            "banca_fin": float(res.banca_fin),
+                            "pnl_total": float(res.pnl_total),
+                            "roi": float(res.roi),
+                            "max_drawdown": float(res.max_drawdown),
+                            "max_racha_perdidas": int(res.max_racha_perdidas),
+                            "max_racha_ganadas": int(res.max_racha_ganadas),
+                        })
+    return filas
+
+
+async def barrido_en_pool(
+    bits: np.ndarray,
+    patrones: List[str],
+    *,
+    direcciones: List[str],
+    banca0: float,
+    stakes: List[float],
+    payouts: List[float],
+    reinvertir: List[bool],
+) -> List[Dict]:
+    """Reparte los patrones en bloques (uno por proceso aprox.) y junta los resultados."""
+    pool = _obtener_pool()
+    n_bloques = max(1, min(len(patrones), _procesos * 4))
+    bloques = [patrones[i::n_bloques] for i in range(n_bloques)]
+
+    loop = asyncio.get_running_loop()
+    tareas = [
+        loop.run_in_executor(
+            pool, evaluar_patrones, bits, bloque, direcciones, banca0, stakes, payouts, reinvertir
+        )
+        for bloque in bloques if bloque
+    ]
+    filas: List[Dict] = []
+    for parcial in await asyncio.gather(*tareas):
+        filas.extend(parcial)
+    return filas
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+from .cache_velas import cache_velas
+from .config import ajustes
+from .db import sesion_async
+from .formatos import codificar, responder
+from .hilos import en_hilo
+from .metricas import contar, etapa
+from .perfilado import perfil_activo
+from .utils_time import utc_naive_a_seg
+
+# mismo formato JSON que usan los modelos de respuesta (p. ej. datetimes con "Z")
+_A_JSON = TypeAdapter(Any)
+
+
+class BackendMemoria:
+    """LRU en proceso acotado por entradas y bytes; cada entrada caduca a los ttl_seg."""
+
+    nombre = "memoria"
+    bloqueante = False
+
+    def __init__(self, max_entradas: int, max_bytes: int):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._generaciones: Dict[Tuple[str, str], int] = {}
+        # las generaciones no sobreviven a un reinicio: la época evita reusar ETags viejos
+        self._epoca = time.time_ns()
+        self._lock = threading.Lock()
+
+    def leer(self, clave: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            caduca, valor = item
+            if caduca < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def escribir(self, clave: str, valor: bytes, ttl_seg: int) -> None:
+        with self._lock:
+            self._quitar(clave)
+            self._datos[clave] = (time.monotonic() + ttl_seg, valor)
+            self._bytes += len(valor)
+            while self._datos and (len(self._datos) > self.max_entradas or self._bytes > self.max_bytes):
+                self._quitar(next(iter(self._datos)))
+
+    def _quitar(self, clave: str) -> None:
+        item = self._datos.pop(clave, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    def generacion(self, mercado: str, intervalo: str) -> str:
+        return f"{self._epoca}.{self._generaciones.get((mercado, intervalo), 0)}"
+
+    def invalidar(self, mercado: str, intervalo: str) -> None:
+        # las entradas viejas dejan de ser alcanzables y salen por LRU/TTL
+        with self._lock:
+            par = (mercado, intervalo)
+            self._generaciones[par] = self._generaciones.get(par, 0) + 1
+
+    def tamano(self) -> Tuple[Optional[int], Optional[int]]:
+        return len(self._datos), self._bytes
+
+
+class BackendRedis:
+    """Store compatible con Redis (requiere el paquete opcional `redis`).
+
+    Entradas y generaciones se comparten entre procesos (API con varios workers o
+    ingesta como worker aparte); el tamaño lo acota maxmemory del servidor más el TTL.
+    Cliente síncrono: cada llamada es un round trip de red, así que se hace fuera del event loop.
+    """
+
+    nombre = "redis"
+    bloqueante = True
+
+    def __init__(self, url: str, prefijo: str = "polypatron"):
+        import redis  # dependencia opcional, solo si CACHE_RESPUESTAS=redis
+
+        self._r = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+
+    def leer(self, clave: str) -> Optional[bytes]:
+        return self._r.get(f"{self._prefijo}:resp:{clave}")
+
+    def escribir(self, clave: str, valor: bytes, ttl_seg: int) -> None:
+        self._r.set(f"{self._prefijo}:resp:{clave}", valor, ex=ttl_seg)
+
+    def generacion(self, mercado: str, intervalo: str) -> str:
+        valor = self._r.get(f"{self._prefijo}:gen:{mercado}:{intervalo}")
+        return valor.decode() if valor else "0"
+
+    def invalidar(self, mercado: str, intervalo: str) -> None:
+        self._r.incr(f"{self._prefijo}:gen:{mercado}:{intervalo}")
+
+    def tamano(self) -> Tuple[Optional[int], Optional[int]]:
+        return None, None
+
+
+def _poner(payload: Any, ruta: str, valor: Any) -> None:
+    """Asigna valor en una ruta tipo 'a.fin' o 'filas.*.fin' del JSON."""
+    *padres, hoja = ruta.split(".")
+    nodos = [payload]
+    for parte in padres:
+        if parte == "*":
+            nodos = [x for n in nodos for x in n]
+        else:
+            nodos = [n[parte] for n in nodos]
+    for n in nodos:
+        n[hoja] = valor
+
+
+class CacheRespuestas:
+    """Cache de respuestas de análisis por request normalizado.
+
+    La clave incluye la generación del (mercado, intervalo) —que la ingesta incrementa al
+    insertar velas— y la última vela guardada y el número de velas de la serie (cambian
+    también cuando inserta un worker aparte); los 'fin' posteriores a la última vela se
+    recortan a ella, así que "hasta ahora" pedido en distintos segundos comparte entrada.
+    """
+
+    def __init__(self, backend, ttl_seg: int):
+        self.backend = backend
+        self.ttl_seg = ttl_seg
+        self.hits = 0
+        self.misses = 0
+        self.no_modificadas = 0
+        self.invalidaciones = 0
+        self.guardadas = 0
+
+    def invalidar(self, mercado: str, intervalo: str) -> None:
+        if self.backend is None:
+            return
+        self.backend.invalidar(mercado, intervalo)
+        self.invalidaciones += 1
+
+    async def invalidar_async(self, mercado: str, intervalo: str) -> None:
+        if self.backend is None:
+            return
+        await self._backend("invalidar", mercado, intervalo)
+        self.invalidaciones += 1
+
+    async def _backend(self, metodo: str, *args: Any) -> Any:
+        """Llama al backend sin bloquear el event loop (los de red van al pool de hilos)."""
+        fn = getattr(self.backend, metodo)
+        if self.backend.bloqueante:
+            return await en_hilo(fn, *args)
+        return fn(*args)
+
+    def clave(
+        self,
+        ruta: str,
+        req: Any,
+        generacion: str,
+        fines: Dict[str, datetime],
+        ultimo_ts: Optional[int],
+        velas: int,
+    ) -> str:
+        datos = jsonable_encoder(req)
+        for campo, fin in fines.items():
+            fin_s = utc_naive_a_seg(fin)
+            datos[campo] = min(fin_s, ultimo_ts) if ultimo_ts is not None else fin_s
+        crudo = json.dumps(
+            [ruta, generacion, ultimo_ts, velas, datos],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha1(crudo.encode()).hexdigest()
+
+    async def servir(
+        self,
+        request: Request,
+        *,
+        req: Any,
+        mercado: str,
+        intervalo: str,
+        calcular: Callable[[], Awaitable[Any]],
+        fines: Optional[Dict[str, datetime]] = None,
+        ecos: Iterable[Tuple[str, Any]] = (),
+        reestampar: Optional[Callable[[Any], None]] = None,
+        formato: Optional[str] = None,
+    ) -> Any:
+        """Regresa la respuesta cacheada o la calcula y la guarda.
+
+        fines: campos 'fin' que se pueden recortar a la última vela (solo si el resultado
+        no cambia al recortarlos). ecos: rutas del JSON que repiten valores del request y
+        se vuelven a poner desde el request actual. reestampar: ajusta campos que dependen
+        de la hora actual. formato: media type columnar negociado (calcular regresa una
+        Tabla); se guardan los bytes ya codificados y un HIT los sirve tal cual.
+        """
+        if self.backend is None or perfil_activo() is not None:
+            # un request perfilado siempre calcula (un HIT no diría nada)
+            with etapa("calculo"):
+                resultado = await calcular()
+            return responder(resultado, formato) if formato is not None else resultado
+
+        async with sesion_async() as db:
+            serie = await cache_velas.obtener_async(db, mercado, intervalo)
+        ruta = request.url.path if formato is None else f"{request.url.path}|{formato}"
+        generacion = await self._backend("generacion", mercado, intervalo)
+        clave = self.clave(ruta, req, generacion, fines or {}, serie.ultimo_ts, len(serie.ts))
+        etag = f'W/"{clave}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+
+        if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+            self.no_modificadas += 1
+            contar("cache_respuestas_304")
+            return Response(status_code=304, headers=headers)
+
+        if formato is not None:
+            return await self._servir_codificado(clave, headers, calcular, formato)
+
+        crudo = await self._backend("leer", clave)
+        if crudo is not None:
+            self.hits += 1
+            contar("cache_respuestas_hit")
+            with etapa("serializacion"):
+                payload = json.loads(crudo)
+            headers["X-Cache"] = "HIT"
+        else:
+            self.misses += 1
+            contar("cache_respuestas_miss")
+            with etapa("calculo"):
+                resultado = await calcular()
+            with etapa("serializacion"):
+                payload = jsonable_encoder(resultado)
+                crudo = json.dumps(payload, separators=(",", ":")).encode()
+            await self._backend("escribir", clave, crudo, self.ttl_seg)
+            self.guardadas += 1
+            headers["X-Cache"] = "MISS"
+
+        with etapa("serializacion"):
+            for ruta, valor in ecos:
+                _poner(payload, ruta, _A_JSON.dump_python(valor, mode="json"))
+            if reestampar is not None:
+                reestampar(payload)
+            return JSONResponse(payload, headers=headers)
+
+    async def _servir_codificado(
+        self, clave: str, headers: Dict[str, str], calcular: Callable[[], Awaitable[Any]], formato: str
+    ) -> Response:
+        crudo = await self._backend("leer", clave)
+        if crudo is not None:
+            self.hits += 1
+            contar("cache_respuestas_hit")
+            headers["X-Cache"] = "HIT"
+        else:
+            self.misses += 1
+            contar("cache_respuestas_miss")
+            with etapa("calculo"):
+                tabla = await calcular()
+            with etapa("serializacion"):
+                crudo = codificar(tabla, formato)
+            await self._backend("escribir", clave, crudo, self.ttl_seg)
+            self.guardadas += 1
+            headers["X-Cache"] = "MISS"
+        return Response(crudo, media_type=formato, headers=headers)
+
+    def stats(self) -> Dict:
+        consultas = self.hits + self.misses
+        entradas, bytes_ = self.backend.tamano() if self.backend is not None else (None, None)
+        return {
+            "backend": self.backend.nombre if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / consultas) if consultas else None,
+            "no_modificadas": self.no_modificadas,
+            "invalidaciones": self.invalidaciones,
+            "guardadas": self.guardadas,
+            "entradas": entradas,
+            "bytes": bytes_,
+            "ttl_seg": self.ttl_seg,
+        }
+
+
+def _crear_backend():
+    tipo = ajustes.CACHE_RESPUESTAS.strip().lower()
+    if tipo == "memoria":
+        return BackendMemoria(ajustes.CACHE_RESPUESTAS_MAX, ajustes.CACHE_RESPUESTAS_MAX_MB * 1024 * 1024)
+    if tipo == "redis":
+        return BackendRedis(ajustes.REDIS_URL)
+    return None
+
+
+cache_respuestas = CacheRespuestas(_crear_backend(), ttl_seg=ajustes.CACHE_RESPUESTAS_TTL_SEG)
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import archivo_velas
+from .coincidencias import IndiceOcurrencias, a_bits, a_segundos
+from .config import ajustes
+from .metricas import contar, etapa
+from .models import Vela
+from .utils_time import seg_a_utc_naive, utc_naive_a_seg
+
+
+@dataclass
+class SerieVelas:
+    """Serie completa de un (mercado, intervalo): epoch seg UTC ordenados + colores (V=1, R=0)."""
+    ts: np.ndarray       # int64
+    colores: np.ndarray  # uint8
+    # índices de ocurrencias por patrón, construidos bajo demanda sobre esta serie (LRU)
+    indices: "OrderedDict[str, IndiceOcurrencias]" = field(default_factory=OrderedDict, repr=False)
+
+    @property
+    def bytes(self) -> int:
+        return int(self.ts.nbytes + self.colores.nbytes + sum(i.bytes for i in self.indices.values()))
+
+    @property
+    def ultimo_ts(self) -> Optional[int]:
+        return int(self.ts[-1]) if len(self.ts) else None
+
+
+def _consulta(
+    mercado: str,
+    intervalo: str,
+    despues_de: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    extra: Sequence = (),
+):
+    """SELECT fin_ts_utc, color[, extra] de las velas V/R (tuplas, no entidades ORM);
+    el índice cubriente (mercado, intervalo, fin_ts_utc) INCLUDE (color) la responde sola."""
+    q = (
+        select(Vela.fin_ts_utc, Vela.color, *extra)
+        .where(Vela.mercado == mercado)
+        .where(Vela.intervalo == intervalo)
+        .where(Vela.color.in_(("V", "R")))
+    )
+    if despues_de is not None:
+        q = q.where(Vela.fin_ts_utc > despues_de)
+    if hasta is not None:
+        q = q.where(Vela.fin_ts_utc <= hasta)
+    return q.order_by(Vela.fin_ts_utc.asc())
+
+
+def filas_rango(
+    db: Session, mercado: str, intervalo: str, inicio: datetime, fin: datetime, *extra
+) -> List[Tuple]:
+    """(fin_ts_utc, color, *extra) de las velas V/R con inicio <= fin_ts_utc <= fin (UTC naive),
+    para lo que necesita columnas que el cache no guarda (p. ej. slug, market_id)."""
+    q = _consulta(mercado, intervalo, hasta=fin, extra=extra).where(Vela.fin_ts_utc >= inicio)
+    return db.execute(q).all()
+
+
+def _serie_de_filas(filas: Sequence) -> SerieVelas:
+    return SerieVelas(
+        ts=a_segundos([f[0] for f in filas]),
+        colores=a_bits([f[1] for f in filas]),
+    )
+
+
+def _empalmar(ref: Optional[SerieVelas], corte: Optional[int], leidas: SerieVelas) -> SerieVelas:
+    """ref hasta corte (inclusive) + leidas, que trae todo lo posterior a corte según la DB."""
+    if ref is None or corte is None:
+        return leidas
+    lo = int(np.searchsorted(ref.ts, corte, side="right"))
+    return SerieVelas(
+        ts=np.concatenate((ref.ts[:lo], leidas.ts)),
+        colores=np.concatenate((ref.colores[:lo], leidas.colores)),
+    )
+
+
+def _iguales(a: SerieVelas, b: SerieVelas, corte: Optional[int]) -> bool:
+    """¿Mismas velas? Solo se compara lo posterior a corte (lo anterior es el mismo arreglo)."""
+    if len(a.ts) != len(b.ts):
+        return False
+    lo = 0 if corte is None else int(np.searchsorted(a.ts, corte, side="right"))
+    return bool(np.array_equal(a.ts[lo:], b.ts[lo:]) and np.array_equal(a.colores[lo:], b.colores[lo:]))
+
+
+def limites_rango(ts: np.ndarray, inicio: datetime, fin: datetime) -> Tuple[int, int]:
+    """Índices [lo, hi) de ts con inicio <= ts <= fin (UTC naive)."""
+    ini_s = utc_naive_a_seg(inicio) + (1 if inicio.microsecond else 0)
+    fin_s = utc_naive_a_seg(fin)
+    lo = int(np.searchsorted(ts, ini_s, side="left"))
+    hi = int(np.searchsorted(ts, fin_s, side="right"))
+    return lo, hi
+
+
+class CacheVelas:
+    """Cache en proceso de series columnares por (mercado, intervalo).
+
+    - La primera lectura carga la serie completa; las siguientes releen solo la cola
+      (últimas INGESTA_BLOQUES_LOOKBACK + 2 velas en adelante) y la reemplazan si cambió.
+    - Los rangos [inicio, fin] se responden con búsqueda binaria (slices sin copia).
+    - Desalojo LRU acotado por número de series y por bytes; los índices por patrón de cada
+      serie son otro LRU (máx. max_indices) y, si la única serie que queda no cabe, se sueltan
+      sus índices antes que la serie.
+    - La consulta corre fuera del lock; al fusionar se descarta si hubo una invalidación
+      entretanto (generación por serie), así las lecturas concurrentes no se serializan.
+    """
+
+    def __init__(self, max_series: int, max_bytes: int, max_indices: int):
+        self.max_series = max_series
+        self.max_bytes = max_bytes
+        self.max_indices = max_indices
+        self._series: "OrderedDict[Tuple[str, str], SerieVelas]" = OrderedDict()
+        self._generaciones: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.filas_anexadas = 0
+        self.desalojos = 0
+        self.indices_desalojados = 0
+        self.invalidaciones = 0
+
+    def _desalojar(self) -> None:
+        while len(self._series) > 1 and (
+            len(self._series) > self.max_series or self.bytes_totales() > self.max_bytes
+        ):
+            self._series.popitem(last=False)
+            self.desalojos += 1
+        # la serie más reciente se conserva siempre; sus índices no
+        for serie in self._series.values():
+            while serie.indices and self.bytes_totales() > self.max_bytes:
+                serie.indices.popitem(last=False)
+                self.indices_desalojados += 1
+
+    def _recortar_indices(self, serie: SerieVelas) -> None:
+        while len(serie.indices) > self.max_indices:
+            serie.indices.popitem(last=False)
+            self.indices_desalojados += 1
+
+    def bytes_totales(self) -> int:
+        return sum(s.bytes for s in self._series.values())
+
+    def _base(
+        self, clave: Tuple[str, str]
+    ) -> Tuple[Optional[SerieVelas], int, Optional[SerieVelas], Optional[datetime]]:
+        """(serie cacheada, generación, serie archivada, desde dónde leer) antes de consultar.
+        Sin serie cacheada se parte del archivo bit-packed del par, si hay. De la DB se relee
+        desde las últimas INGESTA_BLOQUES_LOOKBACK + 2 velas de la cola: ahí escribe la ingesta,
+        también la de un worker aparte, cuyas inserciones tardías (en o antes de la cola) no
+        avisan a este proceso."""
+        with self._lock:
+            serie = self._series.get(clave)
+            gen = self._generaciones.get(clave, 0)
+        archivada = None
+        if serie is None:
+            leida = archivo_velas.leer(*clave)
+            if leida is not None and len(leida[0]):
+                archivada = SerieVelas(ts=leida[0], colores=leida[1])
+                contar("velas_archivo", len(archivada.ts))
+        ref = serie if serie is not None else archivada
+        k = ajustes.INGESTA_BLOQUES_LOOKBACK + 2
+        if ref is None or len(ref.ts) < k:
+            return serie, gen, archivada, None
+        return serie, gen, archivada, seg_a_utc_naive(int(ref.ts[-k]))
+
+    def _fusionar(
+        self,
+        clave: Tuple[str, str],
+        base: Optional[SerieVelas],
+        gen: int,
+        archivada: Optional[SerieVelas],
+        desde: Optional[datetime],
+        leidas: SerieVelas,
+    ) -> SerieVelas:
+        corte = utc_naive_a_seg(desde) if desde is not None else None
+        with self._lock:
+            vigente = self._generaciones.get(clave, 0) == gen
+            contar("velas_leidas", len(leidas.ts))
+            if base is None:
+                self.misses += 1
+                contar("cache_velas_miss")
+                serie = _empalmar(archivada, corte, leidas)
+            else:
+                self.hits += 1
+                contar("cache_velas_hit")
+                # otra consulta pudo leer más tarde mientras tanto: se conserva lo que trajo de más
+                actual = (self._series.get(clave) if vigente else None) or base
+                nueva = _empalmar(actual, corte, leidas)
+                ultimo = nueva.ultimo_ts
+                if ultimo is not None and actual.ultimo_ts is not None and actual.ultimo_ts > ultimo:
+                    resto = int(np.searchsorted(actual.ts, ultimo, side="right"))
+                    nueva = SerieVelas(
+                        ts=np.concatenate((nueva.ts, actual.ts[resto:])),
+                        colores=np.concatenate((nueva.colores, actual.colores[resto:])),
+                    )
+                serie = actual
+                if not _iguales(actual, nueva, corte):
+                    self.filas_anexadas += max(0, len(nueva.ts) - len(actual.ts))
+                    serie = nueva
+            if vigente:
+                self._series[clave] = serie
+                self._series.move_to_end(clave)
+                self._desalojar()
+            return serie
+
+    def obtener(self, db: Session, mercado: str, intervalo: str) -> SerieVelas:
+        clave = (mercado, intervalo)
+        with etapa("carga_velas"):
+            base, gen, archivada, desde = self._base(clave)
+            leidas = _serie_de_filas(db.execute(_consulta(mercado, intervalo, desde)).all())
+        return self._fusionar(clave, base, gen, archivada, desde, leidas)
+
+    async def obtener_async(self, db: AsyncSession, mercado: str, intervalo: str) -> SerieVelas:
+        """Como obtener, con la sesión async (la consulta no bloquea el event loop)."""
+        clave = (mercado, intervalo)
+        with etapa("carga_velas"):
+            base, gen, archivada, desde = self._base(clave)
+            leidas = _serie_de_filas((await db.execute(_consulta(mercado, intervalo, desde))).all())
+        return self._fusionar(clave, base, gen, archivada, desde, leidas)
+
+    def rango(
+        self, db: Session, mercado: str, intervalo: str, inicio: datetime, fin: datetime
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Regresa (ts, colores) con inicio <= ts <= fin."""
+        serie = self.obtener(db, mercado, intervalo)
+        lo, hi = limites_rango(serie.ts, inicio, fin)
+        return serie.ts[lo:hi], serie.colores[lo:hi]
+
+    def indice(
+        self, db: Session, mercado: str, intervalo: str, patron: str
+    ) -> Tuple[SerieVelas, IndiceOcurrencias]:
+        """Serie completa + índice de ocurrencias del patrón (se rehace al anexar velas)."""
+        serie = self.obtener(db, mercado, intervalo)
+        with self._lock:
+            ind = serie.indices.get(patron)
+            if ind is not None:
+                serie.indices.move_to_end(patron)
+        if ind is None:
+            ind = IndiceOcurrencias.construir(serie.colores, patron)
+            with self._lock:
+                ind = serie.indices.setdefault(patron, ind)
+                serie.indices.move_to_end(patron)
+                self._recortar_indices(serie)
+                self._desalojar()
+        return serie, ind
+
+    def invalidar(self, mercado: str, intervalo: str) -> None:
+        clave = (mercado, intervalo)
+        with self._lock:
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+            if self._series.pop(clave, None) is not None:
+                self.invalidaciones += 1
+
+    def notificar_insercion(self, mercado: str, intervalo: str, fin_ts: datetime) -> None:
+        """Una fila insertada en o antes de la cola no se vería con el anexado incremental
+        (sin serie cacheada se invalida igual: puede haber una carga completa en curso)."""
+        with self._lock:
+            serie = self._series.get((mercado, intervalo))
+            if serie is not None and serie.ultimo_ts is not None and utc_naive_a_seg(fin_ts) > serie.ultimo_ts:
+                return
+            self.invalidar(mercado, intervalo)
+
+    def precargar_archivos(self) -> int:
+        """Al iniciar: series de los archivos bit-packed al cache (la primera consulta de cada
+        par solo lee de la DB lo posterior a la cola archivada). Regresa las series cargadas."""
+        cargadas = 0
+        for clave in archivo_velas.listar()[: self.max_series]:
+            leida = archivo_velas.leer(*clave)
+            if leida is None or not len(leida[0]):
+                continue
+            with self._lock:
+                if clave not in self._series:
+                    self._series[clave] = SerieVelas(ts=leida[0], colores=leida[1])
+                    self._desalojar()
+                    cargadas += 1
+        return cargadas
+
+    def stats(self) -> Dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            series: List[Dict] = []
+            for (mercado, intervalo), s in self._series.items():
+                series.append({
+                    "mercado": mercado,
+                    "intervalo": intervalo,
+                    "velas": int(len(s.ts)),
+                    "patrones_indexados": len(s.indices),
+                    "bytes": s.bytes,
+                    "desde_utc": seg_a_utc_naive(int(s.ts[0])) if len(s.ts) else None,
+                    "hasta_utc": seg_a_utc_naive(int(s.ts[-1])) if len(s.ts) else None,
+                })
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / consultas) if consultas else None,
+                "filas_anexadas": self.filas_anexadas,
+                "desalojos": self.desalojos,
+                "indices_desalojados": self.indices_desalojados,
+                "invalidaciones": self.invalidaciones,
+                "bytes": self.bytes_totales(),
+                "max_bytes": self.max_bytes,
+                "max_series": self.max_series,
+                "max_indices": self.max_indices,
+                "series": series,
+            }
+
+
+cache_velas = CacheVelas(
+    max_series=ajustes.CACHE_VELAS_MAX_SERIES,
+    max_bytes=ajustes.CACHE_VELAS_MAX_MB * 1024 * 1024,
+    max_indices=ajustes.CACHE_VELAS_MAX_INDICES,
+)
+
+
+def cargar_colores(
+    db: Session, mercado: str, intervalo: str, inicio: datetime, fin: datetime
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(ts epoch seg, colores uint8) del rango, servidos desde el cache."""
+    return cache_velas.rango(db, mercado, intervalo, inicio, fin)
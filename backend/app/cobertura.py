@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy.orm import Session
+
+from .models import CoberturaVelas
+from .utils_time import iso_a_utc_naive
+
+Tramo = Tuple[datetime, datetime]
+
+
+def tramos_cubiertos(db: Session, mercado: str, intervalo: str, inicio: datetime, fin: datetime) -> List[Tramo]:
+    """Tramos guardados que se traslapan con [inicio, fin], ordenados por desde."""
+    filas = (
+        db.query(CoberturaVelas.desde_utc, CoberturaVelas.hasta_utc)
+        .filter(CoberturaVelas.mercado == mercado)
+        .filter(CoberturaVelas.intervalo == intervalo)
+        .filter(CoberturaVelas.desde_utc <= fin)
+        .filter(CoberturaVelas.hasta_utc >= inicio)
+        .order_by(CoberturaVelas.desde_utc.asc())
+        .all()
+    )
+    return [(f[0], f[1]) for f in filas]
+
+
+def huecos(
+    db: Session,
+    mercado: str,
+    intervalo: str,
+    inicio: datetime,
+    fin: datetime,
+    horizonte: datetime,
+) -> List[Tramo]:
+    """Partes de [inicio, fin] (UTC naive) que faltan por ingerir.
+
+    Todo lo posterior a 'horizonte' (cola todavía abierta: mercados sin cerrar o
+    sin resolver en Gamma) se considera hueco siempre.
+    """
+    ini = iso_a_utc_naive(inicio)
+    fin_n = iso_a_utc_naive(fin)
+    hor = iso_a_utc_naive(horizonte)
+
+    out: List[Tramo] = []
+    limite = min(fin_n, hor)
+    cursor = ini
+    if cursor < limite:
+        for desde, hasta in tramos_cubiertos(db, mercado, intervalo, ini, limite):
+            if desde > cursor:
+                out.append((cursor, min(desde, limite)))
+            cursor = max(cursor, hasta)
+            if cursor >= limite:
+                break
+        if cursor < limite:
+            out.append((cursor, limite))
+
+    if fin_n > hor:
+        if out and out[-1][1] == hor:
+            # hueco pegado a la cola abierta: una sola consulta
+            out[-1] = (out[-1][0], fin_n)
+        else:
+            out.append((max(ini, hor), fin_n))
+    return out
+
+
+def registrar(db: Session, mercado: str, intervalo: str, desde: datetime, hasta: datetime) -> Tramo:
+    """Guarda [desde, hasta] como cubierto y lo fusiona con los tramos que se traslapan o tocan."""
+    desde = iso_a_utc_naive(desde)
+    hasta = iso_a_utc_naive(hasta)
+    if hasta <= desde:
+        return desde, hasta
+
+    existentes = (
+        db.query(CoberturaVelas)
+        .filter(CoberturaVelas.mercado == mercado)
+        .filter(CoberturaVelas.intervalo == intervalo)
+        .filter(CoberturaVelas.desde_utc <= hasta)
+        .filter(CoberturaVelas.hasta_utc >= desde)
+        .all()
+    )
+    for e in existentes:
+        desde = min(desde, e.desde_utc)
+        hasta = max(hasta, e.hasta_utc)
+        db.delete(e)
+
+    db.add(CoberturaVelas(mercado=mercado, intervalo=intervalo, desde_utc=desde, hasta_utc=hasta))
+    db.commit()
+    return desde, hasta
+
+
+def horizonte_cerrado(ahora: datetime, margen_seg: int) -> datetime:
+    """Hasta dónde se puede dar por completo lo que devuelve Gamma (UTC naive)."""
+    return iso_a_utc_naive(ahora) - timedelta(seconds=margen_seg)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+from .utils_time import utc_naive_a_seg
+
+# Misma convención que patrones.py: V=1, R=0
+_BIT_COLOR = {"V": 1, "R": 0}
+_ORD_V = ord("V")
+
+SerieColores = Union[Sequence[str], np.ndarray]
+
+
+def a_bits(colores: SerieColores) -> np.ndarray:
+    """Convierte la serie de colores a un arreglo uint8 (V=1, R=0).
+    Si ya viene como arreglo numérico se regresa tal cual (sin copiar).
+    """
+    if isinstance(colores, np.ndarray):
+        return colores.astype(np.uint8, copy=False)
+    if not colores:
+        return np.zeros(0, dtype=np.uint8)
+    crudo = np.frombuffer("".join(colores).encode("ascii", "replace"), dtype=np.uint8)
+    return (crudo == _ORD_V).astype(np.uint8)
+
+
+def a_segundos(fin_ts: Union[Sequence[datetime], np.ndarray]) -> np.ndarray:
+    """Timestamps UTC naive -> arreglo int64 de epoch en segundos.
+    Si ya viene como arreglo numérico se regresa tal cual (sin copiar).
+    """
+    if isinstance(fin_ts, np.ndarray):
+        return fin_ts.astype(np.int64, copy=False)
+    if not fin_ts:
+        return np.zeros(0, dtype=np.int64)
+    return np.array(fin_ts, dtype="datetime64[s]").astype(np.int64)
+
+
+def seg_en(fin_ts: Union[Sequence[datetime], np.ndarray], i: int) -> int:
+    """Epoch en segundos del elemento i, sin convertir toda la serie."""
+    if isinstance(fin_ts, np.ndarray):
+        return int(fin_ts[i])
+    return utc_naive_a_seg(fin_ts[i])
+
+
+def mascara_patron(colores: SerieColores, patron: str) -> np.ndarray:
+    """Máscara booleana del largo de la serie: True en i si colores[i-L:i] == patron.
+
+    Es decir, marca la vela *resultado* (la siguiente al patrón), así que
+    colores[mascara] son los resultados y la última vela del patrón es i-1.
+    Un patrón vacío o con caracteres distintos de V/R no aparece nunca.
+    """
+    bits = a_bits(colores)
+    n = len(bits)
+    L = len(patron)
+    mascara = np.zeros(n, dtype=bool)
+    if L == 0 or n <= L or any(c not in _BIT_COLOR for c in patron):
+        return mascara
+
+    m = n - L
+    ventana = np.ones(m, dtype=bool)
+    for k, c in enumerate(patron):
+        ventana &= bits[k:k + m] == _BIT_COLOR[c]
+    mascara[L:] = ventana
+    return mascara
+
+
+def codigo_patron(patron: str) -> int:
+    """'VVR' -> 0b110 (V=1, R=0, vela más antigua en el bit alto)."""
+    codigo = 0
+    for c in patron:
+        codigo = (codigo << 1) | _BIT_COLOR[c]
+    return codigo
+
+
+def codigos_ventana(colores: SerieColores, L: int) -> np.ndarray:
+    """Código entero de cada ventana de L velas cuyo resultado cae en la serie:
+    codigos[j] codifica colores[j:j+L] y su vela resultado es j+L (largo n - L)."""
+    bits = a_bits(colores).astype(np.int64)
+    m = max(len(bits) - L, 0)
+    codigos = np.zeros(m, dtype=np.int64)
+    for k in range(L):
+        codigos = (codigos << 1) | bits[k:k + m]
+    return codigos
+
+
+def resultados_patron(colores: SerieColores, patron: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Regresa (indices, siguientes): índice de cada vela resultado y su bit (1=V, 0=R)."""
+    bits = a_bits(colores)
+    indices = np.flatnonzero(mascara_patron(bits, patron))
+    return indices, bits[indices]
+
+
+def contar_resultados(colores: SerieColores, patron: str) -> Tuple[int, int]:
+    """Regresa (verdes, rojas) de la vela siguiente a cada aparición del patrón."""
+    _idx, siguientes = resultados_patron(colores, patron)
+    verdes = int(np.count_nonzero(siguientes))
+    return verdes, int(len(siguientes)) - verdes
+
+
+@dataclass
+class IndiceOcurrencias:
+    """Ocurrencias de un patrón en una serie completa, con verdes acumulados.
+
+    Contar en cualquier slice [lo, hi) de la serie son dos búsquedas binarias y dos
+    restas: cuentan las velas resultado i con lo + L <= i < hi (patrón completo en el slice).
+    """
+    longitud: int
+    indices: np.ndarray      # int64, vela resultado de cada ocurrencia (creciente)
+    verdes_acum: np.ndarray  # int64, largo ocurrencias + 1; verdes_acum[j] = verdes en las primeras j
+
+    @classmethod
+    def construir(cls, colores: SerieColores, patron: str) -> "IndiceOcurrencias":
+        indices, siguientes = resultados_patron(colores, patron)
+        acum = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(siguientes, out=acum[1:])
+        return cls(longitud=len(patron), indices=indices.astype(np.int64, copy=False), verdes_acum=acum)
+
+    @property
+    def bytes(self) -> int:
+        return int(self.indices.nbytes + self.verdes_acum.nbytes)
+
+    def tramo(self, lo: int, hi: int) -> Tuple[int, int]:
+        """Posiciones [a, b) dentro de indices de las ocurrencias del slice [lo, hi)."""
+        a = int(np.searchsorted(self.indices, lo + self.longitud, side="left"))
+        b = int(np.searchsorted(self.indices, hi, side="left"))
+        return a, max(a, b)
+
+    def tramos(self, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Versión vectorizada de tramo para muchos slices a la vez."""
+        a = np.searchsorted(self.indices, lo + self.longitud, side="left")
+        b = np.maximum(a, np.searchsorted(self.indices, hi, side="left"))
+        return a, b
+
+    def contar(self, lo: int, hi: int) -> Tuple[int, int]:
+        """(verdes, rojas) del slice [lo, hi)."""
+        a, b = self.tramo(lo, hi)
+        verdes = int(self.verdes_acum[b] - self.verdes_acum[a])
+        return verdes, (b - a) - verdes
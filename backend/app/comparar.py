@@ -1,34 +1,16 @@
 from __future__ import annotations
 from datetime import datetime, timedelta, timezone
+from statistics import NormalDist
 from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 from sqlalchemy.orm import Session
 
-from .models import Vela
-from .utils_time import iso_a_utc_naive
-
-def _cargar_colores(db: Session, mercado: str, intervalo: str, inicio: datetime, fin: datetime) -> List[str]:
-    ini_n = iso_a_utc_naive(inicio)
-    fin_n = iso_a_utc_naive(fin)
-    filas = (
-        db.query(Vela)
-        .filter(Vela.mercado == mercado)
-        .filter(Vela.intervalo == intervalo)
-        .filter(Vela.fin_ts_utc >= ini_n)
-        .filter(Vela.fin_ts_utc <= fin_n)
-        .order_by(Vela.fin_ts_utc.asc())
-        .all()
-    )
-    return [f.color for f in filas if f.color in ("V","R")]
-
-def _edge(colores: List[str], patron: str, direccion: str) -> Tuple[Optional[float], int, int, int]:
-    L = len(patron)
-    v = r = 0
-    for i in range(L, len(colores)):
-        if "".join(colores[i-L:i]) == patron:
-            if colores[i] == "V":
-                v += 1
-            else:
-                r += 1
+from .cache_velas import SerieVelas, cache_velas, cargar_colores, limites_rango
+from .coincidencias import IndiceOcurrencias, codigo_patron, codigos_ventana
+from .utils_time import seg_a_utc_naive, utc_naive_a_seg
+
+def _edge(v: int, r: int, direccion: Optional[str]) -> Tuple[Optional[float], int, int, int]:
     total = v + r
     if total == 0:
         return None, 0, 0, 0
@@ -37,29 +19,8 @@ def _edge(colores: List[str], patron: str, direccion: str) -> Tuple[Optional[flo
     return r/total, total, v, r
 
 
-def _metricas_desde_colores(
-    colores: List[str],
-    patron: str,
-    direccion: Optional[str],
-    fin_ts_list: Optional[List[datetime]] = None,
-) -> Dict:
-    L = len(patron)
-    v = 0
-    r = 0
-    ocurrencias_ts: List[datetime] = []
-
-    for i in range(L, len(colores)):
-        if "".join(colores[i - L:i]) != patron:
-            continue
-
-        if colores[i] == "V":
-            v += 1
-        else:
-            r += 1
-
-        if fin_ts_list is not None and len(fin_ts_list) == len(colores):
-            ocurrencias_ts.append(fin_ts_list[i - 1])
-
+def _metricas(v: int, r: int, primera: Optional[int], ultima: Optional[int], direccion: Optional[str]) -> Dict:
+    """primera/ultima: epoch seg de la última vela del patrón en su primera/última aparición."""
     muestras = v + r
 
     dir_norm = direccion if direccion in ("V", "R") else None
@@ -78,13 +39,10 @@ def _metricas_desde_colores(
     aparece_cada_seg: Optional[int] = None
     ultima_vez_utc: Optional[datetime] = None
 
-    if len(ocurrencias_ts) >= 1:
-        ultima_vez_utc = max(ocurrencias_ts).replace(tzinfo=timezone.utc)
-    if len(ocurrencias_ts) >= 2:
-        occ = sorted(ocurrencias_ts)
-        diffs = [int((b - a).total_seconds()) for a, b in zip(occ[:-1], occ[1:])]
-        if diffs:
-            aparece_cada_seg = int(sum(diffs) / len(diffs))
+    if muestras >= 1:
+        ultima_vez_utc = seg_a_utc_naive(ultima).replace(tzinfo=timezone.utc)
+        if muestras >= 2:
+            aparece_cada_seg = int((ultima - primera) / (muestras - 1))
 
     return {
         "direccion": dir_calc,
@@ -97,6 +55,25 @@ def _metricas_desde_colores(
     }
 
 
+def _metricas_desde_indice(
+    serie: SerieVelas,
+    ind: IndiceOcurrencias,
+    lo: int,
+    hi: int,
+    direccion: Optional[str],
+) -> Dict:
+    a, b = ind.tramo(lo, hi)
+    v = int(ind.verdes_acum[b] - ind.verdes_acum[a])
+    r = (b - a) - v
+
+    # timestamps de la última vela del patrón (posición i-1); la serie viene ordenada
+    primera = ultima = None
+    if b > a:
+        primera = int(serie.ts[ind.indices[a] - 1])
+        ultima = int(serie.ts[ind.indices[b - 1] - 1])
+    return _metricas(v, r, primera, ultima, direccion)
+
+
 def comparar_rango(
     db: Session,
     mercado: str,
@@ -106,23 +83,9 @@ def comparar_rango(
     patron: str,
     direccion: Optional[str],
 ):
-    ini_n = iso_a_utc_naive(inicio)
-    fin_n = iso_a_utc_naive(fin)
-    filas = (
-        db.query(Vela)
-        .filter(Vela.mercado == mercado)
-        .filter(Vela.intervalo == intervalo)
-        .filter(Vela.fin_ts_utc >= ini_n)
-        .filter(Vela.fin_ts_utc <= fin_n)
-        .order_by(Vela.fin_ts_utc.asc())
-        .all()
-    )
-
-    velas = [f for f in filas if f.color in ("V", "R")]
-    colores = [v.color for v in velas]
-    fin_ts_list = [v.fin_ts_utc for v in velas]
-
-    met = _metricas_desde_colores(colores, patron, direccion, fin_ts_list)
+    serie, ind = cache_velas.indice(db, mercado, intervalo, patron)
+    lo, hi = limites_rango(serie.ts, inicio, fin)
+    met = _metricas_desde_indice(serie, ind, lo, hi, direccion)
     return {
         "inicio": inicio,
         "fin": fin,
@@ -192,6 +155,62 @@ def comparar_patron_vs_patron(
         "ganador": gana,
     }
 
+def _tabla_longitud(ts: np.ndarray, bits: np.ndarray, L: int) -> Tuple[np.ndarray, ...]:
+    """Tablas indexadas por código de patrón (2**L): totales, verdes, primera y última aparición."""
+    codigos = codigos_ventana(bits, L)
+    siguientes = bits[L:].astype(np.int64)
+    pos = ts[L - 1:len(bits) - 1]  # última vela del patrón
+    tam = 1 << L
+    totales = np.bincount(codigos, minlength=tam)
+    verdes = np.bincount(codigos, weights=siguientes, minlength=tam).astype(np.int64)
+    primera = np.full(tam, -1, dtype=np.int64)
+    ultima = np.full(tam, -1, dtype=np.int64)
+    if len(codigos):
+        primera[:] = np.iinfo(np.int64).max
+        np.minimum.at(primera, codigos, pos)
+        np.maximum.at(ultima, codigos, pos)
+    return totales, verdes, primera, ultima
+
+
+def comparar_lote(
+    db: Session,
+    mercado: str,
+    intervalo: str,
+    inicio: datetime,
+    fin: datetime,
+    patrones: List[Tuple[str, Optional[str]]],
+) -> List[Dict]:
+    """Métricas de muchos patrones sobre el mismo rango (mismo criterio que comparar_rango).
+
+    Una pasada por cada longitud distinta: cada ventana se codifica como entero y se
+    acumula en tablas indexadas por código; cada patrón es una búsqueda en la tabla.
+    """
+    ts, bits = cargar_colores(db, mercado, intervalo, inicio, fin)
+    tablas: Dict[int, Tuple[np.ndarray, ...]] = {}
+
+    out: List[Dict] = []
+    for patron, direccion in patrones:
+        L = len(patron)
+        v = r = 0
+        primera = ultima = None
+        if 0 < L < len(bits) and all(c in ("V", "R") for c in patron):
+            if L not in tablas:
+                tablas[L] = _tabla_longitud(ts, bits, L)
+            totales, verdes, primeras, ultimas = tablas[L]
+            k = codigo_patron(patron)
+            v = int(verdes[k])
+            r = int(totales[k]) - v
+            if v + r:
+                primera, ultima = int(primeras[k]), int(ultimas[k])
+        out.append({
+            "patron": patron,
+            "inicio": inicio,
+            "fin": fin,
+            **_metricas(v, r, primera, ultima, direccion),
+        })
+    return out
+
+
 def comparar_ventanas(
     db: Session,
     mercado: str,
@@ -201,13 +220,15 @@ def comparar_ventanas(
     direccion: str,
     ventanas_dias: List[int]
 ):
-    """Calcula efectividad del mismo patrón en varias ventanas hacia atrás desde 'fin'."""
+    """Calcula efectividad del mismo patrón en varias ventanas hacia atrás desde 'fin'.
+    Todas las ventanas salen del mismo índice de ocurrencias (búsquedas binarias por ventana)."""
     filas = []
     fin_dt = fin
+    serie, ind = cache_velas.indice(db, mercado, intervalo, patron)
     for dias in sorted(set(int(x) for x in ventanas_dias if int(x) > 0)):
         inicio = fin_dt - timedelta(days=dias)
-        colores = _cargar_colores(db, mercado, intervalo, inicio, fin_dt)
-        efect, muestras, v, r = _edge(colores, patron, direccion) if len(colores) > len(patron) else (None,0,0,0)
+        lo, hi = limites_rango(serie.ts, inicio, fin_dt)
+        efect, muestras, v, r = _edge(*ind.contar(lo, hi), direccion)
         filas.append((dias, inicio, fin_dt, efect, muestras, v, r))
 
     # Tendencia simple: comparar ventana más corta vs más larga (si hay datos)
@@ -222,3 +243,69 @@ def comparar_ventanas(
             elif corta[3] < larga[3] - 0.02:
                 tendencia = "descenso"
     return filas, tendencia
+
+
+def _wilson(exitos: np.ndarray, n: np.ndarray, z: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Intervalo de Wilson por elemento (NaN donde n = 0)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = exitos / n
+        z2n = z * z / n
+        centro = (p + z2n / 2) / (1 + z2n)
+        radio = z * np.sqrt(p * (1 - p) / n + z2n / (4 * n)) / (1 + z2n)
+    return centro - radio, centro + radio
+
+
+def evolucion_patron(
+    db: Session,
+    mercado: str,
+    intervalo: str,
+    patron: str,
+    direccion: Optional[str],
+    inicio: datetime,
+    fin: datetime,
+    ventana_seg: int,
+    paso_seg: int,
+    confianza: float = 0.95,
+) -> Dict:
+    """Efectividad del patrón en una ventana [t, t + ventana] que avanza de paso en paso
+    desde inicio mientras quepa antes de fin (mismo criterio que comparar_rango por ventana).
+
+    Cada ocurrencia entra y sale de la ventana una sola vez: los conteos por ventana son
+    diferencias de los acumulados del índice de ocurrencias, todas las ventanas a la vez.
+    Sin dirección se usa la dominante del rango completo, fija para toda la serie.
+    """
+    serie, ind = cache_velas.indice(db, mercado, intervalo, patron)
+
+    ini_s = utc_naive_a_seg(inicio) + (1 if inicio.microsecond else 0)
+    fin_s = utc_naive_a_seg(fin)
+    inicios = np.arange(ini_s, fin_s - ventana_seg + 1, paso_seg, dtype=np.int64)
+    fines = inicios + ventana_seg
+
+    lo = np.searchsorted(serie.ts, inicios, side="left")
+    hi = np.searchsorted(serie.ts, fines, side="right")
+    a, b = ind.tramos(lo, hi)
+    verdes = ind.verdes_acum[b] - ind.verdes_acum[a]
+    muestras = b - a
+    rojas = muestras - verdes
+
+    if direccion not in ("V", "R"):
+        v, r = ind.contar(*limites_rango(serie.ts, inicio, fin))
+        direccion = "V" if v >= r else "R"
+    exitos = verdes if direccion == "V" else rojas
+
+    z = NormalDist().inv_cdf(0.5 + confianza / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        efectividad = exitos / muestras
+    ic_inf, ic_sup = _wilson(exitos, muestras, z)
+
+    return {
+        "direccion": direccion,
+        "inicios": inicios,
+        "fines": fines,
+        "efectividad": efectividad,
+        "muestras": muestras,
+        "verdes": verdes,
+        "rojas": rojas,
+        "ic_inf": ic_inf,
+        "ic_sup": ic_sup,
+    }
@@ -3,6 +3,52 @@ from pydantic_settings import BaseSettings
 class Ajustes(BaseSettings):
     """Ajustes de la API (variables de entorno)."""
     DATABASE_URL: str
+    DATABASE_URL_ASYNC: str = ""       # vacío = DATABASE_URL (postgresql+psycopg sirve en sync y async)
+    ANALISIS_HILOS: int = 0            # hilos para análisis fuera del event loop (0 = default de Python)
+    # velas particionada por mes de fin_ts_utc (solo Postgres; tabla existente: python -m app.particiones migrar)
+    VELAS_PARTICIONADAS: bool = False
+    VELAS_SUBPARTICION_INTERVALOS: str = ""   # p. ej. "5m,15m,1h,4h": cada mes sub-particionado LIST por intervalo
+    VELAS_MESES_ADELANTE: int = 2             # particiones futuras que se crean al iniciar
     CORS_ORIGINS: str = "http://localhost:3000,http://localhost:3001"
+    BARRIDO_PROCESOS: int = 0          # 0 = os.cpu_count()
+    BARRIDO_MAX_COMBINACIONES: int = 200000
+    EVOLUCION_MAX_PUNTOS: int = 20000  # ventanas por consulta en /comparar/evolucion
+    SERVER_TIMING: bool = True         # header Server-Timing con las etapas de cada request
+    COMPRESION_MIN_BYTES: int = 16384  # gzip/brotli (paquete opcional) desde este tamaño; 0 = sin compresión
+    # perfilado por request (X-Perfilar: muestreo|cprofile o ?perfilar=); desactivado por default
+    PERFILADO: bool = False
+    PERFILADO_TOKEN: str = ""          # si se define, también se exige X-Perfilar-Token
+    PERFILADO_DIR: str = "/tmp/polypatron-perfiles"
+    PERFILADO_INTERVALO_MS: float = 2.0
+    # cache de respuestas de análisis: "memoria", "redis" (paquete opcional) o "" = desactivado
+    CACHE_RESPUESTAS: str = "memoria"
+    CACHE_RESPUESTAS_MAX: int = 1024
+    CACHE_RESPUESTAS_MAX_MB: int = 64
+    CACHE_RESPUESTAS_TTL_SEG: int = 3600
+    REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_VELAS_MAX_SERIES: int = 64
+    CACHE_VELAS_MAX_MB: int = 256
+    CACHE_VELAS_MAX_INDICES: int = 128   # índices de patrón por serie (LRU)
+    # archivo bit-packed por par (mmap) que escribe la ingesta; vacío = desactivado
+    ARCHIVO_VELAS_DIR: str = ""
+    ARCHIVO_VELAS_PRECARGAR: bool = True     # al iniciar sube las series archivadas al cache de velas
+    # lo que terminó hace menos de esto se vuelve a pedir a Gamma (puede no estar resuelto aún)
+    COBERTURA_MARGEN_SEG: int = 900
+    GAMMA_BASE: str = "https://gamma-api.polymarket.com"
+    GAMMA_PARALELO: int = 4            # páginas en vuelo a la vez
+    GAMMA_TASA_RPS: float = 10.0       # token bucket (0 = sin límite)
+    GAMMA_RAFAGA: int = 10
+    GAMMA_REINTENTOS: int = 4
+    GAMMA_ESPERA_MAX_SEG: float = 0.0  # tope del Retry-After de Gamma (0 = backoff del último reintento)
+    GAMMA_HTTP2: bool = True
+    # ingesta en segundo plano: "mercado:intervalo,..." (vacío = desactivada)
+    INGESTA_MERCADOS: str = ""
+    INGESTA_BLOQUES_LOOKBACK: int = 12
+    INGESTA_RETRASO_SEG: int = 20      # segundos después del cierre de cada vela
+    INGESTA_EN_API: bool = True        # False si corre como worker aparte (python -m app.ingesta)
+    INGESTA_COLA_PAGINAS: int = 4      # páginas en cola entre etapas del pipeline
+    # ranking por agregados diarios (estadisticas_patron_dia)
+    PATRONES_AGREGADOS: bool = True
+    PATRONES_AGREGADOS_DIAS_POR_CONSULTA: int = 31   # días a materializar como máximo por consulta
 
 ajustes = Ajustes()
@@ -1,10 +1,17 @@
+from typing import Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .config import ajustes
 
 engine = create_engine(ajustes.DATABASE_URL, pool_pre_ping=True)
 SesionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# engine async (psycopg async con la misma URL); se crea al primer uso
+_engine_async: Optional[AsyncEngine] = None
+_SesionAsync: Optional[async_sessionmaker] = None
+
 class Base(DeclarativeBase):
     pass
 
@@ -14,3 +21,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def sesion_async() -> AsyncSession:
+    global _engine_async, _SesionAsync
+    if _SesionAsync is None:
+        _engine_async = create_async_engine(ajustes.DATABASE_URL_ASYNC or ajustes.DATABASE_URL, pool_pre_ping=True)
+        _SesionAsync = async_sessionmaker(_engine_async, autoflush=False, expire_on_commit=False)
+    return _SesionAsync()
+
+async def get_db_async():
+    async with sesion_async() as db:
+        yield db
+
+async def cerrar_engine_async() -> None:
+    global _engine_async, _SesionAsync
+    if _engine_async is not None:
+        await _engine_async.dispose()
+        _engine_async = None
+        _SesionAsync = None
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Vela
+from .particiones import asegurar_meses_async, mes_de, olvidar as olvidar_particiones
+
+_CLAVE_UNICA = ["intervalo", "fin_ts_utc", "slug"]
+# ON CONFLICT DO NOTHING ... RETURNING: Postgres (producción) y SQLite (benchmarks locales)
+_INSERT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+@dataclass
+class ResultadoEscritura:
+    insertadas: int = 0
+    omitidas: int = 0
+    errores: int = 0
+    # fin_ts_utc más antiguo / más nuevo insertado (para invalidar caches aguas abajo)
+    min_fin_ts: Optional[datetime] = None
+    max_fin_ts: Optional[datetime] = None
+
+    def sumar(self, otro: "ResultadoEscritura") -> None:
+        self.insertadas += otro.insertadas
+        self.omitidas += otro.omitidas
+        self.errores += otro.errores
+        if otro.min_fin_ts is not None and (self.min_fin_ts is None or otro.min_fin_ts < self.min_fin_ts):
+            self.min_fin_ts = otro.min_fin_ts
+        if otro.max_fin_ts is not None and (self.max_fin_ts is None or otro.max_fin_ts > self.max_fin_ts):
+            self.max_fin_ts = otro.max_fin_ts
+
+
+def _stmt(filas: List[Dict], dialecto: str = "postgresql"):
+    return (
+        _INSERT[dialecto](Vela.__table__)
+        .values(filas)
+        .on_conflict_do_nothing(index_elements=_CLAVE_UNICA)
+        .returning(Vela.__table__.c.fin_ts_utc)
+    )
+
+
+async def upsert_velas(db: AsyncSession, filas: List[Dict], *, lote: int = 1000) -> ResultadoEscritura:
+    """Inserta velas con INSERT multi-fila ... ON CONFLICT DO NOTHING en una sola transacción.
+
+    Cada fila es un dict con las columnas de Vela (mercado, intervalo, slug, market_id,
+    fin_ts_utc, color, precio_cierre_up, precio_cierre_down, fuente).
+    Si el lote falla se reintenta fila por fila con savepoints para no perder la página.
+    """
+    res = ResultadoEscritura()
+
+    # duplicados dentro del mismo lote no cuentan como omitidos contra la DB
+    unicas: Dict[tuple, Dict] = {}
+    for f in filas:
+        unicas.setdefault((f["intervalo"], f["fin_ts_utc"], f["slug"]), f)
+    res.omitidas += len(filas) - len(unicas)
+    pendientes = list(unicas.values())
+    if not pendientes:
+        return res
+
+    dialecto = db.bind.dialect.name
+    # velas particionada: la partición del mes tiene que existir antes del INSERT (no-op si no aplica)
+    meses = {mes_de(f["fin_ts_utc"]) for f in pendientes}
+    await asegurar_meses_async(db, meses)
+    insertadas: List[datetime] = []
+    try:
+        for i in range(0, len(pendientes), lote):
+            chunk = pendientes[i:i + lote]
+            insertadas.extend(r[0] for r in await db.execute(_stmt(chunk, dialecto)))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        # la partición del mes pudo desaparecer (archivada desde otro proceso): releer el catálogo
+        olvidar_particiones()
+        await asegurar_meses_async(db, meses)
+        insertadas = []
+        for f in pendientes:
+            try:
+                async with db.begin_nested():
+                    insertadas.extend(r[0] for r in await db.execute(_stmt([f], dialecto)))
+            except Exception:
+                res.errores += 1
+        await db.commit()
+
+    res.insertadas += len(insertadas)
+    res.omitidas += len(pendientes) - len(insertadas) - res.errores
+    if insertadas:
+        res.min_fin_ts = min(insertadas)
+        res.max_fin_ts = max(insertadas)
+    return res
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .cache_velas import SerieVelas, cache_velas, limites_rango
+from .config import ajustes
+from .metricas import etapa
+from .models import DiaPatrones, EstadisticaPatronDia
+from .patrones import ConteoLongitudes, RankingPatrones, contar_todas_longitudes, ranking_desde_conteo
+from .utils_time import utc_naive_a_seg
+
+DIA_SEG = 86400
+# se materializan todas las longitudes que acepta /patrones/rankear
+LONGITUD_MIN = 2
+LONGITUD_MAX = 12
+
+_DIA_0 = date(1970, 1, 1)
+
+
+def _fecha(num_dia: int) -> date:
+    return _DIA_0 + timedelta(days=num_dia)
+
+
+def _cortes_dias(ts: np.ndarray, d1: int, d2: int) -> List[int]:
+    """cortes[j] = primer índice de ts en el día d1 + j (j = 0 .. d2 - d1 + 1)."""
+    inicios = np.arange(d1, d2 + 2, dtype=np.int64) * DIA_SEG
+    return np.searchsorted(ts, inicios, side="left").tolist()
+
+
+def _contar_tramo(
+    serie: SerieVelas, desde: int, hasta: int, contexto_desde: int, longitud_min: int, longitud_max: int
+) -> ConteoLongitudes:
+    """Resultados en [desde, hasta) cuyas ventanas empiezan en >= contexto_desde.
+    Las posiciones (primero/ultimo) quedan en epoch seg."""
+    ini = max(contexto_desde, desde - longitud_max)
+    conteo = contar_todas_longitudes(
+        serie.colores[ini:hasta].tolist(), longitud_min, longitud_max, desde=desde - ini
+    )
+    ts = serie.ts
+    for k, p in enumerate(conteo.primero):
+        if p >= 0:
+            conteo.primero[k] = int(ts[ini + p])
+            conteo.ultimo[k] = int(ts[ini + conteo.ultimo[k]])
+    return conteo
+
+
+def refrescar_dias(db: Session, mercado: str, intervalo: str, serie: SerieVelas, dias: Iterable[int]) -> int:
+    """Recalcula desde la serie los días indicados (número de día desde epoch). Regresa cuántos escribió."""
+    escritos = 0
+    tabla = EstadisticaPatronDia.__table__
+    for d in sorted(set(dias)):
+        s, e = _cortes_dias(serie.ts, d, d)
+        conteo = _contar_tramo(serie, s, e, 0, LONGITUD_MIN, LONGITUD_MAX)
+        fecha = _fecha(d)
+
+        filas: List[Dict] = []
+        for L in range(LONGITUD_MIN, LONGITUD_MAX + 1):
+            b = conteo.base[L]
+            for codigo in range(1 << L):
+                k = b + codigo
+                if conteo.verdes[k] == 0 and conteo.rojas[k] == 0:
+                    continue
+                filas.append({
+                    "mercado": mercado,
+                    "intervalo": intervalo,
+                    "dia": fecha,
+                    "longitud": L,
+                    "codigo": codigo,
+                    "verdes": conteo.verdes[k],
+                    "rojas": conteo.rojas[k],
+                    "primera_seg": conteo.primero[k],
+                    "ultima_seg": conteo.ultimo[k],
+                })
+
+        try:
+            db.query(EstadisticaPatronDia).filter(
+                EstadisticaPatronDia.mercado == mercado,
+                EstadisticaPatronDia.intervalo == intervalo,
+                EstadisticaPatronDia.dia == fecha,
+            ).delete(synchronize_session=False)
+            db.query(DiaPatrones).filter(
+                DiaPatrones.mercado == mercado,
+                DiaPatrones.intervalo == intervalo,
+                DiaPatrones.dia == fecha,
+            ).delete(synchronize_session=False)
+            if filas:
+                db.execute(tabla.insert(), filas)
+            db.add(DiaPatrones(mercado=mercado, intervalo=intervalo, dia=fecha, velas=e - s))
+            db.commit()
+            escritos += 1
+        except IntegrityError:
+            # otra consulta materializó el mismo día a la vez
+            db.rollback()
+    return escritos
+
+
+def _velas_materializadas(db: Session, mercado: str, intervalo: str, d1: int, d2: int) -> Dict[int, int]:
+    filas = (
+        db.query(DiaPatrones.dia, DiaPatrones.velas)
+        .filter(DiaPatrones.mercado == mercado)
+        .filter(DiaPatrones.intervalo == intervalo)
+        .filter(DiaPatrones.dia >= _fecha(d1))
+        .filter(DiaPatrones.dia <= _fecha(d2))
+        .all()
+    )
+    return {(f[0] - _DIA_0).days: f[1] for f in filas}
+
+
+def refrescar_insercion(db: Session, mercado: str, intervalo: str, desde: datetime, hasta: datetime) -> int:
+    """Tras insertar velas con fin_ts en [desde, hasta]: recalcula los días ya materializados
+    afectados (incluido el siguiente, cuyas primeras ventanas empiezan el día anterior)."""
+    d1 = utc_naive_a_seg(desde) // DIA_SEG
+    d2 = utc_naive_a_seg(hasta) // DIA_SEG + 1
+    dias = _velas_materializadas(db, mercado, intervalo, d1, d2)
+    if not dias:
+        return 0
+    serie = cache_velas.obtener(db, mercado, intervalo)
+    return refrescar_dias(db, mercado, intervalo, serie, dias.keys())
+
+
+def _sumar_dias(
+    db: Session, mercado: str, intervalo: str, d1: int, d2: int, longitud_min: int, longitud_max: int
+) -> ConteoLongitudes:
+    E = EstadisticaPatronDia
+    conteo = ConteoLongitudes.vacio(longitud_min, longitud_max)
+    filas = (
+        db.query(E.longitud, E.codigo, func.sum(E.verdes), func.sum(E.rojas), func.min(E.primera_seg), func.max(E.ultima_seg))
+        .filter(E.mercado == mercado)
+        .filter(E.intervalo == intervalo)
+        .filter(E.dia >= _fecha(d1))
+        .filter(E.dia <= _fecha(d2))
+        .filter(E.longitud >= longitud_min)
+        .filter(E.longitud <= longitud_max)
+        .group_by(E.longitud, E.codigo)
+        .all()
+    )
+    for L, codigo, verdes, rojas, primera, ultima in filas:
+        k = conteo.base[L] + codigo
+        conteo.verdes[k] = int(verdes)
+        conteo.rojas[k] = int(rojas)
+        conteo.primero[k] = int(primera)
+        conteo.ultimo[k] = int(ultima)
+    return conteo
+
+
+def conteo_rango(
+    db: Session,
+    *,
+    mercado: str,
+    intervalo: str,
+    serie: SerieVelas,
+    lo: int,
+    hi: int,
+    longitud_min: int,
+    longitud_max: int,
+) -> ConteoLongitudes:
+    """Mismo conteo que contar_todas_longitudes sobre serie[lo:hi], con posiciones en epoch seg.
+
+    Los días completos dentro del rango se suman desde estadisticas_patron_dia; los bordes
+    (días parciales y el primer día si sus ventanas empiezan antes de lo) se cuentan directo.
+    """
+    total = ConteoLongitudes.vacio(longitud_min, longitud_max)
+    if hi - lo < 2:
+        return total
+
+    ts = serie.ts
+    d1 = int(ts[lo]) // DIA_SEG
+    d2 = int(ts[hi - 1]) // DIA_SEG
+    cortes = _cortes_dias(ts, d1, d2)
+
+    # días cuyas velas caen todas en el rango y cuyas ventanas no salen de él
+    internos = [
+        d for d in range(d1, d2 + 1)
+        if cortes[d - d1] >= lo + longitud_max and cortes[d - d1 + 1] <= hi
+    ] if longitud_max <= LONGITUD_MAX else []
+
+    usables = set()
+    if internos:
+        materializados = _velas_materializadas(db, mercado, intervalo, internos[0], internos[-1])
+        pendientes = []
+        for d in internos:
+            velas = cortes[d - d1 + 1] - cortes[d - d1]
+            if velas == 0 or materializados.get(d) == velas:
+                usables.add(d)
+            else:
+                pendientes.append(d)
+        pendientes = pendientes[:ajustes.PATRONES_AGREGADOS_DIAS_POR_CONSULTA]
+        if pendientes and refrescar_dias(db, mercado, intervalo, serie, pendientes):
+            materializados = _velas_materializadas(db, mercado, intervalo, pendientes[0], pendientes[-1])
+            usables.update(d for d in pendientes if materializados.get(d) == cortes[d - d1 + 1] - cortes[d - d1])
+
+    # tramos en orden: ("dias", d_ini, d_fin) o ("directo", desde, hasta)
+    tramos: List[Tuple[str, int, int]] = []
+    for d in range(d1, d2 + 1):
+        if d in usables:
+            if tramos and tramos[-1][0] == "dias":
+                tramos[-1] = ("dias", tramos[-1][1], d)
+            else:
+                tramos.append(("dias", d, d))
+            continue
+        s = max(lo, cortes[d - d1])
+        e = min(hi, cortes[d - d1 + 1])
+        if e <= s:
+            continue
+        if tramos and tramos[-1][0] == "directo":
+            tramos[-1] = ("directo", tramos[-1][1], e)
+        else:
+            tramos.append(("directo", s, e))
+
+    for tipo, a, b in tramos:
+        if tipo == "dias":
+            total.anexar(_sumar_dias(db, mercado, intervalo, a, b, longitud_min, longitud_max))
+        else:
+            total.anexar(_contar_tramo(serie, a, b, lo, longitud_min, longitud_max))
+    return total
+
+
+def rankear_rango(
+    db: Session,
+    *,
+    mercado: str,
+    intervalo: str,
+    inicio: datetime,
+    fin: datetime,
+    longitud_min: int,
+    longitud_max: int,
+    min_muestras: int,
+    alpha: float = 0.0,
+    now_utc: Optional[datetime] = None,
+    orden: str = "efectividad",
+    limite: Optional[int] = None,
+    despues_de: Optional[Sequence] = None,
+) -> Optional[RankingPatrones]:
+    """Equivalente a ranking_con_tiempos sobre las velas del rango, usando los agregados diarios
+    (None si el rango no alcanza para longitud_max)."""
+    Lmin = max(2, int(longitud_min))
+    Lmax = max(Lmin, int(longitud_max))
+
+    serie = cache_velas.obtener(db, mercado, intervalo)
+    lo, hi = limites_rango(serie.ts, inicio, fin)
+    if hi - lo < Lmax + 2:
+        return None
+
+    with etapa("conteo"):
+        conteo = conteo_rango(
+            db,
+            mercado=mercado,
+            intervalo=intervalo,
+            serie=serie,
+            lo=lo,
+            hi=hi,
+            longitud_min=Lmin,
+            longitud_max=Lmax,
+        )
+        return ranking_desde_conteo(
+            conteo,
+            min_muestras=min_muestras,
+            alpha=alpha,
+            now_utc=now_utc,
+            a_seg=int,
+            orden=orden,
+            limite=limite,
+            despues_de=despues_de,
+        )
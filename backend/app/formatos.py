@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import importlib.util
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import Response
+
+from .metricas import etapa
+
+# Formatos columnares por content negotiation (Accept); sin ellos se responde el JSON por filas
+JSON_COLUMNAS = "application/vnd.polypatron.columnas+json"
+MSGPACK = "application/vnd.msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+_POR_TIPO: Dict[str, Optional[str]] = {
+    JSON_COLUMNAS: JSON_COLUMNAS,
+    MSGPACK: MSGPACK,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    ARROW: ARROW,
+    "application/json": None,
+}
+# paquetes opcionales: el formato solo se ofrece si están instalados
+_PAQUETE = {MSGPACK: "msgpack", ARROW: "pyarrow"}
+
+_COMPRIMIBLES = ("application/json", "application/vnd.", "application/msgpack", "application/x-msgpack", "text/")
+_GZIP_NIVEL = 6
+_BROTLI_CALIDAD = 5
+
+Columna = Union[np.ndarray, List[Any]]
+
+
+@dataclass
+class Tabla:
+    """Respuesta columnar: escalares en meta y columnas paralelas del mismo largo.
+
+    Columnas: arreglos numpy int64/float64, bool (1 bit por fila en JSON y MessagePack)
+    o listas de str/int con None como nulo.
+    """
+    meta: Dict[str, Any]
+    columnas: Dict[str, Columna] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columnas.values()))) if self.columnas else 0
+
+
+@lru_cache(maxsize=None)
+def _instalado(paquete: str) -> bool:
+    return importlib.util.find_spec(paquete) is not None
+
+
+def _disponible(formato: Optional[str]) -> bool:
+    paquete = _PAQUETE.get(formato)
+    return paquete is None or _instalado(paquete)
+
+
+def formato_solicitado(request: Request) -> Optional[str]:
+    """Formato columnar con mayor q en Accept (None = JSON por filas de siempre)."""
+    mejor, mejor_q = None, 0.0
+    for parte in request.headers.get("accept", "").split(","):
+        tipo, *params = (p.strip() for p in parte.split(";"))
+        tipo = tipo.lower()
+        if tipo not in _POR_TIPO or not _disponible(_POR_TIPO[tipo]):
+            continue
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if q > mejor_q:
+            mejor, mejor_q = _POR_TIPO[tipo], q
+    return mejor
+
+
+def _bits(a: np.ndarray) -> bytes:
+    return np.packbits(a.astype(bool, copy=False), bitorder="little").tobytes()
+
+
+def _documento(tabla: Tabla, binario: bool) -> Dict[str, Any]:
+    columnas: Dict[str, Any] = {}
+    for nombre, col in tabla.columnas.items():
+        if isinstance(col, np.ndarray) and col.dtype == bool:
+            bits = _bits(col)
+            columnas[nombre] = {"bits": bits if binario else base64.b64encode(bits).decode(), "n": len(col)}
+        else:
+            columnas[nombre] = col.tolist() if isinstance(col, np.ndarray) else col
+    return {**tabla.meta, "n": len(tabla), "columnas": columnas}
+
+
+def _arrow(tabla: Tabla) -> bytes:
+    import pyarrow as pa  # dependencia opcional
+
+    t = pa.table({nombre: pa.array(col) for nombre, col in tabla.columnas.items()})
+    t = t.replace_schema_metadata({"polypatron": json.dumps(tabla.meta, separators=(",", ":"))})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, t.schema) as escritor:
+        escritor.write_table(t)
+    return sink.getvalue().to_pybytes()
+
+
+def codificar(tabla: Tabla, formato: str) -> bytes:
+    if formato == ARROW:
+        return _arrow(tabla)
+    if formato == MSGPACK:
+        import msgpack  # dependencia opcional
+
+        return msgpack.packb(_documento(tabla, binario=True), use_bin_type=True)
+    return json.dumps(_documento(tabla, binario=False), separators=(",", ":")).encode()
+
+
+def responder(tabla: Tabla, formato: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    with etapa("serializacion"):
+        cuerpo = codificar(tabla, formato)
+    return Response(cuerpo, media_type=formato, headers={"Vary": "Accept", **(headers or {})})
+
+
+def codificacion_aceptada(accept_encoding: str) -> Optional[str]:
+    """'br' (si está el paquete brotli) o 'gzip' según Accept-Encoding."""
+    aceptadas = set()
+    for parte in accept_encoding.lower().split(","):
+        nombre, *params = (p.strip() for p in parte.split(";"))
+        q = next((p[2:] for p in params if p.startswith("q=")), "1")
+        try:
+            if float(q) > 0:
+                aceptadas.add(nombre)
+        except ValueError:
+            pass
+    if "br" in aceptadas and _instalado("brotli"):
+        return "br"
+    if "gzip" in aceptadas:
+        return "gzip"
+    return None
+
+
+def comprimible(content_type: str) -> bool:
+    return content_type.lower().startswith(_COMPRIMIBLES)
+
+
+def comprimir(cuerpo: bytes, codificacion: str) -> bytes:
+    if codificacion == "br":
+        import brotli  # dependencia opcional
+
+        return brotli.compress(cuerpo, quality=_BROTLI_CALIDAD)
+    return gzip.compress(cuerpo, compresslevel=_GZIP_NIVEL)
+
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from .config import ajustes
+from .perfilado import perfil_activo
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _obtener_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=ajustes.ANALISIS_HILOS or None, thread_name_prefix="analisis")
+    return _pool
+
+
+async def en_hilo(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Corre fn en el pool de análisis sin bloquear el event loop.
+
+    Para el código síncrono de los endpoints: consultas con la Session de la request
+    (que la usa un solo hilo a la vez) y cálculo numpy sobre el cache de velas.
+    Corre con una copia del contexto, así las etapas medidas en el hilo cuentan para la request.
+    """
+    loop = asyncio.get_running_loop()
+    perfil = perfil_activo()
+    if perfil is not None:
+        fn = perfil.envolver(fn)
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_obtener_pool(), partial(ctx.run, fn, *args, **kwargs))
+
+
+def cerrar_hilos() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
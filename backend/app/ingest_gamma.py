@@ -1,11 +1,152 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
+import asyncio
 import json
+import time
+from collections import deque
 import httpx
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-GAMMA_BASE = "https://gamma-api.polymarket.com"
+from .config import ajustes
+from .metricas import contar
+
+GAMMA_BASE = ajustes.GAMMA_BASE
+
+class LimitadorTasa:
+    """Token bucket: 'tasa' tokens/seg con ráfaga máxima 'rafaga'."""
+
+    def __init__(self, tasa: float, rafaga: int):
+        self.tasa = float(tasa)
+        self.rafaga = max(1, int(rafaga))
+        self._tokens = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _candado(self) -> asyncio.Lock:
+        # un Lock queda atado al loop donde se usa: uno nuevo por event loop
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        return self._lock
+
+    async def adquirir(self) -> None:
+        if self.tasa <= 0:
+            return
+        async with self._candado():
+            while True:
+                ahora = time.monotonic()
+                self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.tasa)
+
+class ClienteGamma:
+    """Cliente async compartido para Gamma: pool keep-alive (HTTP/2 opcional),
+    concurrencia acotada, limitador de tasa y reintentos con backoff en 429/5xx.
+
+    El pool de httpx y el semáforo se crean al primer uso en cada event loop (la instancia
+    del módulo la usan la API, el worker, el bench y TestClient, cada uno con su loop).
+    """
+
+    def __init__(
+        self,
+        base_url: str = GAMMA_BASE,
+        *,
+        paralelo: int = 4,
+        tasa: float = 10.0,
+        rafaga: int = 10,
+        reintentos: int = 4,
+        backoff_seg: float = 0.5,
+        espera_max_seg: float = 0.0,
+        http2: bool = True,
+        timeout: float = 30,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.paralelo = max(1, int(paralelo))
+        self.reintentos = max(0, int(reintentos))
+        self.backoff_seg = backoff_seg
+        # tope para Retry-After (0 = el backoff del último reintento)
+        self.espera_max_seg = espera_max_seg if espera_max_seg > 0 else backoff_seg * (2 ** self.reintentos)
+        self.http2 = http2
+        self.timeout = timeout
+        self.transport = transport
+        self.limitador = LimitadorTasa(tasa, rafaga)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.paginas = 0
+        self.reintentos_hechos = 0
+
+    def _obtener_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # las conexiones del loop anterior no sirven en este (y ese loop pudo ya cerrarse)
+            self._loop = loop
+            self._client = None
+            self._semaforo = asyncio.Semaphore(self.paralelo)
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.paralelo, max_keepalive_connections=self.paralelo),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def cerrar(self) -> None:
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    async def get(self, path: str, params: list[tuple[str, str]]) -> httpx.Response:
+        """GET con reintentos; regresa la respuesta final (incluye 422 para que el llamador decida)."""
+        client = self._obtener_client()
+        intento = 0
+        while True:
+            await self.limitador.adquirir()
+            try:
+                async with self._semaforo:
+                    r = await client.get(path, params=params)
+            except httpx.TransportError:
+                if intento >= self.reintentos:
+                    raise
+            else:
+                if r.status_code != 429 and r.status_code < 500:
+                    # solo las 2xx son páginas; un 4xx (p. ej. el 422) lo decide el llamador
+                    if r.is_success:
+                        self.paginas += 1
+                        contar("gamma_paginas")
+                    return r
+                if intento >= self.reintentos:
+                    return r
+                espera = r.headers.get("Retry-After")
+                if espera and espera.isdigit():
+                    intento += 1
+                    self.reintentos_hechos += 1
+                    contar("gamma_reintentos")
+                    await asyncio.sleep(min(float(espera), self.espera_max_seg))
+                    continue
+            intento += 1
+            self.reintentos_hechos += 1
+            contar("gamma_reintentos")
+            await asyncio.sleep(self.backoff_seg * (2 ** (intento - 1)))
+
+cliente_gamma = ClienteGamma(
+    GAMMA_BASE,
+    paralelo=ajustes.GAMMA_PARALELO,
+    tasa=ajustes.GAMMA_TASA_RPS,
+    rafaga=ajustes.GAMMA_RAFAGA,
+    reintentos=ajustes.GAMMA_REINTENTOS,
+    espera_max_seg=ajustes.GAMMA_ESPERA_MAX_SEG,
+    http2=ajustes.GAMMA_HTTP2,
+)
 
 @dataclass
 class MercadoGamma:
@@ -52,23 +193,123 @@ def construir_slugs(prefix: str, paso_seg: int, bloques: int) -> list[str]:
     alineado = (ahora // paso_seg) * paso_seg
     return [f"{prefix}{alineado - i*paso_seg}" for i in range(1, bloques + 1)]
 
-async def traer_markets_por_slugs(slugs: list[str], closed: bool = True, limit: int = 200) -> list[dict]:
+async def traer_markets_por_slugs(
+    slugs: list[str],
+    closed: bool = True,
+    limit: int = 200,
+    *,
+    cliente: Optional[ClienteGamma] = None,
+) -> list[dict]:
+    cliente = cliente or cliente_gamma
+    chunk_size = 120
+
+    async def _chunk(chunk: list[str]) -> Optional[list]:
+        params = [("closed", str(closed).lower()), ("limit", str(limit))]
+        params += [("slug", s) for s in chunk]
+        r = await cliente.get("/markets", params)
+        if r.status_code == 422:
+            return None
+        r.raise_for_status()
+        data = r.json()
+        return data if isinstance(data, list) else []
+
+    chunks = [slugs[i:i + chunk_size] for i in range(0, len(slugs), chunk_size)]
     out: list[dict] = []
-    async with httpx.AsyncClient(timeout=30) as client:
-        chunk_size = 120
-        for i in range(0, len(slugs), chunk_size):
-            chunk = slugs[i:i + chunk_size]
-            params = [("closed", str(closed).lower()), ("limit", str(limit))]
-            params += [("slug", s) for s in chunk]
-            r = await client.get(f"{GAMMA_BASE}/markets", params=params)
-            if r.status_code == 422:
-                return []
-            r.raise_for_status()
-            data = r.json()
-            if isinstance(data, list):
-                out.extend(data)
+    for data in await asyncio.gather(*(_chunk(c) for c in chunks)):
+        if data is None:
+            return []
+        out.extend(data)
     return out
 
+def _params_markets(
+    *,
+    closed: bool,
+    limit: int,
+    offset: int,
+    start_date_min: Optional[datetime],
+    start_date_max: Optional[datetime],
+    end_date_min: Optional[datetime],
+    end_date_max: Optional[datetime],
+    order: str,
+    ascending: bool,
+) -> list[tuple[str, str]]:
+    params: list[tuple[str, str]] = [
+        ("limit", str(limit)),
+        ("offset", str(offset)),
+        ("order", order),
+        ("ascending", str(ascending).lower()),
+    ]
+    if start_date_min:
+        params.append(("start_date_min", start_date_min.replace(tzinfo=timezone.utc).isoformat()))
+    if start_date_max:
+        params.append(("start_date_max", start_date_max.replace(tzinfo=timezone.utc).isoformat()))
+    if end_date_min:
+        params.append(("end_date_min", end_date_min.replace(tzinfo=timezone.utc).isoformat()))
+    if end_date_max:
+        params.append(("end_date_max", end_date_max.replace(tzinfo=timezone.utc).isoformat()))
+    params.append(("closed", str(closed).lower()))
+    return params
+
+class RechazoGamma(Exception):
+    """Gamma respondió 422 a la consulta (filtros no aceptados)."""
+
+async def paginas_markets(
+    *,
+    closed: bool,
+    limit: int,
+    max_pages: int,
+    start_date_min: Optional[datetime],
+    start_date_max: Optional[datetime],
+    end_date_min: Optional[datetime],
+    end_date_max: Optional[datetime],
+    order: str = "id",
+    ascending: bool = False,
+    cliente: Optional[ClienteGamma] = None,
+) -> AsyncIterator[list[dict]]:
+    """Generador async de páginas de /markets, en orden de offset.
+    Mantiene hasta 'cliente.paralelo' páginas en vuelo (ventana deslizante) y
+    corta en la primera página incompleta. Lanza RechazoGamma en 422.
+    """
+    cliente = cliente or cliente_gamma
+
+    async def _pagina(offset: int) -> Optional[list]:
+        r = await cliente.get("/markets", _params_markets(
+            closed=closed,
+            limit=limit,
+            offset=offset,
+            start_date_min=start_date_min,
+            start_date_max=start_date_max,
+            end_date_min=end_date_min,
+            end_date_max=end_date_max,
+            order=order,
+            ascending=ascending,
+        ))
+        if r.status_code == 422:
+            return None
+        r.raise_for_status()
+        data = r.json()
+        return data if isinstance(data, list) else []
+
+    en_vuelo: deque[asyncio.Task] = deque()
+    siguiente = 0
+    try:
+        while True:
+            while len(en_vuelo) < cliente.paralelo and siguiente < max_pages:
+                en_vuelo.append(asyncio.create_task(_pagina(siguiente * limit)))
+                siguiente += 1
+            if not en_vuelo:
+                return
+            data = await en_vuelo.popleft()
+            if data is None:
+                raise RechazoGamma("gamma /markets respondió 422")
+            if data:
+                yield data
+            if len(data) < limit:
+                return
+    finally:
+        for t in en_vuelo:
+            t.cancel()
+
 async def backfill_markets(
     *,
     closed: bool,
@@ -79,63 +320,52 @@ async def backfill_markets(
     end_date_min: Optional[datetime],
     end_date_max: Optional[datetime],
     order: str = "id",
-    ascending: bool = False
+    ascending: bool = False,
+    cliente: Optional[ClienteGamma] = None,
 ) -> list[dict]:
     """Consulta paginada a /markets con filtros de fechas.
     Nota: Gamma espera ISO8601 con tz.
+    Junta todas las páginas de paginas_markets en una lista (para ingestas grandes
+    conviene consumir el generador directamente).
     """
     out: list[dict] = []
-    async with httpx.AsyncClient(timeout=30) as client:
-        offset = 0
-        for _ in range(max_pages):
-            params: list[tuple[str, str]] = [
-                ("limit", str(limit)),
-                ("offset", str(offset)),
-                ("order", order),
-                ("ascending", str(ascending).lower()),
-            ]
-            if start_date_min:
-                params.append(("start_date_min", start_date_min.replace(tzinfo=timezone.utc).isoformat()))
-            if start_date_max:
-                params.append(("start_date_max", start_date_max.replace(tzinfo=timezone.utc).isoformat()))
-            if end_date_min:
-                params.append(("end_date_min", end_date_min.replace(tzinfo=timezone.utc).isoformat()))
-            if end_date_max:
-                params.append(("end_date_max", end_date_max.replace(tzinfo=timezone.utc).isoformat()))
-            params.append(("closed", str(closed).lower()))
-
-            r = await client.get(f"{GAMMA_BASE}/markets", params=params)
-            if r.status_code == 422:
-                return []
-            r.raise_for_status()
-            data = r.json()
-            if not isinstance(data, list) or not data:
-                break
+    try:
+        async for data in paginas_markets(
+            closed=closed,
+            limit=limit,
+            max_pages=max_pages,
+            start_date_min=start_date_min,
+            start_date_max=start_date_max,
+            end_date_min=end_date_min,
+            end_date_max=end_date_max,
+            order=order,
+            ascending=ascending,
+            cliente=cliente,
+        ):
             out.extend(data)
-            if len(data) < limit:
-                break
-            offset += limit
+    except RechazoGamma:
+        return []
     return out
 
 def extraer_campos_vela(m: dict) -> tuple[Optional[str], Optional[datetime], Optional[str], Optional[str], Optional[float], Optional[float]]:
     """Regresa: (market_id, fin_ts_utc_naive, slug, color, up_price, down_price)"""
     market_id = str(m.get("id") or "")
     slug = str(m.get("slug") or "")
-    end_date = m.get("endDate")
     outcomes = m.get("outcomes")
     outcome_prices = m.get("outcomePrices")
 
     color, up_p, down_p = _color_ganador(outcomes, outcome_prices)
+    return market_id, fin_de_market(m), slug, color, up_p, down_p
 
-    fin_ts = None
-    if isinstance(end_date, str) and end_date:
-        try:
-            dt = datetime.fromisoformat(end_date.replace("Z", "+00:00")).astimezone(timezone.utc)
-            fin_ts = dt.replace(tzinfo=None)
-        except Exception:
-            fin_ts = None
-
-    return market_id, fin_ts, slug, color, up_p, down_p
+def fin_de_market(m: dict) -> Optional[datetime]:
+    """endDate del market en UTC naive (None si falta o no se puede leer)."""
+    end_date = m.get("endDate")
+    if not isinstance(end_date, str) or not end_date:
+        return None
+    try:
+        return datetime.fromisoformat(end_date.replace("Z", "+00:00")).astimezone(timezone.utc).replace(tzinfo=None)
+    except Exception:
+        return None
 
 def rango_utc_para_lookback(paso_seg: int, bloques: int) -> tuple[datetime, datetime]:
     """Rango (end_date_min, end_date_max) en UTC para traer los últimos N bloques."""
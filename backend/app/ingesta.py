@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .archivo_velas import actualizar as actualizar_archivo
+from .cache_respuestas import cache_respuestas
+from .cache_velas import cache_velas
+from .cobertura import horizonte_cerrado, huecos, registrar
+from .config import ajustes
+from .db import SesionLocal, sesion_async
+from .escritor_velas import ResultadoEscritura, upsert_velas
+from .estadisticas_patrones import refrescar_insercion
+from .hilos import en_hilo
+from .metricas import contar, etapa, registrar_etapa
+from .ingest_gamma import RechazoGamma, extraer_campos_vela, fin_de_market, paginas_markets
+from .utils_time import iso_a_utc_naive
+
+log = logging.getLogger(__name__)
+
+PASO_SEG: Dict[str, int] = {"5m": 300, "15m": 900, "1h": 3600, "4h": 14400}
+
+
+PAGINA_GAMMA = 500
+
+
+def prefix_por_defecto(mercado: str, intervalo: str, override: str = "") -> str:
+    if override:
+        return override
+    return f"{mercado}-{intervalo}-"
+
+
+def _a_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _filas_de_pagina(pagina: List[dict], *, mercado: str, intervalo: str, prefix: str) -> List[Dict]:
+    filas: List[Dict] = []
+    for m in pagina:
+        market_id, fin_ts, slug, color, up_p, down_p = extraer_campos_vela(m)
+        if not slug or not slug.startswith(prefix):
+            continue
+        if not market_id or fin_ts is None or color is None:
+            continue
+        filas.append({
+            "mercado": mercado,
+            "intervalo": intervalo,
+            "slug": slug,
+            "market_id": market_id,
+            "fin_ts_utc": fin_ts,
+            "color": color,
+            "precio_cierre_up": up_p,
+            "precio_cierre_down": down_p,
+            "fuente": "gamma",
+        })
+    return filas
+
+
+async def ingerir_tramo(
+    *,
+    mercado: str,
+    intervalo: str,
+    prefix: str,
+    inicio: datetime,
+    fin: datetime,
+    max_pages: int,
+) -> Tuple[ResultadoEscritura, Optional[datetime]]:
+    """Trae de Gamma los mercados cerrados con endDate en [inicio, fin] y los guarda.
+    Regresa (resultado, cubierto_desde): [cubierto_desde, fin] quedó ingerido por completo
+    (None si nada, p. ej. si Gamma rechazó la consulta).
+
+    /markets no filtra por prefix: la página incluye todas las series. Se pide por endDate
+    descendente, así al cortar en max_pages todo lo posterior al endDate más viejo visto ya
+    pasó; el tramo completo es el de la última página incompleta o si ese endDate llega a inicio.
+
+    Pipeline por página con colas acotadas: traer -> parsear/filtrar por prefix -> escribir.
+    La escritura (una transacción por página, sesión async) se traslapa con las siguientes
+    descargas sin ocupar el event loop; la memoria queda acotada por el tamaño de las colas.
+    """
+    cola_paginas: asyncio.Queue = asyncio.Queue(maxsize=ajustes.INGESTA_COLA_PAGINAS)
+    cola_filas: asyncio.Queue = asyncio.Queue(maxsize=ajustes.INGESTA_COLA_PAGINAS)
+    resultado = ResultadoEscritura()
+    paginas = 0
+    ultima_corta = False
+    mas_viejo: Optional[datetime] = None
+    rechazo = False
+
+    async def _traer() -> None:
+        nonlocal paginas, ultima_corta, mas_viejo, rechazo
+        t = time.perf_counter()
+        try:
+            async for pagina in paginas_markets(
+                closed=True,
+                limit=PAGINA_GAMMA,
+                max_pages=max_pages,
+                start_date_min=None,
+                start_date_max=None,
+                end_date_min=_a_utc(inicio),
+                end_date_max=_a_utc(fin),
+                order="endDate",
+                ascending=False,
+            ):
+                paginas += 1
+                ultima_corta = len(pagina) < PAGINA_GAMMA
+                fines = [f for f in map(fin_de_market, pagina) if f is not None]
+                if fines:
+                    mas_viejo = min(fines) if mas_viejo is None else min(mas_viejo, *fines)
+                await cola_paginas.put(pagina)
+        except RechazoGamma:
+            rechazo = True
+        finally:
+            # tiempo de pared del paginado (se traslapa con parseo y escritura)
+            registrar_etapa("gamma", time.perf_counter() - t)
+            await cola_paginas.put(None)
+
+    async def _parsear() -> None:
+        try:
+            while (pagina := await cola_paginas.get()) is not None:
+                filas = _filas_de_pagina(pagina, mercado=mercado, intervalo=intervalo, prefix=prefix)
+                if filas:
+                    await cola_filas.put(filas)
+        finally:
+            await cola_filas.put(None)
+
+    async def _escribir() -> None:
+        async with sesion_async() as db:
+            while (filas := await cola_filas.get()) is not None:
+                with etapa("escritura"):
+                    parcial = await upsert_velas(db, filas)
+                contar("velas_insertadas", parcial.insertadas)
+                resultado.sumar(parcial)
+
+    etapas = [asyncio.create_task(f()) for f in (_traer, _parsear, _escribir)]
+    try:
+        await asyncio.gather(*etapas)
+    except BaseException:
+        for t in etapas:
+            t.cancel()
+        await asyncio.gather(*etapas, return_exceptions=True)
+        raise
+
+    if rechazo:
+        return resultado, None
+    inicio_n = iso_a_utc_naive(inicio)
+    # menos de max_pages páginas: paginas_markets cortó en una incompleta (o vacía)
+    if paginas < max_pages or ultima_corta or (mas_viejo is not None and mas_viejo <= inicio_n):
+        return resultado, inicio_n
+    if mas_viejo is None:
+        return resultado, None
+    # lo del mismo endDate que el más viejo visto puede seguir en la página siguiente
+    return resultado, mas_viejo + timedelta(seconds=1)
+
+
+async def asegurar_datos_en_rango(
+    db: Session,
+    *,
+    mercado: str,
+    intervalo: str,
+    inicio: datetime,
+    fin: datetime,
+    prefix_override: str = "",
+    max_pages: int = 30,
+    incluir_cola: Optional[bool] = None,
+) -> ResultadoEscritura:
+    """Solo consulta Gamma para los huecos de cobertura del rango (más la cola abierta).
+
+    incluir_cola=None: la cola abierta se pide solo si el par no lo mantiene la ingesta en
+    segundo plano, aquí o en un worker aparte (así las consultas leen del store local).
+    """
+    prefix = prefix_por_defecto(mercado, intervalo, prefix_override)
+    ahora = datetime.now(timezone.utc)
+    horizonte = horizonte_cerrado(ahora, ajustes.COBERTURA_MARGEN_SEG)
+    if incluir_cola is None:
+        incluir_cola = not servicio_ingesta.mantiene_cola(mercado, intervalo)
+
+    fin_n = iso_a_utc_naive(fin)
+    if not incluir_cola:
+        # lo reciente (ventana de bloques_lookback) lo mantiene el servicio de ingesta
+        fin_n = min(fin_n, horizonte, servicio_ingesta.inicio_ventana(intervalo, ahora))
+
+    resultado = ResultadoEscritura()
+    # la Session síncrona de la request solo se usa desde el pool de análisis
+    with etapa("cobertura"):
+        faltan = await en_hilo(huecos, db, mercado, intervalo, inicio, fin_n, horizonte)
+    for desde, hasta in faltan:
+        parcial, cubierto_desde = await ingerir_tramo(
+            mercado=mercado,
+            intervalo=intervalo,
+            prefix=prefix,
+            inicio=desde,
+            fin=hasta,
+            max_pages=max_pages,
+        )
+        resultado.sumar(parcial)
+        # la cola abierta (después del horizonte) nunca se marca como cubierta
+        tope = min(hasta, horizonte)
+        if cubierto_desde is not None and cubierto_desde < tope:
+            await en_hilo(registrar, db, mercado, intervalo, cubierto_desde, tope)
+
+    if resultado.min_fin_ts is not None:
+        if ajustes.ARCHIVO_VELAS_DIR:
+            # antes de avisar al cache: una carga en frío posterior parte del archivo al día
+            with etapa("archivo"):
+                await en_hilo(actualizar_archivo, db, mercado, intervalo, resultado.min_fin_ts)
+        cache_velas.notificar_insercion(mercado, intervalo, resultado.min_fin_ts)
+        await cache_respuestas.invalidar_async(mercado, intervalo)
+        if ajustes.PATRONES_AGREGADOS:
+            with etapa("agregados"):
+                await en_hilo(refrescar_insercion, db, mercado, intervalo, resultado.min_fin_ts, resultado.max_fin_ts)
+    return resultado
+
+
+async def ingerir_ultimas(
+    db: Session,
+    *,
+    mercado: str,
+    intervalo: str,
+    bloques_lookback: int,
+    prefix_override: str = "",
+    ahora: Optional[datetime] = None,
+) -> Tuple[ResultadoEscritura, datetime, datetime]:
+    """Ingiere solo las últimas N velas cerradas del par (incluida la cola abierta)."""
+    ahora = ahora or datetime.now(timezone.utc)
+    inicio = ahora - timedelta(seconds=PASO_SEG[intervalo] * bloques_lookback)
+    res = await asegurar_datos_en_rango(
+        db,
+        mercado=mercado,
+        intervalo=intervalo,
+        inicio=inicio,
+        fin=ahora,
+        prefix_override=prefix_override,
+        incluir_cola=True,
+    )
+    return res, inicio, ahora
+
+
+@dataclass
+class EstadoTarea:
+    mercado: str
+    intervalo: str
+    activo: bool = False
+    ejecuciones: int = 0
+    insertadas_total: int = 0
+    ultima_ejecucion_utc: Optional[datetime] = None
+    proxima_ejecucion_utc: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+
+
+def _parsear_mercados(texto: str) -> List[Tuple[str, str]]:
+    """'btc-updown:5m,eth-updown:1h' -> [("btc-updown", "5m"), ("eth-updown", "1h")]"""
+    out: List[Tuple[str, str]] = []
+    for item in texto.split(","):
+        item = item.strip()
+        if not item or ":" not in item:
+            continue
+        mercado, intervalo = (x.strip() for x in item.rsplit(":", 1))
+        if mercado and intervalo in PASO_SEG:
+            out.append((mercado, intervalo))
+    return out
+
+
+def proxima_ejecucion(ahora: datetime, paso_seg: int, retraso_seg: int) -> datetime:
+    """Siguiente cierre de vela alineado al intervalo, más un retraso para que Gamma lo resuelva."""
+    ts = ahora.timestamp()
+    siguiente = (int(ts - retraso_seg) // paso_seg + 1) * paso_seg + retraso_seg
+    return datetime.fromtimestamp(siguiente, tz=timezone.utc)
+
+
+class ServicioIngesta:
+    """Mantiene al día cada (mercado, intervalo) configurado con una tarea asyncio por par."""
+
+    def __init__(self, pares: List[Tuple[str, str]], bloques_lookback: int, retraso_seg: int):
+        self.pares = pares
+        self.bloques_lookback = bloques_lookback
+        self.retraso_seg = retraso_seg
+        self.estados: Dict[Tuple[str, str], EstadoTarea] = {
+            par: EstadoTarea(mercado=par[0], intervalo=par[1]) for par in pares
+        }
+        self._tareas: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def gestiona(self, mercado: str, intervalo: str) -> bool:
+        return (mercado, intervalo) in self.estados
+
+    def mantiene_cola(self, mercado: str, intervalo: str) -> bool:
+        """¿Alguien mantiene al día la cola del par? Se decide por configuración: con
+        INGESTA_EN_API=false la mantiene el worker (python -m app.ingesta, mismos
+        INGESTA_MERCADOS) aunque aquí no corra; si no, la tarea de este proceso."""
+        estado = self.estados.get((mercado, intervalo))
+        if estado is None:
+            return False
+        return not ajustes.INGESTA_EN_API or estado.activo
+
+    def inicio_ventana(self, intervalo: str, ahora: datetime) -> datetime:
+        """Desde dónde cada ciclo vuelve a pedir a Gamma (UTC naive)."""
+        return iso_a_utc_naive(ahora) - timedelta(seconds=PASO_SEG[intervalo] * self.bloques_lookback)
+
+    async def ejecutar_una_vez(
+        self, mercado: str, intervalo: str, bloques_lookback: Optional[int] = None, prefix_override: str = ""
+    ) -> Tuple[ResultadoEscritura, datetime, datetime]:
+        estado = self.estados.get((mercado, intervalo))
+        db = SesionLocal()
+        try:
+            res, desde, hasta = await ingerir_ultimas(
+                db,
+                mercado=mercado,
+                intervalo=intervalo,
+                bloques_lookback=bloques_lookback or self.bloques_lookback,
+                prefix_override=prefix_override,
+            )
+        except Exception as e:
+            if estado is not None:
+                estado.ultimo_error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            db.close()
+        if estado is not None:
+            estado.ejecuciones += 1
+            estado.insertadas_total += res.insertadas
+            estado.ultima_ejecucion_utc = hasta
+            estado.ultimo_error = None
+        return res, desde, hasta
+
+    async def _bucle(self, mercado: str, intervalo: str) -> None:
+        estado = self.estados[(mercado, intervalo)]
+        paso = PASO_SEG[intervalo]
+        while True:
+            try:
+                await self.ejecutar_una_vez(mercado, intervalo)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("ingesta %s %s falló", mercado, intervalo)
+            estado.proxima_ejecucion_utc = proxima_ejecucion(datetime.now(timezone.utc), paso, self.retraso_seg)
+            espera = (estado.proxima_ejecucion_utc - datetime.now(timezone.utc)).total_seconds()
+            await asyncio.sleep(max(0.0, espera))
+
+    def iniciar(self) -> None:
+        for par in self.pares:
+            tarea = self._tareas.get(par)
+            if tarea is None or tarea.done():
+                self._tareas[par] = asyncio.create_task(self._bucle(*par))
+                self.estados[par].activo = True
+
+    async def detener(self) -> None:
+        tareas = list(self._tareas.values())
+        for t in tareas:
+            t.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self._tareas.clear()
+        for estado in self.estados.values():
+            estado.activo = False
+
+    async def correr(self) -> None:
+        """Modo worker: corre hasta que lo cancelen."""
+        self.iniciar()
+        try:
+            await asyncio.gather(*self._tareas.values())
+        finally:
+            await self.detener()
+
+
+servicio_ingesta = ServicioIngesta(
+    pares=_parsear_mercados(ajustes.INGESTA_MERCADOS),
+    bloques_lookback=ajustes.INGESTA_BLOQUES_LOOKBACK,
+    retraso_seg=ajustes.INGESTA_RETRASO_SEG,
+)
+
+
+if __name__ == "__main__":
+    # Worker aparte: python -m app.ingesta (con INGESTA_EN_API=false en la API)
+    from .db import Base, engine
+    from .particiones import preparar
+
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    preparar(engine)
+    asyncio.run(servicio_ingesta.correr())
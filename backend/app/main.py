@@ -1,32 +1,55 @@
 from __future__ import annotations
 
+import time
 from datetime import datetime, timezone
-from typing import List, Tuple
+from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException
+import numpy as np
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy.dialects.postgresql import insert
 
 from .config import ajustes
-from .db import Base, engine, get_db
+from .db import Base, cerrar_engine_async, engine, get_db, get_db_async
 from .models import Vela
 from .schemas import (
+    ReqIngestLive, ResIngestLive, EstadoIngesta, ResEstadoIngesta,
     ReqRankearPatrones, ResRankearPatrones, FilaPatron,
-    ReqSimular, ResSimular, TradeSim,
-    ResUltimaVela, ReqCompararVentanas, ResCompararVentanas, FilaComparacion,
+    ReqSimular, ResSimular, TradeSim, TradesColumnas,
+    ReqSimularBarrido, ResSimularBarrido, FilaBarrido,
+    ResUltimaVela, ResCacheVelas, ResCacheRespuestas, ReqCompararVentanas, ResCompararVentanas, FilaComparacion,
     ResHistorialPatron, OcurrenciaPatron,
     ReqCompararRango, ResCompararRango,
     ReqCompararAVsB, ResCompararAVsB,
     ReqCompararPatronesVs, ResCompararPatronesVs, ResPatronMetricas,
+    ReqCompararLote, ResCompararLote,
+    ReqEvolucionPatron, ResEvolucionPatron, PuntoEvolucion,
 )
-from .utils_time import iso_a_utc_naive
-from .ingest_gamma import backfill_markets, extraer_campos_vela
-from .patrones import rankear_patrones_con_tiempos
-from .simular import simular_entrar_siempre
-from .comparar import comparar_ventanas, comparar_rango, comparar_a_vs_b, comparar_patron_vs_patron
+from .utils_time import iso_a_utc_naive, seg_a_utc_naive, utc_naive_a_seg
+from .ingest_gamma import cliente_gamma
+from .ingesta import asegurar_datos_en_rango, ingerir_ultimas, servicio_ingesta
+from .patrones import codificar_cursor, leer_cursor, ranking_con_tiempos
+from .estadisticas_patrones import rankear_rango
+from .simular import simular_vectorizado
+from .barrido import barrido_en_pool, cerrar_pool
+from .hilos import cerrar_hilos, en_hilo
+from .metricas import etapa, iniciar_request, metricas
+from .formatos import Tabla, codificacion_aceptada, comprimible, comprimir, formato_solicitado, responder
+from .perfilado import modo_solicitado, perfilando, ruta_artefacto
+from .particiones import preparar as preparar_particiones
+from .cache_velas import cache_velas, cargar_colores, filas_rango
+from .cache_respuestas import cache_respuestas
+from .coincidencias import a_segundos, resultados_patron
+from .comparar import comparar_ventanas, comparar_rango, comparar_a_vs_b, comparar_patron_vs_patron, comparar_lote, evolucion_patron
 
 Base.metadata.create_all(bind=engine)
+# create_all no agrega índices nuevos a tablas que ya existen
+for _indice in Vela.__table__.indexes:
+    _indice.create(bind=engine, checkfirst=True)
+preparar_particiones(engine)
 
 app = FastAPI(title="PolyPatron API", version="0.3.1")
 
@@ -37,139 +60,166 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Cache", "ETag", "X-Perfil"],
 )
 
-def _prefix_por_defecto(mercado: str, intervalo: str, override: str = "") -> str:
-    if override:
-        return override
-    return f"{mercado}-{intervalo}-"
-
-def _insertar_si_no_existe(db: Session, v: Vela) -> bool:
-    stmt = (
-        insert(Vela.__table__)
-        .values(
-            mercado=v.mercado,
-            intervalo=v.intervalo,
-            slug=v.slug,
-            market_id=v.market_id,
-            fin_ts_utc=v.fin_ts_utc,
-            color=v.color,
-            precio_cierre_up=v.precio_cierre_up,
-            precio_cierre_down=v.precio_cierre_down,
-            fuente=v.fuente,
-        )
-        .on_conflict_do_nothing(index_elements=["intervalo", "fin_ts_utc", "slug"])
-    )
-    res = db.execute(stmt)
-    db.commit()
-    return (res.rowcount or 0) > 0
-
-async def _asegurar_datos_en_rango(
-    db: Session,
-    *,
-    mercado: str,
-    intervalo: str,
-    inicio: datetime,
-    fin: datetime,
-    prefix_override: str = "",
-    max_pages: int = 30,
-):
-    prefix = _prefix_por_defecto(mercado, intervalo, prefix_override)
-
-    ini_utc = inicio
-    fin_utc = fin
-    if ini_utc.tzinfo is None:
-        ini_utc = ini_utc.replace(tzinfo=timezone.utc)
+@app.middleware("http")
+async def _comprimir_respuesta(request: Request, call_next):
+    """gzip/brotli para cuerpos grandes (la más interna: su etapa sale en Server-Timing)."""
+    response = await call_next(request)
+    if ajustes.COMPRESION_MIN_BYTES <= 0:
+        return response
+    # también sin comprimir (cuerpo chico, sin Accept-Encoding, 304): así un 304 lleva el mismo Vary que su 200
+    response.headers.add_vary_header("Accept-Encoding")
+    codificacion = codificacion_aceptada(request.headers.get("accept-encoding", ""))
+    if (
+        codificacion is None
+        or "content-encoding" in response.headers
+        or not comprimible(response.headers.get("content-type", ""))
+    ):
+        return response
+    cuerpo = b"".join([parte async for parte in response.body_iterator])
+    comprimido = len(cuerpo) >= ajustes.COMPRESION_MIN_BYTES
+    if comprimido:
+        with etapa("compresion"):
+            cuerpo = comprimir(cuerpo, codificacion)
+    nueva = Response(cuerpo, status_code=response.status_code, background=response.background)
+    # raw_headers conserva los repetidos (p. ej. varios Set-Cookie)
+    nueva.raw_headers = [(k, v) for k, v in response.raw_headers if k != b"content-length"]
+    nueva.headers["content-length"] = str(len(cuerpo))
+    if comprimido:
+        nueva.headers["content-encoding"] = codificacion
+    return nueva
+
+@app.middleware("http")
+async def _medir_request(request: Request, call_next):
+    med = iniciar_request()
+    t = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - t
+    ruta = getattr(request.scope.get("route"), "path", "sin_ruta")
+    metricas.requests.observar(total, ruta, request.method, str(response.status_code))
+    if ajustes.SERVER_TIMING:
+        response.headers["Server-Timing"] = med.server_timing(total)
+    return response
+
+@app.middleware("http")
+async def _perfilar_request(request: Request, call_next):
+    modo = modo_solicitado(request.headers, request.query_params)
+    if modo is None:
+        return await call_next(request)
+    with perfilando(modo) as perfil:
+        response = await call_next(request)
+    if perfil is None:
+        response.headers["X-Perfil"] = "ocupado"
     else:
-        ini_utc = ini_utc.astimezone(timezone.utc)
+        response.headers["X-Perfil"] = perfil.guardar(ajustes.PERFILADO_DIR, request.url.path)
+    return response
+
+@app.on_event("startup")
+async def _al_iniciar():
+    if ajustes.ARCHIVO_VELAS_DIR and ajustes.ARCHIVO_VELAS_PRECARGAR:
+        cache_velas.precargar_archivos()
+    if ajustes.INGESTA_EN_API:
+        servicio_ingesta.iniciar()
+
+@app.on_event("shutdown")
+async def _al_apagar():
+    await servicio_ingesta.detener()
+    cerrar_pool()
+    cerrar_hilos()
+    await cliente_gamma.cerrar()
+    await cerrar_engine_async()
 
-    if fin_utc.tzinfo is None:
-        fin_utc = fin_utc.replace(tzinfo=timezone.utc)
-    else:
-        fin_utc = fin_utc.astimezone(timezone.utc)
-
-    data = await backfill_markets(
-        closed=True,
-        limit=500,
-        max_pages=max_pages,
-        start_date_min=None,
-        start_date_max=None,
-        end_date_min=ini_utc,
-        end_date_max=fin_utc,
-        order="id",
-        ascending=False,
-    )
-
-    for m in data:
-        market_id, fin_ts, slug, color, up_p, down_p = extraer_campos_vela(m)
-        if not slug or not slug.startswith(prefix):
-            continue
-        if not market_id or fin_ts is None or color is None:
-            continue
+@app.get("/salud")
+def salud():
+    return {"ok": True, "app": "PolyPatron"}
 
-        v = Vela(
-            mercado=mercado,
-            intervalo=intervalo,
-            slug=slug,
-            market_id=market_id,
-            fin_ts_utc=fin_ts,
-            color=color,
-            precio_cierre_up=up_p,
-            precio_cierre_down=down_p,
-            fuente="gamma",
+@app.post("/ingesta/live", response_model=ResIngestLive)
+async def ingesta_live(req: ReqIngestLive, db: Session = Depends(get_db)):
+    """Dispara ya la ingesta de las últimas velas cerradas (además del ciclo en segundo plano)."""
+    if servicio_ingesta.gestiona(req.mercado, req.intervalo):
+        res, desde, hasta = await servicio_ingesta.ejecutar_una_vez(
+            req.mercado, req.intervalo, req.bloques_lookback, req.prefix
         )
-        try:
-            _insertar_si_no_existe(db, v)
-        except Exception:
-            db.rollback()
-            continue
-
-def _cargar_colores(
-    db: Session,
-    mercado: str,
-    intervalo: str,
-    inicio: datetime,
-    fin: datetime
-) -> Tuple[List[datetime], List[str]]:
-    ini_n = iso_a_utc_naive(inicio)
-    fin_n = iso_a_utc_naive(fin)
-
-    filas = (
-        db.query(Vela)
-        .filter(Vela.mercado == mercado)
-        .filter(Vela.intervalo == intervalo)
-        .filter(Vela.fin_ts_utc >= ini_n)
-        .filter(Vela.fin_ts_utc <= fin_n)
-        .order_by(Vela.fin_ts_utc.asc())
-        .all()
+    else:
+        res, desde, hasta = await ingerir_ultimas(
+            db,
+            mercado=req.mercado,
+            intervalo=req.intervalo,
+            bloques_lookback=req.bloques_lookback,
+            prefix_override=req.prefix,
+        )
+    return ResIngestLive(
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        desde_utc=desde,
+        hasta_utc=hasta,
+        insertadas=res.insertadas,
+        omitidas=res.omitidas,
+        errores=res.errores,
     )
 
-    fin_ts_list: List[datetime] = []
-    colores: List[str] = []
-    for f in filas:
-        if f.color in ("V", "R"):
-            fin_ts_list.append(f.fin_ts_utc)
-            colores.append(f.color)
-    return fin_ts_list, colores
-
-@app.get("/salud")
-def salud():
-    return {"ok": True, "app": "PolyPatron"}
+@app.get("/ingesta/live", response_model=ResEstadoIngesta)
+def ingesta_live_estado():
+    return ResEstadoIngesta(tareas=[EstadoIngesta(**vars(e)) for e in servicio_ingesta.estados.values()])
+
+@app.get("/metricas", response_class=PlainTextResponse)
+def metricas_prometheus():
+    """Histogramas por ruta y por etapa más contadores, en formato de texto de Prometheus."""
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/perfiles/{nombre}")
+def perfil_descargar(nombre: str, request: Request):
+    """Descarga un artefacto de perfil (el nombre viene en el header X-Perfil)."""
+    if not ajustes.PERFILADO or (
+        ajustes.PERFILADO_TOKEN and request.headers.get("x-perfilar-token") != ajustes.PERFILADO_TOKEN
+    ):
+        raise HTTPException(status_code=404, detail="Not Found")
+    ruta = ruta_artefacto(nombre)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="perfil no encontrado")
+    return FileResponse(ruta, filename=nombre)
+
+@app.get("/cache/velas", response_model=ResCacheVelas)
+def cache_velas_stats():
+    return ResCacheVelas(**cache_velas.stats())
+
+@app.get("/cache/respuestas", response_model=ResCacheRespuestas)
+def cache_respuestas_stats():
+    return ResCacheRespuestas(**cache_respuestas.stats())
 
 @app.get("/velas/ultima", response_model=ResUltimaVela)
-def ultima_vela(mercado: str = "btc-updown", intervalo: str = "5m", db: Session = Depends(get_db)):
-    fila = (
-        db.query(Vela)
-        .filter(Vela.mercado == mercado)
-        .filter(Vela.intervalo == intervalo)
+async def ultima_vela(mercado: str = "btc-updown", intervalo: str = "5m", db: AsyncSession = Depends(get_db_async)):
+    fin_ts = await db.scalar(
+        select(Vela.fin_ts_utc)
+        .where(Vela.mercado == mercado)
+        .where(Vela.intervalo == intervalo)
         .order_by(Vela.fin_ts_utc.desc())
-        .first()
+        .limit(1)
     )
-    return ResUltimaVela(fin_ts_utc=fila.fin_ts_utc if fila else None)
+    return ResUltimaVela(fin_ts_utc=fin_ts)
+
+def _reestampar_desde_ultima(payload: dict) -> None:
+    """desde_ultima_seg depende de la hora actual: se recalcula al servir desde el cache."""
+    ahora = datetime.now(timezone.utc)
+    for f in payload["filas"]:
+        if f.get("ultima_vez_utc"):
+            f["desde_ultima_seg"] = int((ahora - datetime.fromisoformat(f["ultima_vez_utc"])).total_seconds())
+
+def _ranking_vacio(formato: Optional[str]):
+    if formato is not None:
+        vacio = np.zeros(0, dtype=np.int64)
+        return Tabla(meta={"total": 0, "siguiente_cursor": None}, columnas={
+            "patron": [], "verde": np.zeros(0, dtype=bool), "efectividad": np.zeros(0),
+            "muestras": vacio, "verdes": vacio, "rojas": vacio, "ultima_vez_seg": vacio, "aparece_cada_seg": [],
+        })
+    return ResRankearPatrones(filas=[])
 
 @app.post("/patrones/rankear", response_model=ResRankearPatrones)
-async def patrones_rankear(req: ReqRankearPatrones, db: Session = Depends(get_db)):
-    await _asegurar_datos_en_rango(
+async def patrones_rankear(req: ReqRankearPatrones, request: Request, db: Session = Depends(get_db)):
+    formato = formato_solicitado(request)
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -177,34 +227,80 @@ async def patrones_rankear(req: ReqRankearPatrones, db: Session = Depends(get_db
         fin=req.fin,
     )
 
-    fin_ts_list, colores = _cargar_colores(db, req.mercado, req.intervalo, req.inicio, req.fin)
-    if len(colores) < (req.longitud_max + 2):
-        return ResRankearPatrones(filas=[])
-
-    filas = rankear_patrones_con_tiempos(
-        colores=colores,
-        fin_ts_list=fin_ts_list,
-        longitud_min=req.longitud_min,
-        longitud_max=req.longitud_max,
-        min_muestras=req.min_muestras,
-        alpha=req.suavizado,
-        now_utc=datetime.now(timezone.utc),
-    )
+    despues_de = None
+    if req.cursor:
+        try:
+            orden_cursor, despues_de = leer_cursor(req.cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if orden_cursor != req.orden:
+            raise HTTPException(status_code=400, detail="El cursor es de otro orden.")
+
+    async def calcular():
+        if ajustes.PATRONES_AGREGADOS:
+            ranking = await en_hilo(
+                rankear_rango,
+                db,
+                mercado=req.mercado,
+                intervalo=req.intervalo,
+                inicio=req.inicio,
+                fin=req.fin,
+                longitud_min=req.longitud_min,
+                longitud_max=req.longitud_max,
+                min_muestras=req.min_muestras,
+                alpha=req.suavizado,
+                now_utc=datetime.now(timezone.utc),
+                orden=req.orden,
+                limite=req.limite,
+                despues_de=despues_de,
+            )
+            if ranking is None:
+                return _ranking_vacio(formato)
+        else:
+            fin_ts_list, colores = await en_hilo(cargar_colores, db, req.mercado, req.intervalo, req.inicio, req.fin)
+            if len(colores) < (req.longitud_max + 2):
+                return _ranking_vacio(formato)
+
+            with etapa("conteo"):
+                ranking = await en_hilo(
+                    ranking_con_tiempos,
+                    colores=colores,
+                    fin_ts_list=fin_ts_list,
+                    longitud_min=req.longitud_min,
+                    longitud_max=req.longitud_max,
+                    min_muestras=req.min_muestras,
+                    alpha=req.suavizado,
+                    now_utc=datetime.now(timezone.utc),
+                    orden=req.orden,
+                    limite=req.limite,
+                    despues_de=despues_de,
+                )
+
+        # top-K: solo se ordenan y materializan las filas de esta página
+        siguiente = None
+        if ranking.hay_mas and len(ranking):
+            siguiente = codificar_cursor(req.orden, ranking.clave(len(ranking) - 1))
+        if formato is not None:
+            return Tabla(
+                meta={"total": ranking.candidatos, "siguiente_cursor": siguiente},
+                columnas=ranking.columnas(),
+            )
+        return ResRankearPatrones(
+            filas=[FilaPatron(**f) for f in ranking.dicts()],
+            total=ranking.candidatos,
+            siguiente_cursor=siguiente,
+        )
 
-    out = []
-    for (p, d, e, s, v, r, ultima_vez_utc, aparece_cada_seg, desde_ultima_seg) in filas[:500]:
-        out.append(FilaPatron(
-            patron=p,
-            direccion=d,
-            efectividad=float(e),
-            muestras=int(s),
-            verdes=int(v),
-            rojas=int(r),
-            ultima_vez_utc=ultima_vez_utc,
-            aparece_cada_seg=aparece_cada_seg,
-            desde_ultima_seg=desde_ultima_seg,
-        ))
-    return ResRankearPatrones(filas=out)
+    return await cache_respuestas.servir(
+        request,
+        req=req,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        calcular=calcular,
+        fines={"fin": req.fin},
+        reestampar=_reestampar_desde_ultima,
+        formato=formato,
+    )
 
 
 @app.get("/patrones/historial", response_model=ResHistorialPatron)
@@ -215,15 +311,18 @@ async def patrones_historial(
     intervalo: str,
     inicio: datetime,
     fin: datetime,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
 ):
+    formato = formato_solicitado(request)
     if direccion not in ("V", "R"):
         raise HTTPException(status_code=400, detail="direccion debe ser V o R")
 
     if not patron or len(patron) < 2 or any(c not in ("V", "R") for c in patron):
         raise HTTPException(status_code=400, detail="patron inválido: usa solo V/R y longitud >= 2")
 
-    await _asegurar_datos_en_rango(
+    await asegurar_datos_en_rango(
         db,
         mercado=mercado,
         intervalo=intervalo,
@@ -231,60 +330,76 @@ async def patrones_historial(
         fin=fin,
     )
 
-    ini_n = iso_a_utc_naive(inicio)
-    fin_n = iso_a_utc_naive(fin)
-
-    velas = (
-        db.query(Vela)
-        .filter(Vela.mercado == mercado)
-        .filter(Vela.intervalo == intervalo)
-        .filter(Vela.fin_ts_utc >= ini_n)
-        .filter(Vela.fin_ts_utc <= fin_n)
-        .order_by(Vela.fin_ts_utc.asc())
-        .all()
-    )
-
-    velas = [v for v in velas if v.color in ("V", "R")]
-
-    L = len(patron)
-    ocurrencias: List[OcurrenciaPatron] = []
-    ts_ocurrencias: List[datetime] = []
+    def _historial():
+        ini_n = iso_a_utc_naive(inicio)
+        fin_n = iso_a_utc_naive(fin)
+
+        # (fin_ts_utc, color, slug, market_id) de las velas V/R, sin entidades ORM
+        velas = filas_rango(db, mercado, intervalo, ini_n, fin_n, Vela.slug, Vela.market_id)
+
+        ocurrencias: List[OcurrenciaPatron] = []
+        ts_ocurrencias: List[datetime] = []
+
+        indices, _siguientes = resultados_patron([v[1] for v in velas], patron)
+        if formato is not None:
+            # columnas directas de las tuplas: sin OcurrenciaPatron ni fecha/hora formateadas
+            idx = indices.tolist()
+            ts = a_segundos([velas[i][0] for i in idx])
+            return Tabla(
+                meta={
+                    "patron": patron,
+                    "direccion": direccion,
+                    "mercado": mercado,
+                    "intervalo": intervalo,
+                    "total_muestras": len(idx),
+                    "rango_inicio_seg": int(ts.min()) if len(ts) else None,
+                    "rango_fin_seg": int(ts.max()) if len(ts) else None,
+                },
+                columnas={
+                    "fin_ts": ts,
+                    "verde": np.array([velas[i][1] == "V" for i in idx], dtype=bool),
+                    "mercado_slug": [velas[i][2] for i in idx],
+                    "mercado_id": [velas[i][3] for i in idx],
+                },
+            )
 
-    for i in range(L, len(velas)):
-        patron_actual = "".join(v.color for v in velas[i - L:i])
-        if patron_actual != patron:
-            continue
+        for i in indices.tolist():
+            ts, color, slug, market_id = velas[i]
+            ts_ocurrencias.append(ts)
 
-        vela_res = velas[i]
-        ts = vela_res.fin_ts_utc
-        ts_ocurrencias.append(ts)
+            ocurrencias.append(OcurrenciaPatron(
+                fecha=ts.strftime("%Y-%m-%d"),
+                hora=ts.strftime("%H:%M:%S"),
+                direccion_resultado=color,
+                mercado_slug=slug,
+                mercado_id=market_id,
+            ))
 
-        ocurrencias.append(OcurrenciaPatron(
-            fecha=ts.strftime("%Y-%m-%d"),
-            hora=ts.strftime("%H:%M:%S"),
-            direccion_resultado=vela_res.color,
-            mercado_slug=vela_res.slug,
-            mercado_id=vela_res.market_id,
-        ))
+        rango_inicio = min(ts_ocurrencias).replace(tzinfo=timezone.utc) if ts_ocurrencias else None
+        rango_fin = max(ts_ocurrencias).replace(tzinfo=timezone.utc) if ts_ocurrencias else None
 
-    rango_inicio = min(ts_ocurrencias).replace(tzinfo=timezone.utc) if ts_ocurrencias else None
-    rango_fin = max(ts_ocurrencias).replace(tzinfo=timezone.utc) if ts_ocurrencias else None
+        return ResHistorialPatron(
+            patron=patron,
+            direccion=direccion,
+            mercado=mercado,
+            intervalo=intervalo,
+            total_muestras=len(ocurrencias),
+            rango_fecha_inicio=rango_inicio,
+            rango_fecha_fin=rango_fin,
+            ocurrencias=ocurrencias,
+        )
 
-    return ResHistorialPatron(
-        patron=patron,
-        direccion=direccion,
-        mercado=mercado,
-        intervalo=intervalo,
-        total_muestras=len(ocurrencias),
-        rango_fecha_inicio=rango_inicio,
-        rango_fecha_fin=rango_fin,
-        ocurrencias=ocurrencias,
-    )
+    resultado = await en_hilo(_historial)
+    if formato is not None:
+        return responder(resultado, formato)
+    response.headers["Vary"] = "Accept"
+    return resultado
 
 @app.post("/simular", response_model=ResSimular)
-async def simular(req: ReqSimular, db: Session = Depends(get_db)):
+async def simular(req: ReqSimular, request: Request, response: Response, db: Session = Depends(get_db)):
+    formato = formato_solicitado(request)
     # 1) Asegurar datos del rango (sin botón de ingesta)
-    await _asegurar_datos_en_rango(
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -292,56 +407,139 @@ async def simular(req: ReqSimular, db: Session = Depends(get_db)):
         fin=req.fin,
     )
 
-    # 2) Cargar datos
-    fin_ts_list, colores = _cargar_colores(db, req.mercado, req.intervalo, req.inicio, req.fin)
-    if len(colores) < (len(req.patron) + 1):
-        raise HTTPException(status_code=400, detail="No hay suficientes datos en el rango.")
-
-    # 3) Simular (tu simulador regresa una TUPLA; aquí la convertimos a ResSimular)
-    res = simular_entrar_siempre(
-        fin_ts_list=fin_ts_list,
-        colores=colores,
-        patron=req.patron,
-        direccion=req.direccion,
-        banca0=req.banca0,
-        stake=req.stake,
-        payout=req.payout,
-        reinvertir=req.reinvertir,
-    )
+    def _simular():
+        # 2) Cargar datos
+        fin_ts_list, colores = cargar_colores(db, req.mercado, req.intervalo, req.inicio, req.fin)
+        if len(colores) < (len(req.patron) + 1):
+            raise HTTPException(status_code=400, detail="No hay suficientes datos en el rango.")
 
-    # Esperamos: (banca0, banca_fin, pnl_total, roi, max_drawdown, max_racha_perdidas, max_racha_ganadas, trades)
-    banca0, banca_fin, pnl_total, roi, max_drawdown, max_racha_perdidas, max_racha_ganadas, trades = res
-
-    trades_out = []
-    for tr in (trades or []):
-        # tr puede ser dataclass/objeto con atributos
-        trades_out.append(
-            TradeSim(
-                fin_ts_utc=tr.fin_ts_utc,
-                patron=tr.patron,
-                direccion=tr.direccion,
-                real=tr.real,
-                gano=bool(tr.gano),
-                pnl=float(tr.pnl),
-                banca_despues=float(tr.banca_despues),
+        # 3) Simular (vectorizado; los trades solo se materializan en el formato pedido)
+        res = simular_vectorizado(
+            colores=colores,
+            patron=req.patron,
+            direccion=req.direccion,
+            banca0=req.banca0,
+            stake=req.stake,
+            payout=req.payout,
+            reinvertir=req.reinvertir,
+        )
+
+        resumen = dict(
+            banca0=float(res.banca0),
+            banca_fin=float(res.banca_fin),
+            pnl_total=float(res.pnl_total),
+            roi=float(res.roi),
+            max_drawdown=float(res.max_drawdown),
+            max_racha_perdidas=int(res.max_racha_perdidas),
+            max_racha_ganadas=int(res.max_racha_ganadas),
+        )
+        if formato is not None:
+            # los arreglos del simulador tal cual (formato_trades="ninguno" deja las columnas vacías)
+            n = 0 if req.formato_trades == "ninguno" else len(res.indices)
+            idx = res.indices[:n]
+            return Tabla(
+                meta={**resumen, "patron": req.patron, "direccion": res.direccion},
+                columnas={
+                    "fin_ts": np.asarray(fin_ts_list, dtype=np.int64)[idx],
+                    "real_verde": np.asarray(colores)[idx].astype(bool),
+                    "gano": np.asarray(res.gano[:n], dtype=bool),
+                    "pnl": np.asarray(res.pnl[:n], dtype=np.float64),
+                    "banca_despues": np.asarray(res.banca[:n], dtype=np.float64),
+                    "drawdown": np.asarray(res.drawdown[:n], dtype=np.float64),
+                },
             )
+
+        trades_out = []
+        trades_columnas = None
+        if req.formato_trades == "objetos":
+            for i, gano, pnl, banca in zip(res.indices.tolist(), res.gano.tolist(), res.pnl.tolist(), res.banca.tolist()):
+                trades_out.append(
+                    TradeSim(
+                        fin_ts_utc=seg_a_utc_naive(fin_ts_list[i]),
+                        patron=req.patron,
+                        direccion=res.direccion,
+                        real="V" if colores[i] else "R",
+                        gano=gano,
+                        pnl=pnl,
+                        banca_despues=banca,
+                    )
+                )
+        elif req.formato_trades == "columnas":
+            idx = res.indices.tolist()
+            trades_columnas = TradesColumnas(
+                patron=req.patron,
+                direccion=res.direccion,
+                fin_ts_utc=[seg_a_utc_naive(fin_ts_list[i]) for i in idx],
+                real="".join("V" if colores[i] else "R" for i in idx),
+                gano=res.gano.tolist(),
+                pnl=res.pnl.tolist(),
+                banca_despues=res.banca.tolist(),
+                drawdown=res.drawdown.tolist(),
+            )
+
+        return ResSimular(**resumen, trades=trades_out, trades_columnas=trades_columnas)
+
+    resultado = await en_hilo(_simular)
+    if formato is not None:
+        return responder(resultado, formato)
+    response.headers["Vary"] = "Accept"
+    return resultado
+
+@app.post("/simular/barrido", response_model=ResSimularBarrido)
+async def simular_barrido(req: ReqSimularBarrido, db: Session = Depends(get_db)):
+    patrones = list(dict.fromkeys(req.patrones))
+    if any(not p or any(c not in ("V", "R") for c in p) for p in patrones):
+        raise HTTPException(status_code=400, detail="patron inválido: usa solo V/R")
+
+    direcciones = list(dict.fromkeys(req.direcciones))
+    stakes = list(dict.fromkeys(req.stakes))
+    payouts = list(dict.fromkeys(req.payouts))
+    reinvertir = list(dict.fromkeys(req.reinvertir))
+    combinaciones = len(patrones) * len(direcciones) * len(stakes) * len(payouts) * len(reinvertir)
+    if combinaciones > ajustes.BARRIDO_MAX_COMBINACIONES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"demasiadas combinaciones ({combinaciones} > {ajustes.BARRIDO_MAX_COMBINACIONES})",
         )
 
-    return ResSimular(
-        banca0=float(banca0),
-        banca_fin=float(banca_fin),
-        pnl_total=float(pnl_total),
-        roi=float(roi),
-        max_drawdown=float(max_drawdown),
-        max_racha_perdidas=int(max_racha_perdidas),
-        max_racha_ganadas=int(max_racha_ganadas),
-        trades=trades_out,
+    # 1) Datos una sola vez para toda la rejilla
+    await asegurar_datos_en_rango(
+        db,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        inicio=req.inicio,
+        fin=req.fin,
+    )
+    _fin_ts_list, colores = await en_hilo(cargar_colores, db, req.mercado, req.intervalo, req.inicio, req.fin)
+
+    # 2) Evaluar en el pool de procesos
+    filas = await barrido_en_pool(
+        colores,
+        patrones,
+        direcciones=direcciones,
+        banca0=req.banca0,
+        stakes=stakes,
+        payouts=payouts,
+        reinvertir=reinvertir,
+    )
+
+    # 3) Rankear
+    filas = [f for f in filas if f["trades"] >= req.min_trades]
+    if req.ordenar_por == "max_drawdown":
+        filas.sort(key=lambda f: (f["max_drawdown"], -f["pnl_total"]))
+    else:
+        filas.sort(key=lambda f: (f[req.ordenar_por] if f[req.ordenar_por] is not None else float("-inf"), f["trades"]), reverse=True)
+
+    return ResSimularBarrido(
+        combinaciones=combinaciones,
+        velas=len(colores),
+        filas=[FilaBarrido(**f) for f in filas[:req.limite]],
     )
 
 @app.post("/comparar/ventanas", response_model=ResCompararVentanas)
-async def comparar(req: ReqCompararVentanas, db: Session = Depends(get_db)):
+async def comparar(req: ReqCompararVentanas, request: Request, db: Session = Depends(get_db)):
     # 1) Asegurar data en DB para el rango (backfill desde gamma)
-    await _asegurar_datos_en_rango(
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -350,64 +548,73 @@ async def comparar(req: ReqCompararVentanas, db: Session = Depends(get_db)):
         max_pages=60,
     )
 
-    # 2) comparar_ventanas NO es async. Puede regresar: dict o (tendencia, filas) o (filas, tendencia)
-    res = comparar_ventanas(db, req.mercado, req.intervalo, req.fin, req.patron, req.direccion, req.ventanas_dias)
-
-    tendencia = "plano"
-    filas = []
-
-    if isinstance(res, dict):
-        tendencia = res.get("tendencia") or "plano"
-        filas = res.get("filas") or []
-    elif isinstance(res, (tuple, list)) and len(res) == 2:
-        a, b = res
-        if isinstance(a, str) and isinstance(b, list):
-            tendencia, filas = a, b
-        elif isinstance(b, str) and isinstance(a, list):
-            tendencia, filas = b, a
-        else:
-            if isinstance(a, list): filas = a
-            if isinstance(b, list): filas = b
-            if isinstance(a, str): tendencia = a
-            if isinstance(b, str): tendencia = b
-    elif isinstance(res, list):
-        filas = res
-
-    if tendencia not in ("ascenso", "descenso", "plano"):
+    async def calcular():
+        # 2) comparar_ventanas NO es async (corre en el pool de análisis). Puede regresar: dict o (tendencia, filas) o (filas, tendencia)
+        res = await en_hilo(comparar_ventanas, db, req.mercado, req.intervalo, req.fin, req.patron, req.direccion, req.ventanas_dias)
+
         tendencia = "plano"
+        filas = []
+
+        if isinstance(res, dict):
+            tendencia = res.get("tendencia") or "plano"
+            filas = res.get("filas") or []
+        elif isinstance(res, (tuple, list)) and len(res) == 2:
+            a, b = res
+            if isinstance(a, str) and isinstance(b, list):
+                tendencia, filas = a, b
+            elif isinstance(b, str) and isinstance(a, list):
+                tendencia, filas = b, a
+            else:
+                if isinstance(a, list): filas = a
+                if isinstance(b, list): filas = b
+                if isinstance(a, str): tendencia = a
+                if isinstance(b, str): tendencia = b
+        elif isinstance(res, list):
+            filas = res
+
+        if tendencia not in ("ascenso", "descenso", "plano"):
+            tendencia = "plano"
+
+        filas_out = []
+        for row in (filas or []):
+            if isinstance(row, dict):
+                row.setdefault("direccion", req.direccion)
+                filas_out.append(row)
+                continue
+
+            # tupla: (dias, inicio, fin, efectividad, muestras, verdes, rojas)
+            if isinstance(row, (tuple, list)) and len(row) >= 7:
+                dias, ini, fin, efect, muestras, verdes, rojas = row[:7]
+                filas_out.append({
+                    "dias": int(dias),
+                    "direccion": req.direccion,
+                    "inicio": ini,
+                    "fin": fin,
+                    "efectividad": float(efect),
+                    "muestras": int(muestras),
+                    "verdes": int(verdes),
+                    "rojas": int(rojas),
+                })
+
+        return ResCompararVentanas(
+            patron=req.patron,
+            direccion=req.direccion,
+            tendencia=tendencia,
+            filas=filas_out,
+        )
 
-    filas_out = []
-    for row in (filas or []):
-        if isinstance(row, dict):
-            row.setdefault("direccion", req.direccion)
-            filas_out.append(row)
-            continue
-
-        # tupla: (dias, inicio, fin, efectividad, muestras, verdes, rojas)
-        if isinstance(row, (tuple, list)) and len(row) >= 7:
-            dias, ini, fin, efect, muestras, verdes, rojas = row[:7]
-            filas_out.append({
-                "dias": int(dias),
-                "direccion": req.direccion,
-                "inicio": ini,
-                "fin": fin,
-                "efectividad": float(efect),
-                "muestras": int(muestras),
-                "verdes": int(verdes),
-                "rojas": int(rojas),
-            })
-
-    return ResCompararVentanas(
-        patron=req.patron,
-        direccion=req.direccion,
-        tendencia=tendencia,
-        filas=filas_out,
+    return await cache_respuestas.servir(
+        request,
+        req=req,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        calcular=calcular,
     )
 
 
 @app.post("/comparar/rango", response_model=ResCompararRango)
-async def comparar_por_rango(req: ReqCompararRango, db: Session = Depends(get_db)):
-    await _asegurar_datos_en_rango(
+async def comparar_por_rango(req: ReqCompararRango, request: Request, db: Session = Depends(get_db)):
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -415,35 +622,47 @@ async def comparar_por_rango(req: ReqCompararRango, db: Session = Depends(get_db
         fin=req.fin,
     )
 
-    res = comparar_rango(
-        db,
-        req.mercado,
-        req.intervalo,
-        req.inicio,
-        req.fin,
-        req.patron,
-        req.direccion,
-    )
+    async def calcular():
+        res = await en_hilo(
+            comparar_rango,
+            db,
+            req.mercado,
+            req.intervalo,
+            req.inicio,
+            req.fin,
+            req.patron,
+            req.direccion,
+        )
 
-    return ResCompararRango(
+        return ResCompararRango(
+            mercado=req.mercado,
+            intervalo=req.intervalo,
+            patron=req.patron,
+            direccion=res["direccion"],
+            inicio=res["inicio"],
+            fin=res["fin"],
+            efectividad=res["efectividad"],
+            muestras=res["muestras"],
+            verdes=res["verdes"],
+            rojas=res["rojas"],
+            aparece_cada_seg=res.get("aparece_cada_seg"),
+            ultima_vez_utc=res.get("ultima_vez_utc"),
+        )
+
+    return await cache_respuestas.servir(
+        request,
+        req=req,
         mercado=req.mercado,
         intervalo=req.intervalo,
-        patron=req.patron,
-        direccion=res["direccion"],
-        inicio=res["inicio"],
-        fin=res["fin"],
-        efectividad=res["efectividad"],
-        muestras=res["muestras"],
-        verdes=res["verdes"],
-        rojas=res["rojas"],
-        aparece_cada_seg=res.get("aparece_cada_seg"),
-        ultima_vez_utc=res.get("ultima_vez_utc"),
+        calcular=calcular,
+        fines={"fin": req.fin},
+        ecos=[("fin", req.fin)],
     )
 
 
 @app.post("/comparar/a-vs-b", response_model=ResCompararAVsB)
-async def comparar_a_vs_b_endpoint(req: ReqCompararAVsB, db: Session = Depends(get_db)):
-    await _asegurar_datos_en_rango(
+async def comparar_a_vs_b_endpoint(req: ReqCompararAVsB, request: Request, db: Session = Depends(get_db)):
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -451,62 +670,144 @@ async def comparar_a_vs_b_endpoint(req: ReqCompararAVsB, db: Session = Depends(g
         fin=max(req.a_fin, req.b_fin),
     )
 
-    out = comparar_a_vs_b(
-        db,
-        req.mercado,
-        req.intervalo,
-        req.patron,
-        req.direccion,
-        req.a_inicio,
-        req.a_fin,
-        req.b_inicio,
-        req.b_fin,
-    )
+    async def calcular():
+        out = await en_hilo(
+            comparar_a_vs_b,
+            db,
+            req.mercado,
+            req.intervalo,
+            req.patron,
+            req.direccion,
+            req.a_inicio,
+            req.a_fin,
+            req.b_inicio,
+            req.b_fin,
+        )
 
-    a = out["a"]
-    b = out["b"]
+        a = out["a"]
+        b = out["b"]
 
-    return ResCompararAVsB(
-        mercado=req.mercado,
-        intervalo=req.intervalo,
-        patron=req.patron,
-        direccion=req.direccion,
-        a=ResCompararRango(
+        return ResCompararAVsB(
             mercado=req.mercado,
             intervalo=req.intervalo,
             patron=req.patron,
-            direccion=a["direccion"],
-            inicio=a["inicio"],
-            fin=a["fin"],
-            efectividad=a["efectividad"],
-            muestras=a["muestras"],
-            verdes=a["verdes"],
-            rojas=a["rojas"],
-            aparece_cada_seg=a.get("aparece_cada_seg"),
-            ultima_vez_utc=a.get("ultima_vez_utc"),
-        ),
-        b=ResCompararRango(
+            direccion=req.direccion,
+            a=ResCompararRango(
+                mercado=req.mercado,
+                intervalo=req.intervalo,
+                patron=req.patron,
+                direccion=a["direccion"],
+                inicio=a["inicio"],
+                fin=a["fin"],
+                efectividad=a["efectividad"],
+                muestras=a["muestras"],
+                verdes=a["verdes"],
+                rojas=a["rojas"],
+                aparece_cada_seg=a.get("aparece_cada_seg"),
+                ultima_vez_utc=a.get("ultima_vez_utc"),
+            ),
+            b=ResCompararRango(
+                mercado=req.mercado,
+                intervalo=req.intervalo,
+                patron=req.patron,
+                direccion=b["direccion"],
+                inicio=b["inicio"],
+                fin=b["fin"],
+                efectividad=b["efectividad"],
+                muestras=b["muestras"],
+                verdes=b["verdes"],
+                rojas=b["rojas"],
+                aparece_cada_seg=b.get("aparece_cada_seg"),
+                ultima_vez_utc=b.get("ultima_vez_utc"),
+            ),
+            delta_efectividad=out.get("delta_efectividad"),
+            delta_muestras=out["delta_muestras"],
+        )
+
+    return await cache_respuestas.servir(
+        request,
+        req=req,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        calcular=calcular,
+        fines={"a_fin": req.a_fin, "b_fin": req.b_fin},
+        ecos=[("a.fin", req.a_fin), ("b.fin", req.b_fin)],
+    )
+
+
+@app.post("/comparar/patrones-vs", response_model=ResCompararPatronesVs)
+async def comparar_patrones_vs_endpoint(req: ReqCompararPatronesVs, request: Request, db: Session = Depends(get_db)):
+    await asegurar_datos_en_rango(
+        db,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        inicio=req.inicio,
+        fin=req.fin,
+    )
+
+    async def calcular():
+        out = await en_hilo(
+            comparar_patron_vs_patron,
+            db,
+            req.mercado,
+            req.intervalo,
+            req.inicio,
+            req.fin,
+            req.patron_a,
+            req.direccion_a,
+            req.patron_b,
+            req.direccion_b,
+        )
+
+        a = out["a"]
+        b = out["b"]
+
+        return ResCompararPatronesVs(
             mercado=req.mercado,
             intervalo=req.intervalo,
-            patron=req.patron,
-            direccion=b["direccion"],
-            inicio=b["inicio"],
-            fin=b["fin"],
-            efectividad=b["efectividad"],
-            muestras=b["muestras"],
-            verdes=b["verdes"],
-            rojas=b["rojas"],
-            aparece_cada_seg=b.get("aparece_cada_seg"),
-            ultima_vez_utc=b.get("ultima_vez_utc"),
-        ),
-        delta_efectividad=out.get("delta_efectividad"),
-        delta_muestras=out["delta_muestras"],
+            a=ResPatronMetricas(
+                patron=a["patron"],
+                direccion=a["direccion"],
+                inicio=a["inicio"],
+                fin=a["fin"],
+                efectividad=a["efectividad"],
+                muestras=a["muestras"],
+                verdes=a["verdes"],
+                rojas=a["rojas"],
+                aparece_cada_seg=a.get("aparece_cada_seg"),
+                ultima_vez_utc=a.get("ultima_vez_utc"),
+            ),
+            b=ResPatronMetricas(
+                patron=b["patron"],
+                direccion=b["direccion"],
+                inicio=b["inicio"],
+                fin=b["fin"],
+                efectividad=b["efectividad"],
+                muestras=b["muestras"],
+                verdes=b["verdes"],
+                rojas=b["rojas"],
+                aparece_cada_seg=b.get("aparece_cada_seg"),
+                ultima_vez_utc=b.get("ultima_vez_utc"),
+            ),
+            delta_efectividad=out.get("delta_efectividad"),
+            delta_muestras=out["delta_muestras"],
+            ganador=out["ganador"],
+        )
+
+    return await cache_respuestas.servir(
+        request,
+        req=req,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        calcular=calcular,
+        fines={"fin": req.fin},
+        ecos=[("a.fin", req.fin), ("b.fin", req.fin)],
     )
 
 
-@app.post("/comparar/patrones-vs", response_model=ResCompararPatronesVs)
-async def comparar_patrones_vs_endpoint(req: ReqCompararPatronesVs, db: Session = Depends(get_db)):
-    await _asegurar_datos_en_rango(
+@app.post("/comparar/lote", response_model=ResCompararLote)
+async def comparar_lote_endpoint(req: ReqCompararLote, request: Request, db: Session = Depends(get_db)):
+    await asegurar_datos_en_rango(
         db,
         mercado=req.mercado,
         intervalo=req.intervalo,
@@ -514,49 +815,112 @@ async def comparar_patrones_vs_endpoint(req: ReqCompararPatronesVs, db: Session
         fin=req.fin,
     )
 
-    out = comparar_patron_vs_patron(
+    async def calcular():
+        filas = await en_hilo(
+            comparar_lote,
+            db,
+            req.mercado,
+            req.intervalo,
+            req.inicio,
+            req.fin,
+            [(p.patron, p.direccion) for p in req.patrones],
+        )
+
+        return ResCompararLote(
+            mercado=req.mercado,
+            intervalo=req.intervalo,
+            inicio=req.inicio,
+            fin=req.fin,
+            filas=[ResPatronMetricas(**f) for f in filas],
+        )
+
+    return await cache_respuestas.servir(
+        request,
+        req=req,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        calcular=calcular,
+        fines={"fin": req.fin},
+        ecos=[("fin", req.fin), ("filas.*.fin", req.fin)],
+    )
+
+
+@app.post("/comparar/evolucion", response_model=ResEvolucionPatron)
+async def comparar_evolucion(req: ReqEvolucionPatron, request: Request, db: Session = Depends(get_db)):
+    if not req.patron or any(c not in ("V", "R") for c in req.patron):
+        raise HTTPException(status_code=400, detail="patron inválido: usa solo V/R")
+
+    ventana_seg = req.ventana_min * 60
+    paso_seg = req.paso_min * 60
+    # epoch seg UTC: los límites pueden venir con distinta zona (o una sin zona = UTC)
+    rango_seg = utc_naive_a_seg(req.fin) - utc_naive_a_seg(req.inicio)
+    if rango_seg < ventana_seg:
+        raise HTTPException(status_code=400, detail="El rango debe ser al menos del tamaño de la ventana.")
+    puntos = int((rango_seg - ventana_seg) // paso_seg) + 1
+    if puntos > ajustes.EVOLUCION_MAX_PUNTOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiadas ventanas ({puntos}); máximo {ajustes.EVOLUCION_MAX_PUNTOS}. Sube paso_min o acorta el rango.",
+        )
+
+    await asegurar_datos_en_rango(
         db,
-        req.mercado,
-        req.intervalo,
-        req.inicio,
-        req.fin,
-        req.patron_a,
-        req.direccion_a,
-        req.patron_b,
-        req.direccion_b,
+        mercado=req.mercado,
+        intervalo=req.intervalo,
+        inicio=req.inicio,
+        fin=req.fin,
     )
 
-    a = out["a"]
-    b = out["b"]
+    async def calcular():
+        res = await en_hilo(
+            evolucion_patron,
+            db,
+            req.mercado,
+            req.intervalo,
+            req.patron,
+            req.direccion,
+            req.inicio,
+            req.fin,
+            ventana_seg,
+            paso_seg,
+            req.confianza,
+        )
+
+        def _opt(x: float):
+            return None if x != x else float(x)  # NaN -> None (ventana sin muestras)
+
+        out = []
+        for ini, fin, e, n, v, r, lo, hi in zip(
+            res["inicios"].tolist(), res["fines"].tolist(), res["efectividad"].tolist(),
+            res["muestras"].tolist(), res["verdes"].tolist(), res["rojas"].tolist(),
+            res["ic_inf"].tolist(), res["ic_sup"].tolist(),
+        ):
+            out.append(PuntoEvolucion(
+                inicio=seg_a_utc_naive(ini).replace(tzinfo=timezone.utc),
+                fin=seg_a_utc_naive(fin).replace(tzinfo=timezone.utc),
+                efectividad=_opt(e),
+                muestras=int(n),
+                verdes=int(v),
+                rojas=int(r),
+                ic_inf=_opt(lo),
+                ic_sup=_opt(hi),
+            ))
+
+        return ResEvolucionPatron(
+            mercado=req.mercado,
+            intervalo=req.intervalo,
+            patron=req.patron,
+            direccion=res["direccion"],
+            ventana_min=req.ventana_min,
+            paso_min=req.paso_min,
+            confianza=req.confianza,
+            puntos=out,
+        )
 
-    return ResCompararPatronesVs(
+    return await cache_respuestas.servir(
+        request,
+        req=req,
         mercado=req.mercado,
         intervalo=req.intervalo,
-        a=ResPatronMetricas(
-            patron=a["patron"],
-            direccion=a["direccion"],
-            inicio=a["inicio"],
-            fin=a["fin"],
-            efectividad=a["efectividad"],
-            muestras=a["muestras"],
-            verdes=a["verdes"],
-            rojas=a["rojas"],
-            aparece_cada_seg=a.get("aparece_cada_seg"),
-            ultima_vez_utc=a.get("ultima_vez_utc"),
-        ),
-        b=ResPatronMetricas(
-            patron=b["patron"],
-            direccion=b["direccion"],
-            inicio=b["inicio"],
-            fin=b["fin"],
-            efectividad=b["efectividad"],
-            muestras=b["muestras"],
-            verdes=b["verdes"],
-            rojas=b["rojas"],
-            aparece_cada_seg=b.get("aparece_cada_seg"),
-            ultima_vez_utc=b.get("ultima_vez_utc"),
-        ),
-        delta_efectividad=out.get("delta_efectividad"),
-        delta_muestras=out["delta_muestras"],
-        ganador=out["ganador"],
+        calcular=calcular,
     )
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# segundos; cubren desde un hit del cache (~1 ms) hasta un backfill largo
+BUCKETS_SEG = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histograma:
+    """Histograma acumulado por combinación de etiquetas (formato Prometheus)."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS_SEG):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List] = {}  # valores -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas: str) -> None:
+        with self._lock:
+            s = self._series.get(etiquetas)
+            if s is None:
+                s = self._series[etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, valor)
+            if i < len(self.buckets):
+                s[0][i] += 1
+            s[1] += valor
+            s[2] += 1
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for valores, (conteos, suma, total) in sorted(self._series.items()):
+                base = _etiquetas(self.etiquetas, valores)
+                acum = 0
+                for le, c in zip(self.buckets, conteos):
+                    acum += c
+                    lineas.append(f"{self.nombre}_bucket{_con_le(base, repr(le))} {acum}")
+                lineas.append(f"{self.nombre}_bucket{_con_le(base, '+Inf')} {total}")
+                lineas.append(f"{self.nombre}_sum{_llaves(base)} {suma}")
+                lineas.append(f"{self.nombre}_count{_llaves(base)} {total}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def sumar(self, n: int = 1) -> None:
+        with self._lock:
+            self.valor += n
+
+    def exponer(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter", f"{self.nombre} {self.valor}"]
+
+
+def _escapar(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...]) -> str:
+    return ",".join(f'{k}="{_escapar(v)}"' for k, v in zip(nombres, valores))
+
+
+def _llaves(base: str) -> str:
+    return f"{{{base}}}" if base else ""
+
+
+def _con_le(base: str, le: str) -> str:
+    return f'{{{base + "," if base else ""}le="{le}"}}'
+
+
+# contadores conocidos (lo que se cuenta por request también va al Server-Timing)
+_AYUDA_CONTADORES = {
+    "gamma_paginas": "Páginas de Gamma /markets recibidas",
+    "gamma_reintentos": "Reintentos hacia Gamma (429/5xx/transporte)",
+    "velas_insertadas": "Velas insertadas por la ingesta",
+    "velas_leidas": "Filas de velas leídas de la DB por el cache de velas",
+    "velas_archivo": "Velas cargadas del archivo bit-packed en cargas en frío del cache",
+    "cache_velas_hit": "Lecturas del cache de velas servidas con la serie ya cargada",
+    "cache_velas_miss": "Lecturas del cache de velas que cargaron la serie completa",
+    "cache_respuestas_hit": "Respuestas servidas desde el cache de respuestas",
+    "cache_respuestas_miss": "Respuestas calculadas y guardadas en el cache",
+    "cache_respuestas_304": "Revalidaciones respondidas con 304",
+}
+
+
+@dataclass
+class MedicionRequest:
+    """Lo que acumula una request: segundos por etapa y conteos."""
+    etapas: Dict[str, float] = field(default_factory=dict)
+    conteos: Dict[str, int] = field(default_factory=dict)
+
+    def server_timing(self, total_seg: float) -> str:
+        partes = [f"{k};dur={v * 1000:.1f}" for k, v in self.etapas.items()]
+        partes += [f'{k};desc="{v}"' for k, v in self.conteos.items()]
+        partes.append(f"total;dur={total_seg * 1000:.1f}")
+        return ", ".join(partes)
+
+
+_actual: ContextVar[Optional[MedicionRequest]] = ContextVar("medicion_request", default=None)
+
+
+class Metricas:
+    def __init__(self):
+        self.requests = Histograma(
+            "polypatron_request_segundos", "Duración de las requests HTTP", ("ruta", "metodo", "estado")
+        )
+        self.etapas = Histograma(
+            "polypatron_etapa_segundos", "Duración por etapa (gamma, escritura, carga_velas, conteo, ...)", ("etapa",)
+        )
+        self._contadores: Dict[str, Contador] = {}
+        self._lock = threading.Lock()
+
+    def contador(self, nombre: str) -> Contador:
+        c = self._contadores.get(nombre)
+        if c is None:
+            with self._lock:
+                c = self._contadores.setdefault(
+                    nombre, Contador(f"polypatron_{nombre}_total", _AYUDA_CONTADORES.get(nombre, nombre))
+                )
+        return c
+
+    def exponer(self) -> str:
+        lineas = self.requests.exponer() + self.etapas.exponer()
+        for nombre in sorted(self._contadores):
+            lineas += self._contadores[nombre].exponer()
+        return "\n".join(lineas) + "\n"
+
+
+metricas = Metricas()
+
+
+def iniciar_request() -> MedicionRequest:
+    med = MedicionRequest()
+    _actual.set(med)
+    return med
+
+
+def registrar_etapa(nombre: str, seg: float) -> None:
+    metricas.etapas.observar(seg, nombre)
+    med = _actual.get()
+    if med is not None:
+        med.etapas[nombre] = med.etapas.get(nombre, 0.0) + seg
+
+
+@contextmanager
+def etapa(nombre: str) -> Iterator[None]:
+    """Mide el bloque como la etapa 'nombre' (se acumula si se repite en la misma request)."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(nombre, time.perf_counter() - t)
+
+
+def contar(nombre: str, n: int = 1) -> None:
+    if not n:
+        return
+    metricas.contador(nombre).sumar(n)
+    med = _actual.get()
+    if med is not None:
+        med.conteos[nombre] = med.conteos.get(nombre, 0) + n
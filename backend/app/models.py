@@ -1,20 +1,26 @@
-from sqlalchemy import String, Integer, DateTime, Float, UniqueConstraint, Index
+from sqlalchemy import String, Integer, BigInteger, Date, DateTime, Float, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column
-from datetime import datetime
-from .db import Base
+from datetime import date, datetime
+from .config import ajustes
+from .db import Base, engine
+
+# velas particionada por mes de fin_ts_utc (solo Postgres; ver particiones.py)
+VELAS_PARTICIONADA = ajustes.VELAS_PARTICIONADAS and engine.dialect.name == "postgresql"
+_SUBPARTICIONADA = VELAS_PARTICIONADA and bool(ajustes.VELAS_SUBPARTICION_INTERVALOS.strip())
 
 class Vela(Base):
     __tablename__ = "velas"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # en una tabla particionada la PK tiene que incluir las columnas de partición
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
-    mercado: Mapped[str] = mapped_column(String(128), index=True)          # ej. "btc-updown"
-    intervalo: Mapped[str] = mapped_column(String(16), index=True)         # "5m", "15m", "1h", "4h"
-    slug: Mapped[str] = mapped_column(String(256), index=True)
-    market_id: Mapped[str] = mapped_column(String(64), index=True)
+    mercado: Mapped[str] = mapped_column(String(128))                      # ej. "btc-updown"
+    intervalo: Mapped[str] = mapped_column(String(16), primary_key=_SUBPARTICIONADA)  # "5m", "15m", "1h", "4h"
+    slug: Mapped[str] = mapped_column(String(256))
+    market_id: Mapped[str] = mapped_column(String(64))
 
-    fin_ts_utc: Mapped[datetime] = mapped_column(DateTime(timezone=False), index=True)
-    color: Mapped[str] = mapped_column(String(8), index=True)             # "V" o "R"
+    fin_ts_utc: Mapped[datetime] = mapped_column(DateTime(timezone=False), primary_key=VELAS_PARTICIONADA)
+    color: Mapped[str] = mapped_column(String(8))                          # "V" o "R"
 
     precio_cierre_up: Mapped[float | None] = mapped_column(Float, nullable=True)
     precio_cierre_down: Mapped[float | None] = mapped_column(Float, nullable=True)
@@ -24,5 +30,71 @@ class Vela(Base):
 
     __table_args__ = (
         UniqueConstraint("intervalo", "fin_ts_utc", "slug", name="uq_vela_int_fin_slug"),
-        Index("ix_velas_int_mercado_fin", "intervalo", "mercado", "fin_ts_utc"),
+        # cubriente para las lecturas (fin_ts_utc, color) por par: index-only scan en Postgres
+        Index("ix_velas_mercado_int_fin_color", "mercado", "intervalo", "fin_ts_utc", postgresql_include=["color"]),
+        # rangos de tiempo sin filtrar por par (archivado, mantenimiento); en SQLite no aplica
+        Index("ix_velas_fin_brin", "fin_ts_utc", postgresql_using="brin").ddl_if(dialect="postgresql"),
+        {"postgresql_partition_by": "RANGE (fin_ts_utc)"} if VELAS_PARTICIONADA else {},
+    )
+
+
+class CoberturaVelas(Base):
+    """Tramos [desde_utc, hasta_utc] ya ingeridos por completo desde Gamma."""
+    __tablename__ = "cobertura_velas"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    mercado: Mapped[str] = mapped_column(String(128))
+    intervalo: Mapped[str] = mapped_column(String(16))
+    desde_utc: Mapped[datetime] = mapped_column(DateTime(timezone=False))
+    hasta_utc: Mapped[datetime] = mapped_column(DateTime(timezone=False))
+
+    actualizado_en: Mapped[datetime] = mapped_column(DateTime(timezone=False), default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_cobertura_mercado_int_desde", "mercado", "intervalo", "desde_utc"),
+    )
+
+
+class EstadisticaPatronDia(Base):
+    """Conteos por patrón (longitud, código) de las velas resultado de un día UTC.
+
+    La ventana del patrón puede empezar el día anterior; primera/ultima_seg son el
+    epoch seg de la última vela del patrón en su primera y última ocurrencia del día.
+    """
+    __tablename__ = "estadisticas_patron_dia"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    mercado: Mapped[str] = mapped_column(String(128))
+    intervalo: Mapped[str] = mapped_column(String(16))
+    dia: Mapped[date] = mapped_column(Date)
+    longitud: Mapped[int] = mapped_column(Integer)
+    codigo: Mapped[int] = mapped_column(Integer)            # V=1, R=0; vela más antigua en el bit alto
+
+    verdes: Mapped[int] = mapped_column(Integer)
+    rojas: Mapped[int] = mapped_column(Integer)
+    primera_seg: Mapped[int] = mapped_column(BigInteger)
+    ultima_seg: Mapped[int] = mapped_column(BigInteger)
+
+    __table_args__ = (
+        UniqueConstraint("mercado", "intervalo", "dia", "longitud", "codigo", name="uq_estad_patron_dia"),
+    )
+
+
+class DiaPatrones(Base):
+    """Días ya materializados en estadisticas_patron_dia y cuántas velas tenían."""
+    __tablename__ = "dias_patrones"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    mercado: Mapped[str] = mapped_column(String(128))
+    intervalo: Mapped[str] = mapped_column(String(16))
+    dia: Mapped[date] = mapped_column(Date)
+    velas: Mapped[int] = mapped_column(Integer)
+
+    actualizado_en: Mapped[datetime] = mapped_column(DateTime(timezone=False), default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("mercado", "intervalo", "dia", name="uq_dias_patrones"),
     )
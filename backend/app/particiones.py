@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import ajustes
+from .models import VELAS_PARTICIONADA, Vela
+
+log = logging.getLogger(__name__)
+
+Mes = Tuple[int, int]  # (año, mes)
+
+# índices de columna suelta (y el compuesto anterior) que ya cubren el único y el cubriente
+INDICES_REDUNDANTES = (
+    "ix_velas_mercado", "ix_velas_intervalo", "ix_velas_slug", "ix_velas_market_id",
+    "ix_velas_fin_ts_utc", "ix_velas_color", "ix_velas_int_mercado_fin",
+)
+# pg_advisory_xact_lock: un solo proceso crea particiones a la vez (API y worker de ingesta)
+_LLAVE_CANDADO = 0x76656C6173
+_NOMBRE = re.compile(r"^velas_p(\d{4})_(\d{2})$")
+
+_SQL_TIPO = "SELECT relkind FROM pg_class WHERE oid = to_regclass('velas')"
+_SQL_HIJAS = """
+SELECT c.relname, c.reltuples::bigint
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass(:padre)
+ORDER BY c.relname
+"""
+
+# meses con partición ya creada; None = todavía no se consulta el catálogo
+_listos: Optional[Set[Mes]] = None
+_particionada = False
+
+
+def mes_de(dt: datetime) -> Mes:
+    return dt.year, dt.month
+
+
+def _siguiente(mes: Mes) -> Mes:
+    a, m = mes
+    return (a + 1, 1) if m == 12 else (a, m + 1)
+
+
+def meses_entre(desde: Mes, hasta: Mes) -> List[Mes]:
+    out, mes = [], desde
+    while mes <= hasta:
+        out.append(mes)
+        mes = _siguiente(mes)
+    return out
+
+
+def nombre_particion(mes: Mes) -> str:
+    return f"velas_p{mes[0]:04d}_{mes[1]:02d}"
+
+
+def _intervalos() -> List[str]:
+    return [i.strip() for i in ajustes.VELAS_SUBPARTICION_INTERVALOS.split(",") if i.strip()]
+
+
+def ddl_mes(mes: Mes) -> List[str]:
+    """CREATE TABLE de la partición del mes [día 1, día 1 del mes siguiente) y, si hay
+    VELAS_SUBPARTICION_INTERVALOS, sus sub-particiones LIST por intervalo más una DEFAULT."""
+    nombre = nombre_particion(mes)
+    a, m = _siguiente(mes)
+    rango = f"FOR VALUES FROM ('{mes[0]:04d}-{mes[1]:02d}-01') TO ('{a:04d}-{m:02d}-01')"
+    intervalos = _intervalos()
+    if not intervalos:
+        return [f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF velas {rango}"]
+    out = [f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF velas {rango} PARTITION BY LIST (intervalo)"]
+    for i in intervalos:
+        sufijo = re.sub(r"[^a-z0-9]", "_", i.lower())
+        valor = i.replace("'", "''")
+        out.append(f"CREATE TABLE IF NOT EXISTS {nombre}_{sufijo} PARTITION OF {nombre} FOR VALUES IN ('{valor}')")
+    out.append(f"CREATE TABLE IF NOT EXISTS {nombre}_otros PARTITION OF {nombre} DEFAULT")
+    return out
+
+
+def _cargar(tipo: Optional[str], hijas: Iterable) -> None:
+    global _listos, _particionada
+    _particionada = tipo == "p"
+    _listos = set()
+    for nombre, _filas in hijas:
+        if (g := _NOMBRE.match(nombre)) is not None:
+            _listos.add((int(g.group(1)), int(g.group(2))))
+    if VELAS_PARTICIONADA and not _particionada:
+        log.warning("VELAS_PARTICIONADAS=true pero velas no está particionada: python -m app.particiones migrar")
+
+
+def olvidar() -> None:
+    """Descarta los meses conocidos: la próxima llamada vuelve a leer el catálogo (otro
+    proceso pudo separar o borrar particiones, p. ej. con `archivar`)."""
+    global _listos
+    _listos = None
+
+
+def _faltantes(meses: Iterable[Mes]) -> List[Mes]:
+    if not _particionada:
+        return []
+    return sorted(set(meses) - _listos)
+
+
+def asegurar_meses(conn: Connection, meses: Iterable[Mes]) -> List[str]:
+    """Crea las particiones que falten para esos meses (en la transacción de conn)."""
+    if not VELAS_PARTICIONADA:
+        return []
+    if _listos is None:
+        _cargar(conn.execute(text(_SQL_TIPO)).scalar(), conn.execute(text(_SQL_HIJAS), {"padre": "velas"}))
+    faltan = _faltantes(meses)
+    if faltan:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LLAVE_CANDADO})
+        for mes in faltan:
+            for sql in ddl_mes(mes):
+                conn.execute(text(sql))
+        _listos.update(faltan)
+    return [nombre_particion(m) for m in faltan]
+
+
+async def asegurar_meses_async(db: AsyncSession, meses: Iterable[Mes]) -> List[str]:
+    """Igual que asegurar_meses desde la sesión async de la ingesta; hace commit si creó algo
+    (la sesión no debe tener escrituras pendientes)."""
+    if not VELAS_PARTICIONADA:
+        return []
+    if _listos is None:
+        tipo = (await db.execute(text(_SQL_TIPO))).scalar()
+        _cargar(tipo, (await db.execute(text(_SQL_HIJAS), {"padre": "velas"})).all())
+    faltan = _faltantes(meses)
+    if faltan:
+        await db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LLAVE_CANDADO})
+        for mes in faltan:
+            for sql in ddl_mes(mes):
+                await db.execute(text(sql))
+        await db.commit()
+        _listos.update(faltan)
+        log.info("particiones creadas: %s", ", ".join(nombre_particion(m) for m in faltan))
+    return [nombre_particion(m) for m in faltan]
+
+
+def _proximos(hoy: Optional[date] = None) -> List[Mes]:
+    hoy = hoy or datetime.now(timezone.utc).date()
+    hasta = (hoy.year, hoy.month)
+    for _ in range(max(0, ajustes.VELAS_MESES_ADELANTE)):
+        hasta = _siguiente(hasta)
+    return meses_entre((hoy.year, hoy.month), hasta)
+
+
+def preparar(engine: Engine) -> None:
+    """Al iniciar (API o worker): particiones del mes actual y VELAS_MESES_ADELANTE siguientes."""
+    if not VELAS_PARTICIONADA:
+        return
+    with engine.begin() as conn:
+        creadas = asegurar_meses(conn, _proximos())
+    if creadas:
+        log.info("particiones creadas: %s", ", ".join(creadas))
+
+
+def particiones(conn: Connection) -> List[Dict]:
+    """Particiones mensuales de velas con su conteo estimado (reltuples)."""
+    out = []
+    for nombre, filas in conn.execute(text(_SQL_HIJAS), {"padre": "velas"}):
+        if (g := _NOMBRE.match(nombre)) is not None:
+            out.append({"nombre": nombre, "mes": (int(g.group(1)), int(g.group(2))), "filas_estimadas": max(0, filas)})
+    return out
+
+
+def borrar_indices_redundantes(conn: Connection) -> None:
+    for nombre in INDICES_REDUNDANTES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+
+
+def migrar(engine: Engine, *, conservar: bool = False) -> Dict:
+    """Quita los índices redundantes y, con VELAS_PARTICIONADAS, pasa una velas normal a la
+    tabla particionada en una sola transacción (copia todas las filas: detener la ingesta antes)."""
+    global _listos
+    with engine.begin() as conn:
+        borrar_indices_redundantes(conn)
+        if not VELAS_PARTICIONADA:
+            return {"particionada": False}
+        tipo = conn.execute(text(_SQL_TIPO)).scalar()
+        if tipo == "p":
+            return {"particionada": True, "copiadas": 0, "creadas": asegurar_meses(conn, _proximos())}
+
+        if tipo is not None:
+            conn.execute(text("ALTER TABLE velas RENAME TO velas_sin_particion"))
+            # los nombres de índices y constraints son por esquema: liberarlos para la tabla nueva
+            for (indice,) in conn.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'velas_sin_particion'"
+            )).all():
+                conn.execute(text(f'ALTER INDEX "{indice}" RENAME TO "{indice[:50]}_sin_particion"'))
+        Vela.__table__.create(conn)
+        _listos = None
+        meses = _proximos()
+        if tipo is not None:
+            minimo, maximo = conn.execute(text("SELECT min(fin_ts_utc), max(fin_ts_utc) FROM velas_sin_particion")).one()
+            if minimo is not None:
+                meses += meses_entre(mes_de(minimo), mes_de(maximo))
+        creadas = asegurar_meses(conn, meses)
+
+        copiadas = 0
+        if tipo is not None:
+            columnas = ", ".join(c.name for c in Vela.__table__.columns)
+            copiadas = conn.execute(text(
+                f"INSERT INTO velas ({columnas}) SELECT {columnas} FROM velas_sin_particion"
+            )).rowcount
+            conn.execute(text(
+                "SELECT setval(pg_get_serial_sequence('velas', 'id'), coalesce((SELECT max(id) FROM velas), 0) + 1, false)"
+            ))
+            if not conservar:
+                conn.execute(text("DROP TABLE velas_sin_particion"))
+    return {"particionada": True, "copiadas": copiadas, "creadas": creadas}
+
+
+def archivar(engine: Engine, antes_de: Mes, *, esquema: str = "archivo", borrar: bool = False) -> List[str]:
+    """Separa (DETACH) las particiones de meses anteriores a antes_de y las mueve a 'esquema'
+    (o las borra). Sus velas dejan de leerse; la cobertura se conserva, así que esos tramos no
+    se vuelven a pedir a Gamma, y los agregados diarios ya materializados siguen sirviendo."""
+    if not VELAS_PARTICIONADA:
+        raise RuntimeError("velas no está en modo particionado (VELAS_PARTICIONADAS=true en Postgres)")
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", esquema):
+        raise ValueError(f"esquema inválido: {esquema}")
+    global _listos
+    hechas = []
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LLAVE_CANDADO})
+        if not borrar:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {esquema}"))
+        for p in particiones(conn):
+            if p["mes"] >= antes_de:
+                continue
+            nombre = p["nombre"]
+            conn.execute(text(f"ALTER TABLE velas DETACH PARTITION {nombre}"))
+            if borrar:
+                conn.execute(text(f"DROP TABLE {nombre}"))
+            else:
+                # SET SCHEMA no arrastra las sub-particiones
+                hijas = [h for h, _ in conn.execute(text(_SQL_HIJAS), {"padre": nombre})]
+                for tabla in [nombre, *hijas]:
+                    conn.execute(text(f"ALTER TABLE {tabla} SET SCHEMA {esquema}"))
+            hechas.append(nombre)
+    _listos = None
+    return hechas
+
+
+def _mes_arg(texto: str) -> Mes:
+    a, m = texto.split("-")[:2]
+    return int(a), int(m)
+
+
+if __name__ == "__main__":
+    # python -m app.particiones estado|migrar|crear|archivar (ver README)
+    import argparse
+
+    from .db import engine
+
+    p = argparse.ArgumentParser(prog="python -m app.particiones", description="Particiones mensuales de velas.")
+    sub = p.add_subparsers(dest="comando", required=True)
+    sub.add_parser("estado", help="particiones actuales y filas estimadas")
+    s = sub.add_parser("migrar", help="quita índices redundantes y convierte velas a particionada")
+    s.add_argument("--conservar", action="store_true", help="no borrar velas_sin_particion al terminar")
+    s = sub.add_parser("crear", help="crea por adelantado las particiones de un rango de meses")
+    s.add_argument("desde", type=_mes_arg, help="AAAA-MM")
+    s.add_argument("hasta", type=_mes_arg, help="AAAA-MM")
+    s = sub.add_parser("archivar", help="separa las particiones de meses anteriores a antes_de")
+    s.add_argument("antes_de", type=_mes_arg, help="AAAA-MM (este mes se conserva)")
+    s.add_argument("--esquema", default="archivo")
+    s.add_argument("--borrar", action="store_true", help="borrar en vez de mover al esquema de archivo")
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.comando == "migrar":
+        print(migrar(engine, conservar=args.conservar))
+    elif args.comando == "crear":
+        with engine.begin() as conn:
+            print(asegurar_meses(conn, meses_entre(args.desde, args.hasta)))
+    elif args.comando == "archivar":
+        print(archivar(engine, args.antes_de, esquema=args.esquema, borrar=args.borrar))
+    elif not VELAS_PARTICIONADA:
+        print("velas no está particionada (VELAS_PARTICIONADAS=true en Postgres)")
+    else:
+        with engine.connect() as conn:
+            for fila in particiones(conn):
+                print(f"{fila['nombre']:24s} {fila['filas_estimadas']:>12d}")
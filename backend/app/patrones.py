@@ -1,33 +1,109 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import base64
+import json
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, List, Sequence, Tuple, Optional, Union
 
+import numpy as np
 
-@dataclass
-class StatsPatron:
-    verdes: int = 0
-    rojas: int = 0
-    # Guardamos timestamps (UTC naive) de la "última vela del patrón" cada vez que aparece
-    ocurrencias_ts: List[datetime] = field(default_factory=list)
+from .coincidencias import SerieColores, seg_en
+from .utils_time import seg_a_utc_naive
 
-    @property
-    def muestras(self) -> int:
-        return self.verdes + self.rojas
 
+# Bit por color: V=1, R=0. El patrón se codifica con la vela más antigua en el bit alto.
+_BIT_COLOR = {"V": 1, "R": 0}
+_A_COLOR = str.maketrans("10", "VR")
 
-def _avg_seg_entre(ts_list: List[datetime]) -> Optional[int]:
-    if len(ts_list) < 2:
-        return None
-    # orden por si acaso
-    ts_list = sorted(ts_list)
-    diffs = []
-    for a, b in zip(ts_list[:-1], ts_list[1:]):
-        diffs.append(int((b - a).total_seconds()))
-    if not diffs:
-        return None
-    return int(sum(diffs) / len(diffs))
+# (patron, direccion, efectividad, total, verdes, rojas, ultima_vez_utc, aparece_cada_seg, desde_ultima_seg)
+FilaRanking = Tuple[str, str, float, int, int, int, Optional[datetime], Optional[int], Optional[int]]
+
+
+def _decodificar(codigo: int, L: int) -> str:
+    return format(codigo, f"0{L}b").translate(_A_COLOR)
+
+
+@dataclass(slots=True)
+class ConteoLongitudes:
+    """Conteos por (longitud, código) en tablas planas de tamaño fijo.
+
+    La longitud L ocupa los índices [base[L], base[L] + 2**L).
+    primero/ultimo guardan la posición de la última vela del patrón (-1 = nunca visto):
+    índice en la serie, o epoch seg si el conteo viene de tramos ya convertidos a tiempo.
+    """
+    longitud_min: int
+    longitud_max: int
+    base: Dict[int, int]
+    verdes: List[int]
+    rojas: List[int]
+    primero: List[int]
+    ultimo: List[int]
+
+    @classmethod
+    def vacio(cls, longitud_min: int, longitud_max: int) -> "ConteoLongitudes":
+        base: Dict[int, int] = {}
+        tam = 0
+        for L in range(longitud_min, longitud_max + 1):
+            base[L] = tam
+            tam += 1 << L
+        return cls(
+            longitud_min=longitud_min,
+            longitud_max=longitud_max,
+            base=base,
+            verdes=[0] * tam,
+            rojas=[0] * tam,
+            primero=[-1] * tam,
+            ultimo=[-1] * tam,
+        )
+
+    def anexar(self, otro: "ConteoLongitudes") -> None:
+        """Suma un conteo de un tramo posterior (mismas longitudes, posiciones comparables)."""
+        for k, (v, r) in enumerate(zip(otro.verdes, otro.rojas)):
+            if v == 0 and r == 0:
+                continue
+            self.verdes[k] += v
+            self.rojas[k] += r
+            if self.primero[k] < 0:
+                self.primero[k] = otro.primero[k]
+            self.ultimo[k] = otro.ultimo[k]
+
+
+def contar_todas_longitudes(
+    bits: List[int], longitud_min: int, longitud_max: int, desde: int = 1
+) -> ConteoLongitudes:
+    """Una sola pasada: desliza un código entero y actualiza todas las longitudes a la vez.
+
+    Solo cuenta resultados en índices >= desde; las velas anteriores sirven de contexto.
+    """
+    conteo = ConteoLongitudes.vacio(longitud_min, longitud_max)
+    verdes = conteo.verdes
+    rojas = conteo.rojas
+    primero = conteo.primero
+    ultimo = conteo.ultimo
+
+    longitudes = [(L, conteo.base[L], (1 << L) - 1) for L in range(longitud_min, longitud_max + 1)]
+    mascara_max = (1 << longitud_max) - 1
+    codigo = 0
+
+    for i in range(1, len(bits)):
+        codigo = ((codigo << 1) | bits[i - 1]) & mascara_max
+        if i < desde:
+            continue
+        siguiente = bits[i]
+        for L, b, m in longitudes:
+            if L > i:
+                break
+            k = b + (codigo & m)
+            if siguiente:
+                verdes[k] += 1
+            else:
+                rojas[k] += 1
+            if primero[k] < 0:
+                primero[k] = i - 1
+            ultimo[k] = i - 1
+
+    return conteo
 
 
 def rankear_patrones(
@@ -57,95 +133,294 @@ def rankear_patrones(
 
 def rankear_patrones_con_tiempos(
     *,
-    colores: List[str],
-    fin_ts_list: Optional[List[datetime]],
+    colores: SerieColores,
+    fin_ts_list: Optional[Union[List[datetime], np.ndarray]],
     longitud_min: int,
     longitud_max: int,
     min_muestras: int,
     alpha: float = 0.0,
     now_utc: Optional[datetime] = None,
-) -> List[Tuple[str, str, float, int, int, int, Optional[datetime], Optional[int], Optional[int]]]:
+) -> List[FilaRanking]:
     """
-    Cuenta patrones de V/R y calcula efectividad (dirección dominante).
+    Cuenta patrones de V/R (todas las longitudes en una sola pasada) y calcula
+    efectividad (dirección dominante).
     Además devuelve:
       - ultima_vez_utc (aware UTC) = cuándo se vio por última vez el patrón
       - aparece_cada_seg (promedio entre ocurrencias)
       - desde_ultima_seg (segundos desde la última vez hasta ahora)
     """
-    if now_utc is None:
-        now_utc = datetime.now(timezone.utc)
+    return ranking_con_tiempos(
+        colores=colores,
+        fin_ts_list=fin_ts_list,
+        longitud_min=longitud_min,
+        longitud_max=longitud_max,
+        min_muestras=min_muestras,
+        alpha=alpha,
+        now_utc=now_utc,
+    ).filas()
 
-    stats: Dict[str, StatsPatron] = {}
-    n = len(colores)
 
+def ranking_con_tiempos(
+    *,
+    colores: SerieColores,
+    fin_ts_list: Optional[Union[List[datetime], np.ndarray]],
+    longitud_min: int,
+    longitud_max: int,
+    min_muestras: int,
+    alpha: float = 0.0,
+    now_utc: Optional[datetime] = None,
+    orden: str = "efectividad",
+    limite: Optional[int] = None,
+    despues_de: Optional[Sequence] = None,
+) -> RankingPatrones:
+    """Como rankear_patrones_con_tiempos, pero sin materializar las filas
+    (con orden / top-K / paginación, ver ranking_desde_conteo)."""
     Lmin = max(2, int(longitud_min))
     Lmax = max(Lmin, int(longitud_max))
 
     # Si fin_ts_list viene, debe ser mismo largo que colores
     usar_tiempos = fin_ts_list is not None and len(fin_ts_list) == len(colores)
 
-    for L in range(Lmin, Lmax + 1):
-        for i in range(L, n):
-            patron = "".join(colores[i - L:i])
-            siguiente = colores[i]
+    if isinstance(colores, np.ndarray):
+        bits = colores.tolist()
+    else:
+        bits = [_BIT_COLOR.get(c, 0) for c in colores]
+    conteo = contar_todas_longitudes(bits, Lmin, Lmax)
 
-            s = stats.get(patron)
-            if s is None:
-                s = StatsPatron()
-                stats[patron] = s
+    return ranking_desde_conteo(
+        conteo,
+        min_muestras=min_muestras,
+        alpha=alpha,
+        now_utc=now_utc,
+        a_seg=(lambda i: seg_en(fin_ts_list, i)) if usar_tiempos else None,
+        orden=orden,
+        limite=limite,
+        despues_de=despues_de,
+    )
 
-            if siguiente == "V":
-                s.verdes += 1
-            else:
-                s.rojas += 1
 
-            if usar_tiempos:
-                # timestamp de la última vela del patrón (posición i-1)
-                s.ocurrencias_ts.append(fin_ts_list[i - 1])
+@dataclass(slots=True)
+class RankingPatrones:
+    """Ranking ya ordenado como arreglos paralelos (uno por columna).
 
-    filas: List[Tuple[str, str, float, int, int, int, Optional[datetime], Optional[int], Optional[int]]] = []
+    Solo las filas que se leen (filas / dicts) se convierten a str/datetime; el resto
+    del ranking nunca crea objetos por patrón.
+    """
+    longitud: np.ndarray      # int64
+    codigo: np.ndarray        # int64
+    verdes: np.ndarray        # int64
+    rojas: np.ndarray         # int64
+    efectividad: np.ndarray   # float64
+    es_verde: np.ndarray      # bool, dirección dominante V
+    primero: np.ndarray       # int64, posición (ver ConteoLongitudes)
+    ultimo: np.ndarray        # int64
+    a_seg: Optional[Callable[[int], int]]
+    now_utc: datetime
+    orden: str = "efectividad"
+    candidatos: int = 0       # patrones que pasan min_muestras (antes de paginar)
+    hay_mas: bool = False     # quedaron filas después de la última devuelta
 
-    for patron, s in stats.items():
-        total = s.muestras
-        if total < min_muestras:
-            continue
+    def __len__(self) -> int:
+        return len(self.codigo)
 
-        if alpha > 0:
-            pv = (s.verdes + alpha) / (total + 2 * alpha)
-            pr = (s.rojas + alpha) / (total + 2 * alpha)
-        else:
-            pv = s.verdes / total
-            pr = s.rojas / total
+    def clave(self, j: int) -> List:
+        """Clave de orden de la fila j (para pedir la página siguiente)."""
+        n = self.verdes[j:j + 1] + self.rojas[j:j + 1]
+        claves = _claves_orden(
+            self.orden, self.efectividad[j:j + 1], n, self.longitud[j:j + 1],
+            self.primero[j:j + 1], self.ultimo[j:j + 1],
+        )
+        return [c[0].item() for c in claves]
 
-        if pv >= pr:
-            direccion = "V"
-            efect = float(pv)
-        else:
-            direccion = "R"
-            efect = float(pr)
+    def fila(self, j: int) -> FilaRanking:
+        L = int(self.longitud[j])
+        verdes = int(self.verdes[j])
+        rojas = int(self.rojas[j])
+        total = verdes + rojas
 
         ultima_vez_utc = None
         aparece_cada_seg = None
         desde_ultima_seg = None
 
-        if usar_tiempos and s.ocurrencias_ts:
-            last_naive = max(s.ocurrencias_ts)
+        if self.a_seg is not None:
+            ultima_seg = self.a_seg(int(self.ultimo[j]))
             # lo devolvemos como aware UTC para que FastAPI lo serialice bien
-            ultima_vez_utc = last_naive.replace(tzinfo=timezone.utc)
-            aparece_cada_seg = _avg_seg_entre(s.ocurrencias_ts)
-            desde_ultima_seg = int((now_utc - ultima_vez_utc).total_seconds())
-
-        filas.append((
-            patron,
-            direccion,
-            efect,
-            int(total),
-            int(s.verdes),
-            int(s.rojas),
+            ultima_vez_utc = seg_a_utc_naive(ultima_seg).replace(tzinfo=timezone.utc)
+            if total >= 2:
+                # promedio de diferencias consecutivas = (última - primera) / (n - 1)
+                span = ultima_seg - self.a_seg(int(self.primero[j]))
+                aparece_cada_seg = int(span / (total - 1))
+            desde_ultima_seg = int((self.now_utc - ultima_vez_utc).total_seconds())
+
+        return (
+            _decodificar(int(self.codigo[j]), L),
+            "V" if self.es_verde[j] else "R",
+            float(self.efectividad[j]),
+            total,
+            verdes,
+            rojas,
             ultima_vez_utc,
             aparece_cada_seg,
-            desde_ultima_seg
-        ))
+            desde_ultima_seg,
+        )
+
+    def filas(self, desde: int = 0, hasta: Optional[int] = None) -> List[FilaRanking]:
+        hasta = len(self) if hasta is None else min(hasta, len(self))
+        return [self.fila(j) for j in range(desde, hasta)]
+
+    def dicts(self, desde: int = 0, hasta: Optional[int] = None) -> List[Dict]:
+        """Filas como dicts con los nombres de FilaPatron."""
+        return [dict(zip(_CAMPOS_FILA, f)) for f in self.filas(desde, hasta)]
+
+    def columnas(self) -> Dict[str, Union[np.ndarray, List]]:
+        """Columnas para las respuestas columnares: los arreglos tal cual, solo el patrón se
+        decodifica a str; tiempos en epoch seg (desde_ultima_seg lo calcula el cliente)."""
+        total = self.verdes + self.rojas
+        cols: Dict[str, Union[np.ndarray, List]] = {
+            "patron": [_decodificar(int(c), int(L)) for c, L in zip(self.codigo.tolist(), self.longitud.tolist())],
+            "verde": self.es_verde.astype(bool, copy=False),
+            "efectividad": self.efectividad,
+            "muestras": total,
+            "verdes": self.verdes,
+            "rojas": self.rojas,
+        }
+        if self.a_seg is not None:
+            ultima = np.array([self.a_seg(int(u)) for u in self.ultimo.tolist()], dtype=np.int64)
+            primera = np.array([self.a_seg(int(p)) for p in self.primero.tolist()], dtype=np.int64)
+            cols["ultima_vez_seg"] = ultima
+            cols["aparece_cada_seg"] = [
+                int((u - p) / (n - 1)) if n >= 2 else None
+                for u, p, n in zip(ultima.tolist(), primera.tolist(), total.tolist())
+            ]
+        return cols
+
+
+_CAMPOS_FILA = (
+    "patron", "direccion", "efectividad", "muestras", "verdes", "rojas",
+    "ultima_vez_utc", "aparece_cada_seg", "desde_ultima_seg",
+)
+
+
+# criterio de orden -> columnas de su clave (ascendente); longitud y primera aparición
+# desempatan siempre, así la clave es única por patrón y sirve de cursor
+ORDENES = {"efectividad": 4, "muestras": 4, "reciente": 5}
+
+
+def codificar_cursor(orden: str, clave: Sequence) -> str:
+    return base64.urlsafe_b64encode(json.dumps([orden, list(clave)]).encode()).decode().rstrip("=")
+
+
+def leer_cursor(cursor: str) -> Tuple[str, List]:
+    """Inverso de codificar_cursor; ValueError si el cursor no es válido."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        orden, clave = json.loads(crudo)
+    except Exception as e:
+        raise ValueError("cursor inválido") from e
+    n_claves = ORDENES.get(orden) if isinstance(orden, str) else None
+    if n_claves is None or not isinstance(clave, list) or len(clave) != n_claves \
+            or not all(isinstance(x, (int, float)) for x in clave):
+        raise ValueError("cursor inválido")
+    return orden, clave
+
+
+def _claves_orden(orden: str, efect, n, longitud, primero, ultimo) -> List[np.ndarray]:
+    if orden == "efectividad":
+        return [-efect, -n, longitud, primero]
+    if orden == "muestras":
+        return [-n, -efect, longitud, primero]
+    if orden == "reciente":
+        return [-ultimo, -efect, -n, longitud, primero]
+    raise ValueError(f"orden inválido: {orden}")
+
+
+def _despues_de(claves: List[np.ndarray], cursor: Sequence) -> np.ndarray:
+    """Máscara de filas cuya clave es estrictamente mayor que la del cursor (orden lexicográfico)."""
+    despues = claves[-1] > cursor[-1]
+    for col, valor in zip(reversed(claves[:-1]), reversed(cursor[:-1])):
+        despues = (col > valor) | ((col == valor) & despues)
+    return despues
 
-    filas.sort(key=lambda x: (x[2], x[3]), reverse=True)
-    return filas
+
+def ranking_desde_conteo(
+    conteo: ConteoLongitudes,
+    *,
+    min_muestras: int,
+    alpha: float = 0.0,
+    now_utc: Optional[datetime] = None,
+    a_seg: Optional[Callable[[int], int]] = None,
+    orden: str = "efectividad",
+    limite: Optional[int] = None,
+    despues_de: Optional[Sequence] = None,
+) -> RankingPatrones:
+    """Ranking a partir de un conteo, vectorizado sobre las tablas planas.
+    a_seg convierte una posición a epoch seg (None = sin campos de tiempo).
+
+    Con limite solo se ordenan los primeros `limite` (selección parcial + orden de esos);
+    despues_de es la clave de la última fila de la página anterior (ver RankingPatrones.clave).
+    """
+    if now_utc is None:
+        now_utc = datetime.now(timezone.utc)
+
+    verdes = np.asarray(conteo.verdes, dtype=np.int64)
+    rojas = np.asarray(conteo.rojas, dtype=np.int64)
+    total = verdes + rojas
+    k = np.flatnonzero((total > 0) & (total >= min_muestras))
+    candidatos = len(k)
+
+    # longitud y código de cada posición de las tablas planas
+    longitud = np.empty(len(verdes), dtype=np.int64)
+    codigo = np.empty(len(verdes), dtype=np.int64)
+    for L in range(conteo.longitud_min, conteo.longitud_max + 1):
+        b = conteo.base[L]
+        longitud[b:b + (1 << L)] = L
+        codigo[b:b + (1 << L)] = np.arange(1 << L)
+
+    v = verdes[k]
+    r = rojas[k]
+    n = total[k]
+    if alpha > 0:
+        pv = (v + alpha) / (n + 2 * alpha)
+        pr = (r + alpha) / (n + 2 * alpha)
+    else:
+        pv = v / n
+        pr = r / n
+    es_verde = pv >= pr
+    efect = np.where(es_verde, pv, pr)
+    primero = np.asarray(conteo.primero, dtype=np.int64)[k]
+    ultimo = np.asarray(conteo.ultimo, dtype=np.int64)[k]
+
+    claves = _claves_orden(orden, efect, n, longitud[k], primero, ultimo)
+    sel = np.arange(len(k))
+    if despues_de is not None:
+        sel = np.flatnonzero(_despues_de(claves, despues_de))
+
+    hay_mas = False
+    if limite is not None and len(sel) > limite:
+        hay_mas = True
+        # top-K: umbral de la clave principal por selección parcial; los empates en el
+        # umbral entran todos y el orden completo decide entre ellos
+        principal = claves[0][sel]
+        umbral = np.partition(principal, limite - 1)[limite - 1]
+        sel = sel[principal <= umbral]
+
+    idx = sel[np.lexsort(tuple(c[sel] for c in reversed(claves)))]
+    if limite is not None:
+        idx = idx[:limite]
+
+    kk = k[idx]
+    return RankingPatrones(
+        longitud=longitud[kk],
+        codigo=codigo[kk],
+        verdes=v[idx],
+        rojas=r[idx],
+        efectividad=efect[idx],
+        es_verde=es_verde[idx],
+        primero=primero[idx],
+        ultimo=ultimo[idx],
+        a_seg=a_seg,
+        now_utc=now_utc,
+        orden=orden,
+        candidatos=candidatos,
+        hay_mas=hay_mas,
+    )
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator, List, Optional
+
+from .config import ajustes
+
+MODOS = ("muestreo", "cprofile")
+
+# solo cuentan las pilas que pasan por código de la app (descarta hilos ociosos del loop/pool)
+_DIR_APP = os.path.dirname(os.path.abspath(__file__))
+
+
+class Perfil:
+    """Perfil de una request (o de un replay).
+
+    - "muestreo": un hilo toma la pila de todos los hilos cada intervalo_seg y guarda
+      pilas colapsadas ("f1 (archivo:línea);f2 (...) N"), listas para flamegraph.pl/speedscope.
+    - "cprofile": perfil determinista del hilo del event loop y de cada tarea que corre en
+      el pool de análisis (en_hilo); se guarda como .pstats.
+    """
+
+    def __init__(self, modo: str, intervalo_seg: float = 0.002):
+        if modo not in MODOS:
+            raise ValueError(f"modo de perfil inválido: {modo}")
+        self.modo = modo
+        self.intervalo_seg = intervalo_seg
+        self.muestras: Counter = Counter()
+        self._perfiles: List[cProfile.Profile] = []
+        self._alto = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def iniciar(self) -> None:
+        if self.modo == "muestreo":
+            self._hilo = threading.Thread(target=self._muestrear, name="perfil-muestreo", daemon=True)
+            self._hilo.start()
+        else:
+            p = cProfile.Profile()
+            self._perfiles.append(p)
+            p.enable()
+
+    def detener(self) -> None:
+        if self.modo == "muestreo":
+            self._alto.set()
+            if self._hilo is not None:
+                self._hilo.join()
+        else:
+            self._perfiles[0].disable()
+
+    def envolver(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """fn perfilada en el hilo donde corra (modo cprofile; en muestreo no hace falta)."""
+        if self.modo != "cprofile":
+            return fn
+
+        def _perfilada(*args: Any, **kwargs: Any) -> Any:
+            p = cProfile.Profile()
+            try:
+                return p.runcall(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._perfiles.append(p)
+
+        return _perfilada
+
+    def _muestrear(self) -> None:
+        propio = threading.get_ident()
+        while not self._alto.wait(self.intervalo_seg):
+            for tid, frame in sys._current_frames().items():
+                if tid == propio:
+                    continue
+                pila = []
+                en_app = False
+                while frame is not None:
+                    codigo = frame.f_code
+                    en_app = en_app or codigo.co_filename.startswith(_DIR_APP)
+                    pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if en_app:
+                    self.muestras[";".join(reversed(pila))] += 1
+
+    def guardar(self, directorio: str, etiqueta: str) -> str:
+        """Escribe el artefacto y regresa su nombre de archivo (dentro de directorio)."""
+        os.makedirs(directorio, exist_ok=True)
+        base = re.sub(r"[^A-Za-z0-9_.-]+", "_", etiqueta).strip("_") or "request"
+        sello = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        if self.modo == "muestreo":
+            nombre = f"{sello}-{base}.collapsed.txt"
+            with open(os.path.join(directorio, nombre), "w", encoding="utf-8") as f:
+                for pila, n in self.muestras.most_common():
+                    f.write(f"{pila} {n}\n")
+        else:
+            nombre = f"{sello}-{base}.pstats"
+            stats = pstats.Stats(self._perfiles[0])
+            for p in self._perfiles[1:]:
+                stats.add(p)
+            stats.dump_stats(os.path.join(directorio, nombre))
+        return nombre
+
+
+_actual: ContextVar[Optional[Perfil]] = ContextVar("perfil_request", default=None)
+# un solo perfil a la vez: cProfile es uno por hilo y el muestreo ve todos los hilos
+_ocupado = threading.Lock()
+
+
+def perfil_activo() -> Optional[Perfil]:
+    return _actual.get()
+
+
+@contextmanager
+def perfilando(modo: str) -> Iterator[Optional[Perfil]]:
+    """Perfila lo que corre dentro del bloque; None si ya hay otro perfil en curso."""
+    if not _ocupado.acquire(blocking=False):
+        yield None
+        return
+    perfil = Perfil(modo, ajustes.PERFILADO_INTERVALO_MS / 1000)
+    token = _actual.set(perfil)
+    perfil.iniciar()
+    try:
+        yield perfil
+    finally:
+        perfil.detener()
+        _actual.reset(token)
+        _ocupado.release()
+
+
+def modo_solicitado(headers, query) -> Optional[str]:
+    """Modo pedido con el header X-Perfilar o ?perfilar= (None si no se pidió o no está permitido)."""
+    if not ajustes.PERFILADO:
+        return None
+    valor = (headers.get("x-perfilar") or query.get("perfilar") or "").strip().lower()
+    if not valor:
+        return None
+    if ajustes.PERFILADO_TOKEN and headers.get("x-perfilar-token") != ajustes.PERFILADO_TOKEN:
+        return None
+    if valor in ("1", "true", "si"):
+        return "muestreo"
+    return valor if valor in MODOS else None
+
+
+def ruta_artefacto(nombre: str) -> Optional[str]:
+    """Ruta de un artefacto guardado (None si el nombre no es de un archivo de PERFILADO_DIR)."""
+    if not nombre or os.path.basename(nombre) != nombre or nombre.startswith("."):
+        return None
+    ruta = os.path.join(ajustes.PERFILADO_DIR, nombre)
+    return ruta if os.path.isfile(ruta) else None
+
+
+async def _replay(args) -> None:
+    import json
+
+    import httpx
+
+    from .main import app
+
+    with open(args.cuerpo, encoding="utf-8") as f:
+        cuerpo = json.load(f)
+    metodo = args.metodo.upper()
+
+    async def llamar(cliente: httpx.AsyncClient) -> httpx.Response:
+        if metodo == "GET":
+            return await cliente.get(args.ruta, params=cuerpo)
+        return await cliente.request(metodo, args.ruta, json=cuerpo)
+
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://replay", timeout=None) as cliente:
+        for _ in range(args.calentar):
+            await llamar(cliente)
+        t = time.perf_counter()
+        with perfilando(args.modo) as perfil:
+            for _ in range(args.repeticiones):
+                r = await llamar(cliente)
+        seg = time.perf_counter() - t
+    nombre = perfil.guardar(args.salida, f"replay-{args.ruta}")
+    print(f"{metodo} {args.ruta} -> {r.status_code} en {seg:.3f} s ({args.repeticiones} rep.)")
+    print(f"Server-Timing: {r.headers.get('server-timing', '')}")
+    print(os.path.join(args.salida, nombre))
+
+
+if __name__ == "__main__":
+    # Replay offline: DATABASE_URL=... python -m app.perfilado /patrones/rankear req.json
+    import argparse
+    import asyncio
+
+    p = argparse.ArgumentParser(prog="python -m app.perfilado", description="Perfila un request guardado contra la DB local.")
+    p.add_argument("ruta", help="ruta del endpoint, p. ej. /patrones/rankear")
+    p.add_argument("cuerpo", help="JSON del request (body; en GET se manda como query)")
+    p.add_argument("--metodo", default="POST")
+    p.add_argument("--modo", choices=MODOS, default="muestreo")
+    p.add_argument("--calentar", type=int, default=1, help="llamadas previas sin perfilar (caches calientes)")
+    p.add_argument("--repeticiones", type=int, default=1)
+    p.add_argument("--salida", default=ajustes.PERFILADO_DIR)
+    # desde el módulo del paquete: el contextvar tiene que ser el mismo que ven main/hilos
+    from app import perfilado
+
+    asyncio.run(perfilado._replay(p.parse_args()))
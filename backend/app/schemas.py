@@ -10,6 +10,28 @@ class ReqIngestLive(BaseModel):
     bloques_lookback: int = Field(144, ge=1, le=4000)
     prefix: str = ""  # opcional: forzar prefix tipo "btc-updown-5m-"
 
+class ResIngestLive(BaseModel):
+    mercado: str
+    intervalo: Intervalo
+    desde_utc: datetime
+    hasta_utc: datetime
+    insertadas: int
+    omitidas: int
+    errores: int
+
+class EstadoIngesta(BaseModel):
+    mercado: str
+    intervalo: Intervalo
+    activo: bool
+    ejecuciones: int
+    insertadas_total: int
+    ultima_ejecucion_utc: Optional[datetime] = None
+    proxima_ejecucion_utc: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+
+class ResEstadoIngesta(BaseModel):
+    tareas: List[EstadoIngesta]
+
 class ReqRankearPatrones(BaseModel):
     mercado: str = "btc-updown"
     intervalo: Intervalo
@@ -19,6 +41,9 @@ class ReqRankearPatrones(BaseModel):
     longitud_max: int = Field(6, ge=2, le=12)
     min_muestras: int = Field(20, ge=1, le=100000)
     suavizado: float = Field(0.0, ge=0.0, le=10.0)
+    orden: Literal["efectividad", "muestras", "reciente"] = "efectividad"
+    limite: int = Field(500, ge=1, le=5000)
+    cursor: Optional[str] = None  # siguiente_cursor de la página anterior
 
 class FilaPatron(BaseModel):
     patron: str
@@ -35,6 +60,8 @@ class FilaPatron(BaseModel):
 
 class ResRankearPatrones(BaseModel):
     filas: List[FilaPatron]
+    total: int = 0                          # patrones que pasan min_muestras
+    siguiente_cursor: Optional[str] = None  # None = no hay más páginas
 
 class ReqSimular(BaseModel):
     mercado: str = "btc-updown"
@@ -46,7 +73,9 @@ class ReqSimular(BaseModel):
     banca0: float = Field(1000.0, gt=0)
     stake: float = Field(10.0, gt=0)
     payout: float = Field(0.85, ge=0, le=2.0)
-    reinvertir: bool = True
+    reinvertir: bool = True  # apuesta la fracción stake/banca0 de la banca actual (compuesto)
+    # "objetos": un TradeSim por trade | "columnas": arreglos paralelos | "ninguno": solo resumen
+    formato_trades: Literal["objetos", "columnas", "ninguno"] = "objetos"
 
 class TradeSim(BaseModel):
     fin_ts_utc: datetime
@@ -57,6 +86,17 @@ class TradeSim(BaseModel):
     pnl: float
     banca_despues: float
 
+class TradesColumnas(BaseModel):
+    """Trades como arreglos paralelos (mismo largo), incluye curva de equity y drawdown."""
+    patron: str
+    direccion: Literal["V", "R"]
+    fin_ts_utc: List[datetime]
+    real: str  # una letra V/R por trade
+    gano: List[bool]
+    pnl: List[float]
+    banca_despues: List[float]
+    drawdown: List[float]
+
 class ResSimular(BaseModel):
     banca0: float
     banca_fin: float
@@ -65,7 +105,44 @@ class ResSimular(BaseModel):
     max_drawdown: float
     max_racha_perdidas: int
     max_racha_ganadas: int
-    trades: List[TradeSim]
+    trades: List[TradeSim] = Field(default_factory=list)
+    trades_columnas: Optional[TradesColumnas] = None
+
+class ReqSimularBarrido(BaseModel):
+    mercado: str = "btc-updown"
+    intervalo: Intervalo
+    inicio: datetime
+    fin: datetime
+    patrones: List[str] = Field(..., min_length=1)
+    direcciones: List[Literal["V", "R"]] = Field(default_factory=lambda: ["V", "R"])
+    banca0: float = Field(1000.0, gt=0)
+    stakes: List[float] = Field(default_factory=lambda: [10.0], min_length=1)
+    payouts: List[float] = Field(default_factory=lambda: [0.85], min_length=1)
+    reinvertir: List[bool] = Field(default_factory=lambda: [True], min_length=1)
+    min_trades: int = Field(1, ge=0)
+    ordenar_por: Literal["pnl_total", "roi", "efectividad", "max_drawdown"] = "pnl_total"
+    limite: int = Field(500, ge=1, le=100000)
+
+class FilaBarrido(BaseModel):
+    patron: str
+    direccion: Literal["V", "R"]
+    stake: float
+    payout: float
+    reinvertir: bool
+    trades: int
+    ganados: int
+    efectividad: Optional[float]
+    banca_fin: float
+    pnl_total: float
+    roi: float
+    max_drawdown: float
+    max_racha_perdidas: int
+    max_racha_ganadas: int
+
+class ResSimularBarrido(BaseModel):
+    combinaciones: int
+    velas: int
+    filas: List[FilaBarrido]
 
 class ReqUltimaVela(BaseModel):
     mercado: str = "btc-updown"
@@ -74,6 +151,41 @@ class ReqUltimaVela(BaseModel):
 class ResUltimaVela(BaseModel):
     fin_ts_utc: Optional[datetime]
 
+class SerieCacheVelas(BaseModel):
+    mercado: str
+    intervalo: str
+    velas: int
+    bytes: int
+    patrones_indexados: int = 0
+    desde_utc: Optional[datetime] = None
+    hasta_utc: Optional[datetime] = None
+
+class ResCacheVelas(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+    filas_anexadas: int
+    desalojos: int
+    indices_desalojados: int = 0
+    invalidaciones: int
+    bytes: int
+    max_bytes: int
+    max_series: int
+    max_indices: int = 0
+    series: List[SerieCacheVelas]
+
+class ResCacheRespuestas(BaseModel):
+    backend: Optional[str]
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+    no_modificadas: int
+    invalidaciones: int
+    guardadas: int
+    entradas: Optional[int] = None
+    bytes: Optional[int] = None
+    ttl_seg: int
+
 class ReqCompararVentanas(BaseModel):
     mercado: str = "btc-updown"
     intervalo: Intervalo
@@ -179,6 +291,61 @@ class ResCompararPatronesVs(BaseModel):
     ganador: Literal["A", "B", "empate"]
 
 
+class PatronLote(BaseModel):
+    patron: str = Field(..., min_length=1, max_length=16)
+    direccion: Optional[Literal["V", "R"]] = None
+
+
+class ReqCompararLote(BaseModel):
+    mercado: str = "btc-updown"
+    intervalo: Intervalo
+    inicio: datetime
+    fin: datetime
+    patrones: List[PatronLote] = Field(..., min_length=1, max_length=1000)
+
+
+class ResCompararLote(BaseModel):
+    mercado: str
+    intervalo: Intervalo
+    inicio: datetime
+    fin: datetime
+    filas: List[ResPatronMetricas]
+
+
+class ReqEvolucionPatron(BaseModel):
+    mercado: str = "btc-updown"
+    intervalo: Intervalo
+    inicio: datetime
+    fin: datetime
+    patron: str
+    direccion: Optional[Literal["V", "R"]] = None
+    ventana_min: int = Field(1440, ge=5, le=525600)
+    paso_min: int = Field(60, ge=1, le=525600)
+    confianza: float = Field(0.95, gt=0.5, lt=1.0)
+
+
+class PuntoEvolucion(BaseModel):
+    inicio: datetime
+    fin: datetime
+    efectividad: Optional[float]
+    muestras: int
+    verdes: int
+    rojas: int
+    ic_inf: Optional[float] = None
+    ic_sup: Optional[float] = None
+
+
+class ResEvolucionPatron(BaseModel):
+    mercado: str
+    intervalo: Intervalo
+    patron: str
+    direccion: Literal["V", "R"]
+    ventana_min: int
+    paso_min: int
+    confianza: float
+    puntos: List[PuntoEvolucion]
+
+
 class OcurrenciaPatron(BaseModel):
     fecha: str
     hora: str
@@ -2,6 +2,10 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import List, Optional, Tuple
 
+import numpy as np
+
+from .coincidencias import resultados_patron
+
 @dataclass
 class Trade:
     fin_ts_utc: object
@@ -12,66 +16,139 @@ class Trade:
     pnl: float
     banca_despues: float
 
-def simular_entrar_siempre(
+@dataclass
+class ResultadoSimulacion:
+    """Resumen + curvas por trade como arreglos paralelos (sin un objeto por trade)."""
+    banca0: float
+    banca_fin: float
+    pnl_total: float
+    roi: float
+    max_drawdown: float
+    max_racha_perdidas: int
+    max_racha_ganadas: int
+    direccion: str
+    indices: np.ndarray      # índice de la vela resultado de cada trade
+    gano: np.ndarray         # bool
+    pnl: np.ndarray          # float64
+    banca: np.ndarray        # banca después de cada trade (curva de equity)
+    drawdown: np.ndarray     # pico acumulado - banca
+
+def _max_racha(x: np.ndarray) -> int:
+    """Largo de la corrida más larga de True (run-length encoding con diff)."""
+    if not x.any():
+        return 0
+    bordes = np.diff(np.concatenate(([0], x.astype(np.int8), [0])))
+    inicios = np.flatnonzero(bordes == 1)
+    fines = np.flatnonzero(bordes == -1)
+    return int((fines - inicios).max())
+
+def simular_vectorizado(
     *,
-    fin_ts_list: List[object],
-    colores: List[str],
+    colores,
     patron: str,
     direccion: Optional[str],
     banca0: float,
     stake: float,
     payout: float,
     reinvertir: bool
-) -> Tuple[float, float, float, float, float, int, int, List[Trade]]:
-    L = len(patron)
-    banca = banca0
-    pico = banca0
-    max_dd = 0.0
-    racha_perdidas = 0
-    racha_ganadas = 0
-    max_racha_perdidas = 0
-    max_racha_ganadas = 0
-
-    trades: List[Trade] = []
+) -> ResultadoSimulacion:
+    indices, siguientes = resultados_patron(colores, patron)
+    return simular_desde_resultados(
+        indices=indices,
+        siguientes=siguientes,
+        direccion=direccion,
+        banca0=banca0,
+        stake=stake,
+        payout=payout,
+        reinvertir=reinvertir,
+    )
 
-    for i in range(L, len(colores)):
-        if "".join(colores[i - L:i]) != patron:
-            continue
+def simular_desde_resultados(
+    *,
+    indices: np.ndarray,
+    siguientes: np.ndarray,
+    direccion: Optional[str],
+    banca0: float,
+    stake: float,
+    payout: float,
+    reinvertir: bool
+) -> ResultadoSimulacion:
+    """Igual que simular_vectorizado pero con las apariciones ya calculadas
+    (para reutilizarlas en varias combinaciones de stake/payout).
 
-        real = colores[i]
-        dir_use = direccion or "V"
-        gano = (real == dir_use)
+    reinvertir: cada trade apuesta la misma fracción stake/banca0 de la banca de ese momento
+    (interés compuesto; la banca no baja de 0). Sin reinvertir el stake es fijo.
+    """
+    dir_use = direccion or "V"
+    gano = siguientes == (1 if dir_use == "V" else 0)
 
-        stake_use = stake if reinvertir else stake
+    if reinvertir and banca0 > 0:
+        # banca_i = banca_{i-1} * (1 + f * r_i) con r_i = payout o -1: producto acumulado secuencial
+        f = stake / banca0
+        factores = np.maximum(np.where(gano, 1.0 + f * payout, 1.0 - f), 0.0)
+        banca = float(banca0) * np.cumprod(factores)
+        pnl = np.diff(np.concatenate(([float(banca0)], banca)))
+    else:
+        pnl = np.where(gano, stake * payout, -stake).astype(np.float64)
+        # cumsum secuencial desde banca0: mismos redondeos que sumar trade por trade
+        banca = np.cumsum(np.concatenate(([float(banca0)], pnl)))[1:]
+    pico = np.maximum.accumulate(np.maximum(banca, banca0)) if len(banca) else banca
+    drawdown = pico - banca
 
-        if gano:
-            pnl = stake_use * payout
-            banca += pnl
-            racha_ganadas += 1
-            racha_perdidas = 0
-        else:
-            pnl = -stake_use
-            banca += pnl
-            racha_perdidas += 1
-            racha_ganadas = 0
+    banca_fin = float(banca[-1]) if len(banca) else float(banca0)
+    pnl_total = banca_fin - banca0
+    roi = pnl_total / banca0 if banca0 != 0 else 0.0
 
-        pico = max(pico, banca)
-        dd = pico - banca
-        max_dd = max(max_dd, dd)
+    return ResultadoSimulacion(
+        banca0=banca0,
+        banca_fin=banca_fin,
+        pnl_total=pnl_total,
+        roi=roi,
+        max_drawdown=max(0.0, float(drawdown.max())) if len(drawdown) else 0.0,
+        max_racha_perdidas=_max_racha(~gano),
+        max_racha_ganadas=_max_racha(gano),
+        direccion=dir_use,
+        indices=indices,
+        gano=gano,
+        pnl=pnl,
+        banca=banca,
+        drawdown=drawdown,
+    )
 
-        max_racha_perdidas = max(max_racha_perdidas, racha_perdidas)
-        max_racha_ganadas = max(max_racha_ganadas, racha_ganadas)
+def simular_entrar_siempre(
+    *,
+    fin_ts_list: List[object],
+    colores: List[str],
+    patron: str,
+    direccion: Optional[str],
+    banca0: float,
+    stake: float,
+    payout: float,
+    reinvertir: bool
+) -> Tuple[float, float, float, float, float, int, int, List[Trade]]:
+    res = simular_vectorizado(
+        colores=colores,
+        patron=patron,
+        direccion=direccion,
+        banca0=banca0,
+        stake=stake,
+        payout=payout,
+        reinvertir=reinvertir,
+    )
 
+    trades: List[Trade] = []
+    for i, gano, pnl, banca in zip(res.indices.tolist(), res.gano.tolist(), res.pnl.tolist(), res.banca.tolist()):
         trades.append(Trade(
             fin_ts_utc=fin_ts_list[i],
             patron=patron,
-            direccion=dir_use,
-            real=real,
+            direccion=res.direccion,
+            real=colores[i],
             gano=gano,
             pnl=pnl,
             banca_despues=banca
         ))
 
-    pnl_total = banca - banca0
-    roi = pnl_total / banca0 if banca0 != 0 else 0.0
-    return banca0, banca, pnl_total, roi, max_dd, max_racha_perdidas, max_racha_ganadas, trades
+    return (
+        res.banca0, res.banca_fin, res.pnl_total, res.roi, res.max_drawdown,
+        res.max_racha_perdidas, res.max_racha_ganadas, trades,
+    )
@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 def iso_a_utc_naive(dt: datetime) -> datetime:
     """Convierte datetime con tz a UTC sin tzinfo (naive).
@@ -7,3 +7,13 @@ def iso_a_utc_naive(dt: datetime) -> datetime:
     if dt.tzinfo is None:
         return dt
     return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+_EPOCH = datetime(1970, 1, 1)
+
+def seg_a_utc_naive(seg: int) -> datetime:
+    """Epoch en segundos -> datetime UTC sin tzinfo (naive)."""
+    return _EPOCH + timedelta(seconds=int(seg))
+
+def utc_naive_a_seg(dt: datetime) -> int:
+    """datetime (naive = UTC, o con tz) -> epoch en segundos (piso)."""
+    return (iso_a_utc_naive(dt) - _EPOCH) // timedelta(seconds=1)
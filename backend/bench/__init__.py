@@ -0,0 +1,8 @@
+"""Benchmarks de PolyPatron: motores de patrones y endpoints de la API.
+
+Uso (desde backend/):
+    python -m bench motores --tamanos 1000,100000,1000000 --salida motores.json
+    python -m bench api --tamanos 100000 --salida api.json          # SQLite temporal
+    python -m bench api --db postgresql+psycopg://...               # Postgres local
+    python -m bench comparar base.json nuevo.json --umbral 0.15
+"""
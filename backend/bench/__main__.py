@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+
+def _tamanos(texto: str) -> List[int]:
+    return [int(x.replace("_", "")) for x in texto.split(",") if x.strip()]
+
+
+def _configurar_entorno(args) -> None:
+    """Todo antes de importar app (los ajustes se leen al importar). Nunca toma DATABASE_URL del
+    entorno: los benchmarks borran y siembran datos, la base se elige con --db."""
+    db = getattr(args, "db", "") or ""
+    if not db:
+        ruta = os.path.join(tempfile.mkdtemp(prefix="polypatron-bench-"), "bench.db")
+        db = f"sqlite:///{ruta}"
+    os.environ["DATABASE_URL"] = db
+    if db.startswith("sqlite"):
+        # la ruta async de la API necesita aiosqlite para el stand-in SQLite
+        os.environ["DATABASE_URL_ASYNC"] = db.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    else:
+        os.environ.pop("DATABASE_URL_ASYNC", None)
+    os.environ["CACHE_RESPUESTAS"] = "memoria" if getattr(args, "cache_respuestas", False) else ""
+    os.environ["INGESTA_EN_API"] = "false"
+    os.environ["INGESTA_MERCADOS"] = ""
+    os.environ["GAMMA_TASA_RPS"] = "0"
+    os.environ["GAMMA_HTTP2"] = "false"
+
+
+def _cmd_comparar(args) -> int:
+    from .medicion import comparar
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding="utf-8") as f:
+        nuevo = json.load(f)
+    filas, regresion = comparar(base, nuevo, args.umbral)
+    for r in filas:
+        marca = "  REGRESION" if r["regresion"] else ""
+        print(
+            f"{r['grupo']:8s} {r['nombre']:36s} n={r['n']:>8d} "
+            f"{r['base_seg'] * 1000:10.2f} -> {r['nuevo_seg'] * 1000:10.2f} ms {r['cambio']:+7.1%}{marca}"
+        )
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"umbral": args.umbral, "filas": filas}, f, indent=2)
+    return 1 if regresion else 0
+
+
+def _cmd_correr(args) -> int:
+    _configurar_entorno(args)
+    from .medicion import entorno, guardar
+
+    resultados = []
+    if args.comando in ("motores", "todo"):
+        from . import motores
+
+        resultados += motores.correr(args.tamanos, repeticiones=args.repeticiones, semilla=args.semilla, filtro=args.filtro)
+
+    meta = {"comando": args.comando, "semilla": args.semilla, "repeticiones": args.repeticiones}
+    if args.comando in ("api", "todo"):
+        from . import api
+        from .gamma_stub import GammaStub
+
+        ahora_seg = int(time.time())
+        stub = GammaStub(
+            api.markets_ingesta(args.ingesta_velas, args.semilla, ahora_seg) if args.ingesta_velas else [],
+            latencia_seg=args.latencia_gamma_ms / 1000,
+        ).iniciar()
+        os.environ["GAMMA_BASE"] = stub.url
+        try:
+            resultados += asyncio.run(api.correr(
+                args.tamanos,
+                repeticiones=args.repeticiones,
+                semilla=args.semilla,
+                concurrencia=args.concurrencia,
+                ingesta_velas=args.ingesta_velas,
+                stub=stub,
+                ahora_seg=ahora_seg,
+            ))
+        finally:
+            stub.detener()
+        meta.update({
+            "db": os.environ["DATABASE_URL"].split("://", 1)[0],
+            "cache_respuestas": bool(args.cache_respuestas),
+            "concurrencia": args.concurrencia,
+        })
+
+    guardar(args.salida, resultados, entorno(**meta))
+    return 0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m bench", description="Benchmarks de motores y API de PolyPatron.")
+    sub = p.add_subparsers(dest="comando", required=True)
+
+    for nombre, ayuda in (
+        ("motores", "micro-benchmarks de los motores en proceso"),
+        ("api", "end-to-end contra la API (SQLite temporal o --db) + ingesta en frío con Gamma stub"),
+        ("todo", "motores + api"),
+    ):
+        s = sub.add_parser(nombre, help=ayuda)
+        s.add_argument("--tamanos", type=_tamanos, default=_tamanos("1000,100000" if nombre != "motores" else "1000,100000,1000000"),
+                       help="velas por serie, separadas por coma (1000 .. 1000000)")
+        s.add_argument("--repeticiones", type=int, default=5)
+        s.add_argument("--semilla", type=int, default=7)
+        s.add_argument("--salida", default="", help="archivo JSON de resultados (default: stdout)")
+        s.add_argument("--filtro", default="", help="solo los motores cuyo nombre contenga esto")
+        if nombre != "motores":
+            s.add_argument("--db", default="", help="URL SQLAlchemy (default: SQLite temporal; los datos del benchmark se borran)")
+            s.add_argument("--concurrencia", type=int, default=16)
+            s.add_argument("--ingesta-velas", type=int, default=10000, help="mercados en el Gamma stub (0 = sin escenario de ingesta)")
+            s.add_argument("--latencia-gamma-ms", type=float, default=20.0)
+            s.add_argument("--cache-respuestas", action="store_true", help="medir con el cache de respuestas activo")
+        s.set_defaults(fn=_cmd_correr)
+
+    s = sub.add_parser("comparar", help="compara dos archivos de resultados (código 1 si hay regresión)")
+    s.add_argument("base")
+    s.add_argument("nuevo")
+    s.add_argument("--umbral", type=float, default=0.15, help="empeoramiento relativo de la mediana tolerado")
+    s.add_argument("--salida", default="")
+    s.set_defaults(fn=_cmd_comparar)
+
+    args = p.parse_args(argv)
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
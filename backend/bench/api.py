@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .medicion import Resultado, medir, medir_async
+from .sinteticos import filas_velas, iso_z, markets_gamma, serie_sintetica
+
+MERCADO = "bench-updown"
+MERCADO_INGESTA = "bench-ingesta"
+INTERVALO = "5m"
+PASO_SEG = 300
+LOTE_PATRONES = ["VV", "RR", "VR", "RV", "VVR", "RRV", "VRVR", "VVRRV"]
+
+
+def inicio_para(n: int, ahora_seg: int) -> int:
+    """Primer ts para que n velas terminen un día antes de ahora (cerradas y fuera de la cola abierta)."""
+    return (ahora_seg // PASO_SEG) * PASO_SEG - 86400 - (n + 1) * PASO_SEG
+
+
+def _seg_a_fecha(seg: int) -> datetime:
+    return datetime.fromtimestamp(seg, tz=timezone.utc).replace(tzinfo=None)
+
+
+def limpiar_par(mercado: str) -> None:
+    from app.cache_respuestas import cache_respuestas
+    from app.cache_velas import cache_velas
+    from app.db import engine
+    from app.models import CoberturaVelas, DiaPatrones, EstadisticaPatronDia, Vela
+
+    with engine.begin() as conn:
+        for modelo in (Vela, CoberturaVelas, EstadisticaPatronDia, DiaPatrones):
+            conn.execute(modelo.__table__.delete().where(modelo.__table__.c.mercado == mercado))
+    cache_velas.invalidar(mercado, INTERVALO)
+    cache_respuestas.invalidar(mercado, INTERVALO)
+
+
+def sembrar(ts: np.ndarray, colores: np.ndarray) -> float:
+    """Carga la serie sintética en velas y la marca como cubierta. Regresa segundos."""
+    from app.cobertura import registrar
+    from app.db import SesionLocal, engine
+    from app.models import Vela
+    from app.particiones import asegurar_meses, mes_de, meses_entre
+
+    t = time.perf_counter()
+    limpiar_par(MERCADO)
+    with engine.begin() as conn:
+        asegurar_meses(conn, meses_entre(mes_de(_seg_a_fecha(int(ts[0]))), mes_de(_seg_a_fecha(int(ts[-1])))))
+        for filas in filas_velas(MERCADO, INTERVALO, ts, colores):
+            conn.execute(Vela.__table__.insert(), filas)
+    db = SesionLocal()
+    try:
+        registrar(db, MERCADO, INTERVALO, _seg_a_fecha(int(ts[0])), _seg_a_fecha(int(ts[-1])))
+    finally:
+        db.close()
+    return time.perf_counter() - t
+
+
+def cuerpos(ts: np.ndarray) -> Dict[str, Tuple[str, str, Dict[str, Any]]]:
+    """Escenarios HTTP: nombre -> (método, ruta, cuerpo o query)."""
+    ini, fin = iso_z(int(ts[0])), iso_z(int(ts[-1]))
+    rango_min = (int(ts[-1]) - int(ts[0])) // 60
+    base = {"mercado": MERCADO, "intervalo": INTERVALO}
+    return {
+        "POST /patrones/rankear": ("POST", "/patrones/rankear", {
+            **base, "inicio": ini, "fin": fin, "longitud_min": 2, "longitud_max": 12,
+            "min_muestras": 30, "limite": 100,
+        }),
+        "POST /comparar/rango": ("POST", "/comparar/rango", {
+            **base, "inicio": ini, "fin": fin, "patron": "VVRV",
+        }),
+        "POST /comparar/lote": ("POST", "/comparar/lote", {
+            **base, "inicio": ini, "fin": fin, "patrones": [{"patron": p} for p in LOTE_PATRONES],
+        }),
+        "POST /comparar/ventanas": ("POST", "/comparar/ventanas", {
+            **base, "fin": fin, "patron": "VVR", "direccion": "V", "ventanas_dias": [3, 7, 15, 30, 90],
+        }),
+        "POST /comparar/evolucion": ("POST", "/comparar/evolucion", {
+            **base, "inicio": ini, "fin": fin, "patron": "VVR", "ventana_min": 1440,
+            "paso_min": max(60, rango_min // 5000),
+        }),
+        "POST /simular": ("POST", "/simular", {
+            **base, "inicio": ini, "fin": fin, "patron": "VVR", "formato_trades": "columnas",
+        }),
+        "GET /patrones/historial": ("GET", "/patrones/historial", {
+            **base, "inicio": ini, "fin": fin, "patron": "VVRV", "direccion": "V",
+        }),
+    }
+
+
+def correr_comparar(ts: np.ndarray, *, repeticiones: int) -> List[Resultado]:
+    """Funciones de comparar.py llamadas directo con una Session (cache de velas caliente)."""
+    from app.cache_velas import cache_velas
+    from app.comparar import comparar_lote, comparar_rango, comparar_ventanas, evolucion_patron
+    from app.db import SesionLocal
+
+    n = len(ts)
+    ini, fin = _seg_a_fecha(int(ts[0])), _seg_a_fecha(int(ts[-1]))
+    paso = max(3600, (int(ts[-1]) - int(ts[0])) // 5000)
+    db = SesionLocal()
+    try:
+        casos = {
+            "carga_serie_fria": lambda: (cache_velas.invalidar(MERCADO, INTERVALO), cache_velas.obtener(db, MERCADO, INTERVALO)),
+            "comparar_rango": lambda: comparar_rango(db, MERCADO, INTERVALO, ini, fin, "VVRV", None),
+            "comparar_lote": lambda: comparar_lote(db, MERCADO, INTERVALO, ini, fin, [(p, None) for p in LOTE_PATRONES]),
+            "comparar_ventanas": lambda: comparar_ventanas(db, MERCADO, INTERVALO, fin, "VVR", None, [3, 7, 15, 30, 90]),
+            "evolucion_patron": lambda: evolucion_patron(db, MERCADO, INTERVALO, "VVR", None, ini, fin, 86400, paso, 0.95),
+        }
+        out = []
+        for nombre, fn in casos.items():
+            tiempos = medir(fn, repeticiones=repeticiones)
+            out.append(Resultado("comparar", nombre, n, tiempos))
+            print(f"comparar {nombre:31s} n={n:>8d} {min(tiempos) * 1000:10.2f} ms", flush=True)
+        return out
+    finally:
+        db.close()
+
+
+async def correr_http(cliente, ts: np.ndarray, *, repeticiones: int, concurrencia: int) -> List[Resultado]:
+    n = len(ts)
+    out = []
+    for nombre, (metodo, ruta, cuerpo) in cuerpos(ts).items():
+        async def llamar():
+            if metodo == "GET":
+                r = await cliente.get(ruta, params=cuerpo)
+            else:
+                r = await cliente.post(ruta, json=cuerpo)
+            if r.status_code != 200:
+                raise RuntimeError(f"{nombre}: {r.status_code} {r.text[:300]}")
+            return r
+
+        t = time.perf_counter()
+        r = await llamar()
+        frio = time.perf_counter() - t
+        tiempos = await medir_async(llamar, repeticiones=repeticiones, calentamiento=0)
+        out.append(Resultado("api", nombre, n, tiempos, {"primera_seg": frio, "bytes_respuesta": len(r.content)}))
+        print(f"api      {nombre:31s} n={n:>8d} {min(tiempos) * 1000:10.2f} ms (primera {frio * 1000:.1f} ms)", flush=True)
+
+    # varias consultas a la vez contra un solo proceso
+    metodo, ruta, cuerpo = cuerpos(ts)["POST /comparar/rango"]
+    async def rafaga():
+        rs = await asyncio.gather(*[cliente.post(ruta, json=cuerpo) for _ in range(concurrencia)])
+        if any(r.status_code != 200 for r in rs):
+            raise RuntimeError("rafaga: respuesta no 200")
+    tiempos = await medir_async(rafaga, repeticiones=repeticiones)
+    out.append(Resultado("api", f"rafaga x{concurrencia} /comparar/rango", n, tiempos,
+                         {"consultas_por_seg": concurrencia / min(tiempos)}))
+    print(f"api      rafaga x{concurrencia:<24d} n={n:>8d} {min(tiempos) * 1000:10.2f} ms", flush=True)
+    return out
+
+
+async def correr_ingesta(cliente, ts: np.ndarray, stub, *, repeticiones: int) -> List[Resultado]:
+    """Ingesta en frío: el par no tiene velas ni cobertura y la primera consulta hace el backfill
+    completo desde el stub de Gamma."""
+    n = len(ts)
+    cuerpo = {
+        "mercado": MERCADO_INGESTA, "intervalo": INTERVALO,
+        "inicio": iso_z(int(ts[0])), "fin": iso_z(int(ts[-1])), "patron": "VVR",
+    }
+    tiempos, paginas = [], []
+    for _ in range(repeticiones):
+        limpiar_par(MERCADO_INGESTA)
+        p0 = stub.paginas
+        t = time.perf_counter()
+        r = await cliente.post("/comparar/rango", json=cuerpo)
+        tiempos.append(time.perf_counter() - t)
+        paginas.append(stub.paginas - p0)
+        if r.status_code != 200:
+            raise RuntimeError(f"ingesta: {r.status_code} {r.text[:300]}")
+    res = Resultado("ingesta", "backfill_frio /comparar/rango", n, tiempos, {
+        "velas_por_seg": n / min(tiempos),
+        "paginas_gamma": max(paginas),
+        "latencia_stub_seg": stub.latencia_seg,
+    })
+    print(f"ingesta  backfill_frio{'':18s} n={n:>8d} {min(tiempos) * 1000:10.2f} ms ({n / min(tiempos):.0f} velas/s)", flush=True)
+    return [res]
+
+
+def markets_ingesta(n: int, semilla: int, ahora_seg: int) -> List[Dict]:
+    ts, colores = serie_sintetica(n, semilla=semilla + 1, inicio_seg=inicio_para(n, ahora_seg), paso_seg=PASO_SEG)
+    return markets_gamma(f"{MERCADO_INGESTA}-{INTERVALO}-", ts, colores)
+
+
+async def correr(
+    tamanos: List[int],
+    *,
+    repeticiones: int,
+    semilla: int,
+    concurrencia: int,
+    ingesta_velas: int,
+    stub,
+    ahora_seg: int,
+) -> List[Resultado]:
+    import httpx
+
+    from app.barrido import cerrar_pool
+    from app.db import cerrar_engine_async
+    from app.hilos import cerrar_hilos
+    from app.ingest_gamma import cliente_gamma
+    from app.main import app
+
+    resultados: List[Resultado] = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as cliente:
+            for n in tamanos:
+                ts, colores = serie_sintetica(
+                    n, semilla=semilla, prob_repetir=0.55, inicio_seg=inicio_para(n, ahora_seg), paso_seg=PASO_SEG
+                )
+                seg = await asyncio.to_thread(sembrar, ts, colores)
+                print(f"sembrar  {MERCADO} n={n} en {seg:.1f} s", flush=True)
+                resultados += await asyncio.to_thread(correr_comparar, ts, repeticiones=repeticiones)
+                resultados += await correr_http(cliente, ts, repeticiones=repeticiones, concurrencia=concurrencia)
+            if ingesta_velas:
+                ts_ing = np.array([int(m["id"]) for m in reversed(stub.markets)], dtype=np.int64)
+                resultados += await correr_ingesta(cliente, ts_ing, stub, repeticiones=max(1, min(repeticiones, 3)))
+    finally:
+        cerrar_pool()
+        cerrar_hilos()
+        await cliente_gamma.cerrar()
+        await cerrar_engine_async()
+    return resultados
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+def _fecha(valor: Optional[str]) -> Optional[datetime]:
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor.replace("Z", "+00:00"))
+
+
+class GammaStub:
+    """Servidor HTTP local que responde /markets como Gamma (limit/offset, end_date_min/max
+    y order=id|endDate con ascending).
+
+    latencia_seg simula la ida y vuelta por página; paginas cuenta las respuestas servidas.
+    """
+
+    def __init__(self, markets: List[Dict], *, latencia_seg: float = 0.0, puerto: int = 0):
+        self.markets = markets
+        self.latencia_seg = latencia_seg
+        self.paginas = 0
+        self._fin = [_fecha(m["endDate"]) for m in markets]
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                if url.path != "/markets":
+                    self.send_error(404)
+                    return
+                cuerpo = json.dumps(stub.pagina(parse_qs(url.query))).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+                except (BrokenPipeError, ConnectionResetError):
+                    # páginas en vuelo que la ingesta cancela al ver la última página incompleta
+                    pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", puerto), _Handler)
+        self._server.daemon_threads = True
+        self._hilo: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, puerto = self._server.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def pagina(self, q: Dict[str, List[str]]) -> List[Dict]:
+        limit = int(q.get("limit", ["500"])[0])
+        offset = int(q.get("offset", ["0"])[0])
+        desde = _fecha(q.get("end_date_min", [None])[0])
+        hasta = _fecha(q.get("end_date_max", [None])[0])
+        if self.latencia_seg:
+            time.sleep(self.latencia_seg)
+        self.paginas += 1
+        filtrados = [
+            (m, f) for m, f in zip(self.markets, self._fin)
+            if (desde is None or f >= desde) and (hasta is None or f <= hasta)
+        ]
+        orden = q.get("order", ["id"])[0]
+        ascendente = q.get("ascending", ["false"])[0] == "true"
+        if orden == "endDate":
+            filtrados.sort(key=lambda x: x[1], reverse=not ascendente)
+        elif orden == "id":
+            filtrados.sort(key=lambda x: int(x[0]["id"]), reverse=not ascendente)
+        return [m for m, _ in filtrados[offset:offset + limit]]
+
+    def iniciar(self) -> "GammaStub":
+        self._hilo = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class Resultado:
+    grupo: str                 # "motores", "api", "ingesta"
+    nombre: str
+    n: int                     # velas de la serie
+    tiempos_seg: List[float]
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def resumen(self) -> Dict[str, Any]:
+        t = sorted(self.tiempos_seg)
+        return {
+            "grupo": self.grupo,
+            "nombre": self.nombre,
+            "n": self.n,
+            "repeticiones": len(t),
+            "min_seg": t[0],
+            "mediana_seg": statistics.median(t),
+            "media_seg": statistics.fmean(t),
+            "p95_seg": t[min(len(t) - 1, int(round(0.95 * (len(t) - 1))))],
+            "max_seg": t[-1],
+            **self.extra,
+        }
+
+
+def medir(fn: Callable[[], Any], *, repeticiones: int, calentamiento: int = 1) -> List[float]:
+    for _ in range(calentamiento):
+        fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t)
+    return tiempos
+
+
+async def medir_async(
+    fn: Callable[[], Awaitable[Any]], *, repeticiones: int, calentamiento: int = 1
+) -> List[float]:
+    for _ in range(calentamiento):
+        await fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        await fn()
+        tiempos.append(time.perf_counter() - t)
+    return tiempos
+
+
+def entorno(**extra: Any) -> Dict[str, Any]:
+    from app.main import app
+
+    return {
+        "app_version": app.version,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "plataforma": platform.platform(),
+        "procesador": platform.processor() or platform.machine(),
+        "fecha_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **extra,
+    }
+
+
+def guardar(ruta: Optional[str], resultados: List[Resultado], meta: Dict[str, Any]) -> Dict[str, Any]:
+    doc = {"meta": meta, "resultados": [r.resumen() for r in resultados]}
+    texto = json.dumps(doc, indent=2, ensure_ascii=False)
+    if ruta:
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    return doc
+
+
+def _por_clave(doc: Dict[str, Any]) -> Dict[Tuple[str, str, int], Dict[str, Any]]:
+    return {(r["grupo"], r["nombre"], r["n"]): r for r in doc["resultados"]}
+
+
+def comparar(base: Dict[str, Any], nuevo: Dict[str, Any], umbral: float) -> Tuple[List[Dict[str, Any]], bool]:
+    """Filas (grupo, nombre, n, base, nuevo, cambio) por mediana; True si algo empeoró más que umbral."""
+    a, b = _por_clave(base), _por_clave(nuevo)
+    filas = []
+    regresion = False
+    for clave in sorted(a.keys() & b.keys()):
+        t0, t1 = a[clave]["mediana_seg"], b[clave]["mediana_seg"]
+        cambio = (t1 - t0) / t0 if t0 > 0 else 0.0
+        peor = cambio > umbral
+        regresion |= peor
+        filas.append({
+            "grupo": clave[0],
+            "nombre": clave[1],
+            "n": clave[2],
+            "base_seg": t0,
+            "nuevo_seg": t1,
+            "cambio": cambio,
+            "regresion": peor,
+        })
+    return filas, regresion
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+from .medicion import Resultado, medir
+from .sinteticos import serie_sintetica
+
+# rejilla chica de /simular/barrido: 8 patrones x 2 direcciones x 2 stakes x 2 payouts x 2 reinvertir
+PATRONES_BARRIDO = ["VV", "RR", "VR", "RV", "VVR", "RRV", "VRVR", "VVRRV"]
+
+
+def casos(n: int, semilla: int) -> Dict[str, Callable[[], object]]:
+    from app.barrido import evaluar_patrones
+    from app.coincidencias import IndiceOcurrencias, resultados_patron
+    from app.patrones import contar_todas_longitudes, rankear_patrones_con_tiempos, ranking_con_tiempos
+    from app.simular import simular_entrar_siempre, simular_vectorizado
+    from app.utils_time import seg_a_utc_naive
+
+    ts, colores = serie_sintetica(n, semilla=semilla, prob_repetir=0.55)
+    bits = colores.tolist()
+    letras = ["V" if b else "R" for b in bits]
+    fechas = [seg_a_utc_naive(s) for s in ts.tolist()]
+    ahora = datetime.fromtimestamp(int(ts[-1]) + 3600, tz=timezone.utc)
+
+    return {
+        "contar_todas_longitudes": lambda: contar_todas_longitudes(bits, 2, 12),
+        "rankear_patrones_con_tiempos": lambda: rankear_patrones_con_tiempos(
+            colores=colores, fin_ts_list=ts, longitud_min=2, longitud_max=12, min_muestras=30, now_utc=ahora
+        ),
+        "ranking_con_tiempos_top100": lambda: ranking_con_tiempos(
+            colores=colores, fin_ts_list=ts, longitud_min=2, longitud_max=12, min_muestras=30, now_utc=ahora,
+            limite=100,
+        ).dicts(),
+        "resultados_patron": lambda: resultados_patron(colores, "VVRV"),
+        "indice_ocurrencias": lambda: IndiceOcurrencias.construir(colores, "VVRV"),
+        "simular_vectorizado": lambda: simular_vectorizado(
+            colores=colores, patron="VVR", direccion=None, banca0=1000.0, stake=10.0, payout=0.95, reinvertir=False
+        ),
+        "simular_entrar_siempre": lambda: simular_entrar_siempre(
+            fin_ts_list=fechas, colores=letras, patron="VVR", direccion=None,
+            banca0=1000.0, stake=10.0, payout=0.95, reinvertir=False,
+        ),
+        "barrido_evaluar_patrones": lambda: evaluar_patrones(
+            colores, PATRONES_BARRIDO, ["V", "R"], 1000.0, [5.0, 10.0], [0.9, 0.95], [False, True]
+        ),
+    }
+
+
+def correr(tamanos: List[int], *, repeticiones: int, semilla: int, filtro: str = "") -> List[Resultado]:
+    """Micro-benchmarks de los motores en proceso (sin DB ni HTTP)."""
+    resultados: List[Resultado] = []
+    for n in tamanos:
+        for nombre, fn in casos(n, semilla).items():
+            if filtro and filtro not in nombre:
+                continue
+            tiempos = medir(fn, repeticiones=repeticiones)
+            resultados.append(Resultado("motores", nombre, n, tiempos, {"velas_por_seg": n / min(tiempos)}))
+            print(f"motores {nombre:32s} n={n:>8d} {min(tiempos) * 1000:10.2f} ms", flush=True)
+    return resultados
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+# 2025-01-01T00:00:00Z: las series sintéticas empiezan aquí
+INICIO_SEG = 1735689600
+
+
+def serie_sintetica(
+    n: int,
+    *,
+    semilla: int = 0,
+    prob_repetir: float = 0.5,
+    paso_seg: int = 300,
+    inicio_seg: int = INICIO_SEG,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(ts epoch seg int64, colores uint8 V=1/R=0) de n velas consecutivas.
+
+    prob_repetir: probabilidad de que una vela repita el color de la anterior
+    (0.5 = ruido blanco; > 0.5 da rachas y patrones con ventaja medible).
+    """
+    rng = np.random.default_rng(semilla)
+    cambia = rng.random(n) >= prob_repetir
+    colores = ((np.cumsum(cambia) + rng.integers(2)) % 2).astype(np.uint8)
+    ts = inicio_seg + paso_seg * np.arange(1, n + 1, dtype=np.int64)
+    return ts, colores
+
+
+def iso_z(seg: int) -> str:
+    return datetime.fromtimestamp(seg, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def filas_velas(
+    mercado: str, intervalo: str, ts: np.ndarray, colores: np.ndarray, *, lote: int = 10000
+) -> Iterator[List[Dict]]:
+    """Lotes de filas para la tabla velas (mismas columnas que escribe la ingesta)."""
+    prefix = f"{mercado}-{intervalo}-"
+    insertado = datetime(2025, 1, 1)
+    for i in range(0, len(ts), lote):
+        filas = []
+        for s, c in zip(ts[i:i + lote].tolist(), colores[i:i + lote].tolist()):
+            filas.append({
+                "mercado": mercado,
+                "intervalo": intervalo,
+                "slug": f"{prefix}{s}",
+                "market_id": str(s),
+                "fin_ts_utc": datetime.fromtimestamp(s, tz=timezone.utc).replace(tzinfo=None),
+                "color": "V" if c else "R",
+                "precio_cierre_up": 1.0 if c else 0.0,
+                "precio_cierre_down": 0.0 if c else 1.0,
+                "fuente": "sintetica",
+                "insertado_en": insertado,
+            })
+        yield filas
+
+
+def markets_gamma(prefix: str, ts: np.ndarray, colores: np.ndarray) -> List[Dict]:
+    """Mercados cerrados con la forma de Gamma /markets (id descendente, como los pide la ingesta)."""
+    out = []
+    for s, c in zip(ts.tolist(), colores.tolist()):
+        out.append({
+            "id": str(s),
+            "slug": f"{prefix}{s}",
+            "endDate": iso_z(s),
+            "closed": True,
+            "outcomes": '["Up", "Down"]',
+            "outcomePrices": '["1", "0"]' if c else '["0", "1"]',
+        })
+    out.reverse()
+    return out
@@ -0,0 +1,74 @@
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+# la app lee DATABASE_URL al importarse: un sqlite temporal por sesión de pytest
+_DB = os.path.join(tempfile.mkdtemp(prefix="polypatron-tests-"), "tests.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB}"
+os.environ["DATABASE_URL_ASYNC"] = f"sqlite+aiosqlite:///{_DB}"
+os.environ["CACHE_RESPUESTAS"] = "memoria"
+os.environ["INGESTA_EN_API"] = "false"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+T0 = datetime(2026, 1, 1)
+PASO = timedelta(minutes=5)
+N = 300
+
+
+def sembrar(mercado: str, intervalo: str = "5m", n: int = N, *, semilla: int = 1, omitir=()) -> list:
+    """n velas V/R aleatorias cada 5m desde T0 (sin las posiciones en omitir); regresa los colores."""
+    from app.db import SesionLocal
+    from app.models import Vela
+
+    rnd = random.Random(semilla)
+    colores = [rnd.choice("VR") for _ in range(n)]
+    db = SesionLocal()
+    for i, color in enumerate(colores):
+        if i not in omitir:
+            db.add(vela(mercado, intervalo, i, color))
+    db.commit()
+    db.close()
+    return colores
+
+
+def vela(mercado: str, intervalo: str, i: int, color: str):
+    from app.models import Vela
+
+    return Vela(
+        mercado=mercado, intervalo=intervalo, slug=f"{mercado}-{intervalo}-{i}", market_id=f"{mercado}-{i}",
+        fin_ts_utc=T0 + PASO * i, color=color, fuente="gamma", insertado_en=T0,
+    )
+
+
+async def _sin_paginas(**kw):
+    return
+    yield
+
+
+@pytest.fixture(autouse=True)
+def sin_gamma(monkeypatch):
+    # sin red: los rangos de los tests ya están en la DB
+    import app.ingesta as ingesta
+
+    monkeypatch.setattr(ingesta, "paginas_markets", _sin_paginas)
+
+
+@pytest.fixture(scope="session")
+def colores():
+    import app.main  # noqa: F401  (crea las tablas al importarse)
+    return sembrar("btc-updown")
+
+
+@pytest.fixture(scope="session")
+def cliente(colores):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    return TestClient(app)
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from conftest import N, PASO, T0, sembrar, vela
+
+from app.cache_respuestas import cache_respuestas
+from app.db import SesionLocal
+
+CUERPO = {"intervalo": "5m", "inicio": "2026-01-01T00:00:00Z", "min_muestras": 1}
+
+
+def _fin(dt) -> str:
+    return dt.isoformat() + "Z"
+
+
+def test_rankear_recorta_fin_a_la_ultima_vela(cliente):
+    ultima = T0 + PASO * (N - 1)
+    r1 = cliente.post("/patrones/rankear", json={**CUERPO, "fin": _fin(ultima + timedelta(minutes=7))})
+    r2 = cliente.post("/patrones/rankear", json={**CUERPO, "fin": _fin(ultima + timedelta(hours=3))})
+
+    assert r1.status_code == r2.status_code == 200
+    assert r1.headers["x-cache"] == "MISS"
+    assert r2.headers["x-cache"] == "HIT"
+    assert r1.json()["total"] == r2.json()["total"]
+
+
+def test_insercion_de_otro_proceso_cambia_la_clave(cliente):
+    # un worker aparte inserta una vela tardía antes de la cola: este proceso no recibe aviso
+    colores = sembrar("otro-proceso", omitir={N - 3})
+    cuerpo = {**CUERPO, "mercado": "otro-proceso", "fin": _fin(T0 + PASO * N)}
+    r1 = cliente.post("/patrones/rankear", json=cuerpo)
+    assert cliente.post("/patrones/rankear", json=cuerpo).headers["x-cache"] == "HIT"
+
+    db = SesionLocal()
+    db.add(vela("otro-proceso", "5m", N - 3, colores[N - 3]))
+    db.commit()
+    db.close()
+
+    r2 = cliente.post("/patrones/rankear", json=cuerpo)
+    assert r2.headers["x-cache"] == "MISS"
+    assert r2.headers["etag"] != r1.headers["etag"]
+    assert sum(f["muestras"] for f in r2.json()["filas"]) > sum(f["muestras"] for f in r1.json()["filas"])
+
+
+def test_304_lleva_el_mismo_vary_que_el_200(cliente):
+    cuerpo = {**CUERPO, "fin": _fin(T0 + PASO * N)}
+    r1 = cliente.post("/patrones/rankear", json=cuerpo)
+    r2 = cliente.post("/patrones/rankear", json=cuerpo, headers={"If-None-Match": r1.headers["etag"]})
+
+    assert r2.status_code == 304
+    assert r2.headers["etag"] == r1.headers["etag"]
+    assert "Accept-Encoding" in r1.headers["vary"]
+    assert r2.headers["vary"] == r1.headers["vary"]
+
+
+def test_etag_304_e_invalidacion(cliente):
+    sembrar("invalidacion")
+    cuerpo = {**CUERPO, "mercado": "invalidacion", "fin": _fin(T0 + PASO * N)}
+    r1 = cliente.post("/patrones/rankear", json=cuerpo)
+    etag = r1.headers["etag"]
+    assert cliente.post("/patrones/rankear", json=cuerpo, headers={"If-None-Match": etag}).status_code == 304
+
+    # lo que hace la ingesta al insertar: la generación cambia y el ETag anterior ya no vale
+    cache_respuestas.invalidar("invalidacion", "5m")
+    r2 = cliente.post("/patrones/rankear", json=cuerpo, headers={"If-None-Match": etag})
+    assert r2.status_code == 200
+    assert r2.headers["x-cache"] == "MISS"
+    assert r2.headers["etag"] != etag
+    assert r2.json() == r1.json()
+    assert cliente.post("/patrones/rankear", json=cuerpo, headers={"If-None-Match": r2.headers["etag"]}).status_code == 304
+
+    # otro par no se entera
+    otro = cliente.post("/patrones/rankear", json={**cuerpo, "mercado": "btc-updown"})
+    cache_respuestas.invalidar("invalidacion", "5m")
+    assert cliente.post("/patrones/rankear", json={**cuerpo, "mercado": "btc-updown"},
+                        headers={"If-None-Match": otro.headers["etag"]}).status_code == 304
@@ -0,0 +1,36 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.coincidencias import IndiceOcurrencias
+
+
+def _contar_ingenuo(colores, patron, lo, hi):
+    """(verdes, rojas) de las velas resultado i con el patrón completo dentro de [lo, hi)."""
+    L = len(patron)
+    v = r = 0
+    for i in range(lo + L, hi):
+        if "".join(colores[i - L:i]) == patron:
+            if colores[i] == "V":
+                v += 1
+            else:
+                r += 1
+    return v, r
+
+
+@pytest.mark.parametrize("patron", ["V", "RV", "VVR", "RRRR", "VRVRV"])
+def test_indice_cuenta_igual_que_recorrer_el_slice(patron):
+    rnd = random.Random(11)
+    colores = [rnd.choice("VR") for _ in range(600)]
+    ind = IndiceOcurrencias.construir(colores, patron)
+
+    slices = [(0, len(colores)), (0, 0), (5, 5), (len(colores) - 3, len(colores))]
+    slices += [tuple(sorted(rnd.sample(range(len(colores) + 1), 2))) for _ in range(60)]
+    for lo, hi in slices:
+        assert ind.contar(lo, hi) == _contar_ingenuo(colores, patron, lo, hi)
+
+    lo = np.array([s[0] for s in slices], dtype=np.int64)
+    hi = np.array([s[1] for s in slices], dtype=np.int64)
+    a, b = ind.tramos(lo, hi)
+    assert [ind.tramo(int(x), int(y)) for x, y in zip(lo, hi)] == list(zip(a.tolist(), b.tolist()))
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from conftest import N, PASO, T0
+
+from app.comparar import comparar_lote, comparar_rango, evolucion_patron
+from app.db import SesionLocal
+from app.utils_time import utc_naive_a_seg
+
+PATRONES = ["VV", "RV", "VRR", "RRRV", "VVRVR", "X", ""]
+
+
+@pytest.fixture
+def db(colores):
+    db = SesionLocal()
+    yield db
+    db.close()
+
+
+def _contar_ingenuo(colores, patron, lo, hi):
+    """(verdes, rojas, índices de la última vela del patrón) con el patrón y su resultado en [lo, hi)."""
+    L = len(patron)
+    v = r = 0
+    ultimas = []
+    for i in range(lo + L, hi):
+        if "".join(colores[i - L:i]) == patron:
+            v += colores[i] == "V"
+            r += colores[i] == "R"
+            ultimas.append(i - 1)
+    return v, r, ultimas
+
+
+@pytest.mark.parametrize("a,b", [(0, N - 1), (17, 203), (250, 260)])
+def test_comparar_lote_igual_al_conteo_ingenuo(db, colores, a, b):
+    inicio, fin = T0 + PASO * a, T0 + PASO * b
+    filas = comparar_lote(db, "btc-updown", "5m", inicio, fin, [(p, None) for p in PATRONES])
+
+    for patron, fila in zip(PATRONES, filas):
+        valido = patron != "" and set(patron) <= {"V", "R"}
+        v, r, ultimas = _contar_ingenuo(colores, patron, a, b + 1) if valido else (0, 0, [])
+        assert (fila["verdes"], fila["rojas"], fila["muestras"]) == (v, r, v + r)
+        if v + r:
+            assert fila["ultima_vez_utc"].replace(tzinfo=None) == T0 + PASO * ultimas[-1]
+            assert fila["direccion"] == ("V" if v >= r else "R")
+        if v + r >= 2:
+            assert fila["aparece_cada_seg"] == int((ultimas[-1] - ultimas[0]) * PASO.total_seconds() / (v + r - 1))
+        if patron in ("VV", "VRR"):
+            # mismo criterio que el índice de ocurrencias de comparar_rango
+            uno = comparar_rango(db, "btc-updown", "5m", inicio, fin, patron, None)
+            assert {k: fila[k] for k in uno} == uno
+
+
+@pytest.mark.parametrize("patron,direccion", [("VV", "V"), ("RVR", "R"), ("VRRV", None)])
+def test_evolucion_igual_a_contar_cada_ventana(db, colores, patron, direccion):
+    inicio, fin = T0 + timedelta(minutes=3), T0 + PASO * (N - 1)
+    ventana_seg, paso_seg = 4 * 3600, 1800
+    res = evolucion_patron(db, "btc-updown", "5m", patron, direccion, inicio, fin, ventana_seg, paso_seg)
+
+    if direccion is None:
+        v, r, _ = _contar_ingenuo(colores, patron, 1, N)
+        direccion = "V" if v >= r else "R"
+    assert res["direccion"] == direccion
+
+    # vela i cierra en t0 + i * paso: la ventana [t, t + ventana] son las velas ceil((t - t0) / paso) ..
+    t0, paso = utc_naive_a_seg(T0), int(PASO.total_seconds())
+    esperado = []
+    for t in res["inicios"].tolist():
+        lo = -(-(t - t0) // paso)
+        hi = (t + ventana_seg - t0) // paso + 1
+        esperado.append(_contar_ingenuo(colores, patron, max(lo, 0), min(hi, N))[:2])
+    assert len(esperado) == (int((fin - inicio).total_seconds()) - ventana_seg) // paso_seg + 1
+    assert res["verdes"].tolist() == [v for v, _ in esperado]
+    assert res["rojas"].tolist() == [r for _, r in esperado]
+    exitos = res["verdes"] if direccion == "V" else res["rojas"]
+    with np.errstate(invalid="ignore"):
+        np.testing.assert_array_equal(res["efectividad"], exitos / res["muestras"])
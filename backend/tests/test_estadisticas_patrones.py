@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import pytest
+from conftest import PASO, T0, sembrar, vela
+
+from app.cache_velas import cache_velas, limites_rango
+from app.db import SesionLocal
+from app.estadisticas_patrones import refrescar_insercion, rankear_rango
+from app.models import DiaPatrones
+from app.patrones import ranking_con_tiempos
+
+DIA = 288  # velas de 5m por día
+N_AGREGADOS = 4 * DIA + 40
+
+
+@pytest.fixture
+def db(colores):
+    db = SesionLocal()
+    yield db
+    db.close()
+
+
+def _directo(db, mercado, inicio, fin, **kw):
+    """El mismo ranking contando directo sobre todas las velas del rango."""
+    serie = cache_velas.obtener(db, mercado, "5m")
+    lo, hi = limites_rango(serie.ts, inicio, fin)
+    return ranking_con_tiempos(colores=serie.colores[lo:hi], fin_ts_list=serie.ts[lo:hi], **kw).filas()
+
+
+def _rango(db, mercado, inicio, fin, **kw):
+    return rankear_rango(db, mercado=mercado, intervalo="5m", inicio=inicio, fin=fin, **kw).filas()
+
+
+def _sin_ahora(filas):
+    # desde_ultima_seg depende de la hora de cada llamada
+    return [f[:8] for f in filas]
+
+
+@pytest.mark.parametrize("orden", ["efectividad", "reciente"])
+def test_agregados_diarios_igual_al_conteo_directo(db, orden):
+    mercado = f"agregados-{orden}"
+    sembrar(mercado, n=N_AGREGADOS, semilla=4)
+    kw = dict(longitud_min=2, longitud_max=8, min_muestras=3, orden=orden)
+    inicio, fin = T0 + timedelta(hours=7, minutes=2), T0 + PASO * (N_AGREGADOS - 5)
+
+    primera = _rango(db, mercado, inicio, fin, **kw)
+    assert db.query(DiaPatrones).filter(DiaPatrones.mercado == mercado).count() >= 2
+    # la segunda vez los días internos salen de estadisticas_patron_dia
+    segunda = _rango(db, mercado, inicio, fin, **kw)
+    directo = _directo(db, mercado, inicio, fin, **kw)
+    assert _sin_ahora(primera) == _sin_ahora(segunda) == _sin_ahora(directo)
+
+
+def test_insercion_tardia_recalcula_los_dias(db):
+    mercado = "agregados-tardia"
+    hueco = 2 * DIA + 100
+    colores = sembrar(mercado, n=N_AGREGADOS, semilla=6, omitir={hueco})
+    kw = dict(longitud_min=2, longitud_max=6, min_muestras=2)
+    inicio, fin = T0, T0 + PASO * N_AGREGADOS
+    _rango(db, mercado, inicio, fin, **kw)
+
+    db.add(vela(mercado, "5m", hueco, colores[hueco]))
+    db.commit()
+    fin_ts = T0 + PASO * hueco
+    cache_velas.notificar_insercion(mercado, "5m", fin_ts)
+    assert refrescar_insercion(db, mercado, "5m", fin_ts, fin_ts) >= 1
+
+    assert _sin_ahora(_rango(db, mercado, inicio, fin, **kw)) == _sin_ahora(_directo(db, mercado, inicio, fin, **kw))
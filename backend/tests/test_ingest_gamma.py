@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import httpx
+
+from app.ingest_gamma import ClienteGamma
+
+
+def _cliente(respuestas, **kw) -> ClienteGamma:
+    async def _responder(request):
+        await asyncio.sleep(0.01)
+        return respuestas(request)
+
+    kw = {"tasa": 0, "http2": False, **kw}
+    return ClienteGamma("http://gamma.test", transport=httpx.MockTransport(_responder), **kw)
+
+
+def test_se_usa_desde_varios_event_loops():
+    # paralelo=1 fuerza a esperar el semáforo (y el lock del limitador) en cada loop
+    cliente = _cliente(lambda r: httpx.Response(200, json=[]), paralelo=1, tasa=1000, rafaga=1)
+
+    async def _rafaga():
+        return [r.status_code for r in await asyncio.gather(*(cliente.get("/markets", []) for _ in range(3)))]
+
+    assert asyncio.run(_rafaga()) == [200] * 3
+    assert asyncio.run(_rafaga()) == [200] * 3
+    assert cliente.paginas == 6
+
+
+def test_solo_las_2xx_cuentan_como_pagina():
+    codigos = iter([422, 200])
+    cliente = _cliente(lambda r: httpx.Response(next(codigos), json=[]))
+
+    async def _dos():
+        return [(await cliente.get("/markets", [])).status_code for _ in range(2)]
+
+    assert asyncio.run(_dos()) == [422, 200]
+    assert cliente.paginas == 1
+
+
+def test_retry_after_acotado():
+    codigos = iter([429, 200])
+
+    def _responder(request):
+        codigo = next(codigos)
+        return httpx.Response(codigo, json=[], headers={"Retry-After": "3600"} if codigo == 429 else {})
+
+    cliente = _cliente(_responder, reintentos=2, backoff_seg=0.05)
+    t = time.perf_counter()
+    assert asyncio.run(cliente.get("/markets", [])).status_code == 200
+    assert time.perf_counter() - t < 1.0
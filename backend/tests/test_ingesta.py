@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.ingesta as ingesta
+from app.db import SesionLocal
+
+
+@pytest.fixture
+def pedidas(monkeypatch, colores):
+    out = []
+
+    async def _registrar(**kw):
+        out.append(kw)
+        return
+        yield
+
+    monkeypatch.setattr(ingesta, "paginas_markets", _registrar)
+    return out
+
+
+def _asegurar(servicio, monkeypatch):
+    monkeypatch.setattr(ingesta, "servicio_ingesta", servicio)
+    ahora = datetime.now(timezone.utc)
+    db = SesionLocal()
+    try:
+        asyncio.run(ingesta.asegurar_datos_en_rango(
+            db, mercado="cola-worker", intervalo="5m", inicio=ahora - timedelta(minutes=30), fin=ahora,
+        ))
+    finally:
+        db.close()
+
+
+def test_cola_del_worker_no_se_pide_a_gamma(pedidas, monkeypatch):
+    # INGESTA_EN_API=false (conftest) y el par configurado: la cola la mantiene el worker,
+    # aunque su tarea no corra en este proceso
+    _asegurar(ingesta.ServicioIngesta([("cola-worker", "5m")], bloques_lookback=12, retraso_seg=30), monkeypatch)
+    assert pedidas == []
+
+
+def test_par_sin_worker_pide_la_cola(pedidas, monkeypatch):
+    _asegurar(ingesta.ServicioIngesta([], bloques_lookback=12, retraso_seg=30), monkeypatch)
+    assert pedidas
+
+
+def test_en_la_api_sin_tarea_corriendo_pide_la_cola(pedidas, monkeypatch):
+    # INGESTA_EN_API=true: la cola solo la mantiene la tarea de este proceso, si corre
+    monkeypatch.setattr(ingesta.ajustes, "INGESTA_EN_API", True)
+    _asegurar(ingesta.ServicioIngesta([("cola-worker", "5m")], bloques_lookback=12, retraso_seg=30), monkeypatch)
+    assert pedidas
+
+
+def test_tramo_cortado_en_max_pages_registra_lo_cubierto(monkeypatch, colores):
+    # 10 series por slot de 5m en 6 h: 720 mercados, más de una página de 500 por consulta
+    from app.cobertura import huecos
+    from app.models import Vela
+
+    t0 = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    slots = 72
+    markets = [
+        {
+            "id": str(s * 10 + k), "slug": f"{'ocupado' if k == 0 else f'otra{k}'}-5m-{s}",
+            "endDate": (t0 + timedelta(minutes=5 * s)).isoformat().replace("+00:00", "Z"),
+            "outcomes": '["Up", "Down"]', "outcomePrices": '["1", "0"]',
+        }
+        for s in range(slots) for k in range(10)
+    ]
+
+    async def _paginas(*, limit, max_pages, end_date_min, end_date_max, order, ascending, **kw):
+        assert (order, ascending) == ("endDate", False)
+        fin = lambda m: datetime.fromisoformat(m["endDate"].replace("Z", "+00:00"))
+        sel = sorted((m for m in markets if end_date_min <= fin(m) <= end_date_max), key=fin, reverse=True)
+        for p in range(max_pages):
+            pagina = sel[p * limit:(p + 1) * limit]
+            if pagina:
+                yield pagina
+            if len(pagina) < limit:
+                return
+
+    monkeypatch.setattr(ingesta, "paginas_markets", _paginas)
+    inicio, fin = t0, t0 + timedelta(minutes=5 * (slots - 1))
+    db = SesionLocal()
+    try:
+        def _asegurar():
+            asyncio.run(ingesta.asegurar_datos_en_rango(
+                db, mercado="ocupado", intervalo="5m", inicio=inicio, fin=fin, max_pages=1, incluir_cola=False,
+            ))
+            return huecos(db, "ocupado", "5m", inicio, fin, datetime(2100, 1, 1))
+
+        faltan = _asegurar()
+        # la primera página cubre los 50 slots más nuevos; solo falta lo anterior
+        assert len(faltan) == 1 and faltan[0][0] == inicio.replace(tzinfo=None)
+        assert faltan[0][1] == (t0 + timedelta(minutes=5 * 22, seconds=1)).replace(tzinfo=None)
+        assert _asegurar() == []
+        assert db.query(Vela).filter(Vela.mercado == "ocupado").count() == slots
+    finally:
+        db.close()
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from app.patrones import codificar_cursor, leer_cursor, ranking_con_tiempos
+
+
+def _colores(n: int, semilla: int) -> list:
+    rnd = random.Random(semilla)
+    return [rnd.choice("VR") for _ in range(n)]
+
+
+def _ranking_ingenuo(colores, longitud_min, longitud_max, min_muestras, alpha, orden):
+    """Cuenta cada ventana por separado con un dict y ordena con sorted."""
+    conteos = {}
+    for L in range(longitud_min, longitud_max + 1):
+        for i in range(L, len(colores)):
+            c = conteos.setdefault("".join(colores[i - L:i]), [0, 0, i - 1, i - 1])
+            c[0 if colores[i] == "V" else 1] += 1
+            c[3] = i - 1
+    filas = []
+    for patron, (v, r, primero, ultimo) in conteos.items():
+        n = v + r
+        if n < min_muestras:
+            continue
+        pv = (v + alpha) / (n + 2 * alpha)
+        pr = (r + alpha) / (n + 2 * alpha)
+        efect = pv if pv >= pr else pr
+        clave = {
+            "efectividad": (-efect, -n, len(patron), primero),
+            "muestras": (-n, -efect, len(patron), primero),
+            "reciente": (-ultimo, -efect, -n, len(patron), primero),
+        }[orden]
+        filas.append((clave, (patron, "V" if pv >= pr else "R", efect, n, v, r)))
+    return [f for _, f in sorted(filas)]
+
+
+def _seis(filas):
+    return [f[:6] for f in filas]
+
+
+@pytest.mark.parametrize("orden", ["efectividad", "muestras", "reciente"])
+@pytest.mark.parametrize("alpha", [0.0, 1.0])
+def test_ranking_igual_al_conteo_ingenuo(orden, alpha):
+    colores = _colores(2000, semilla=3)
+    ranking = ranking_con_tiempos(
+        colores=colores, fin_ts_list=None, longitud_min=2, longitud_max=7,
+        min_muestras=5, alpha=alpha, orden=orden,
+    )
+    esperado = _ranking_ingenuo(colores, 2, 7, 5, alpha, orden)
+    assert ranking.candidatos == len(esperado)
+    assert _seis(ranking.filas()) == esperado
+
+
+@pytest.mark.parametrize("orden", ["efectividad", "muestras", "reciente"])
+def test_paginas_por_cursor_igual_al_ranking_completo(orden):
+    colores = _colores(1500, semilla=5)
+    kw = dict(colores=colores, fin_ts_list=None, longitud_min=2, longitud_max=6, min_muestras=3, orden=orden)
+    completo = ranking_con_tiempos(**kw).filas()
+
+    paginas, despues_de = [], None
+    while True:
+        pagina = ranking_con_tiempos(**kw, limite=7, despues_de=despues_de)
+        paginas.extend(pagina.filas())
+        if not pagina.hay_mas:
+            break
+        # la clave viaja en el cursor: ida y vuelta por JSON
+        orden_cursor, despues_de = leer_cursor(codificar_cursor(orden, pagina.clave(len(pagina) - 1)))
+        assert orden_cursor == orden
+    assert paginas == completo
+
+
+def test_cursor_invalido():
+    with pytest.raises(ValueError):
+        leer_cursor("no-es-un-cursor")
+    with pytest.raises(ValueError):
+        leer_cursor(codificar_cursor("efectividad", [0.5, 1]))
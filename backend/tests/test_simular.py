@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.barrido import evaluar_patrones
+from app.coincidencias import a_bits
+from app.simular import simular_vectorizado
+
+
+def _simular_ingenuo(colores, patron, direccion, banca0, stake, payout, reinvertir):
+    """Trade por trade, como la versión original con bucle."""
+    banca, pico, max_dd, bancas = banca0, banca0, 0.0, []
+    for i in range(len(patron), len(colores)):
+        if "".join(colores[i - len(patron):i]) != patron:
+            continue
+        apuesta = stake * banca / banca0 if reinvertir else stake
+        banca += apuesta * payout if colores[i] == direccion else -apuesta
+        if reinvertir:
+            banca = max(0.0, banca)
+        pico = max(pico, banca)
+        max_dd = max(max_dd, pico - banca)
+        bancas.append(banca)
+    return bancas, max_dd
+
+
+@pytest.mark.parametrize("reinvertir", [False, True])
+@pytest.mark.parametrize("patron,direccion,stake", [("VV", "V", 10.0), ("RVR", "R", 50.0), ("VRRV", "V", 1200.0)])
+def test_simular_igual_al_bucle(reinvertir, patron, direccion, stake):
+    rnd = random.Random(7)
+    colores = [rnd.choice("VR") for _ in range(3000)]
+    res = simular_vectorizado(
+        colores=colores, patron=patron, direccion=direccion, banca0=1000.0, stake=stake, payout=0.85,
+        reinvertir=reinvertir,
+    )
+    bancas, max_dd = _simular_ingenuo(colores, patron, direccion, 1000.0, stake, 0.85, reinvertir)
+    np.testing.assert_allclose(res.banca, bancas, rtol=1e-9, atol=1e-9)
+    assert res.max_drawdown == pytest.approx(max_dd, rel=1e-9, abs=1e-9)
+    assert res.banca_fin == pytest.approx(bancas[-1], rel=1e-9, abs=1e-9)
+
+
+def test_barrido_distingue_reinvertir():
+    rnd = random.Random(3)
+    bits = a_bits([rnd.choice("VR") for _ in range(2000)])
+    filas = evaluar_patrones(bits, ["VV", "VRV"], ["V"], 1000.0, [25.0], [0.9], [True, False])
+    for fijo, compuesto in zip(*(iter([f for f in filas if f["reinvertir"] is r]) for r in (False, True))):
+        assert (fijo["patron"], fijo["trades"]) == (compuesto["patron"], compuesto["trades"])
+        assert fijo["banca_fin"] != compuesto["banca_fin"]
@@ -21,13 +21,20 @@ async function proxy(req: NextRequest, ctx: { params: { path?: string[] } }) {
     cache: "no-store",
   };
 
+  const t0 = performance.now();
   const res = await fetch(target, init);
+  const body = await res.arrayBuffer();
+  const proxyMs = performance.now() - t0;
 
   const outHeaders = new Headers(res.headers);
-  // opcional: limpiar headers conflictivos
+  // opcional: limpiar headers conflictivos (fetch ya descomprimió el cuerpo gzip/br)
   outHeaders.delete("content-encoding");
+  outHeaders.delete("content-length");
+  // desglose por etapa de la API (Server-Timing) + el salto del proxy, visible en DevTools
+  const timing = res.headers.get("server-timing");
+  outHeaders.set("server-timing", `${timing ? timing + ", " : ""}proxy;dur=${proxyMs.toFixed(1)}`);
 
-  return new Response(await res.arrayBuffer(), {
+  return new Response(body, {
     status: res.status,
     headers: outHeaders,
   });